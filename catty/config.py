@@ -7,8 +7,14 @@
 
 # 当读取队列为满或空时的等待时间
 LOAD_QUEUE_INTERVAL = 1
-# SELECTOR扫描一次的时间间隔
+# 调度器检查待启动爬虫的时间间隔
 SELECTOR_INTERVAL = 1
+# SELECTOR检查各爬虫令牌桶的时间间隔(秒)，爬虫速度可为小数(如0.3个请求/秒)
+SELECTOR_TICK = 0.01
+# SELECTOR统计实际发出速度的时间间隔(秒)
+SELECTOR_STATS_INTERVAL = 10
+# 调度器检查重试延时队列(Catty:Retry)中到期Task的时间间隔
+RETRY_PROMOTE_INTERVAL = 1
 
 NUM_OF_PARSER_MAKE_TASK = 5
 NUM_OF_SCHEDULER_MAKE_TASK = 5
@@ -17,13 +23,46 @@ NUM_OF_SCHEDULER_MAKE_TASK = 5
 SPIDER_DEFAULT = {
     # 默认速度
     'SPEED': 1,
+    # 公平调度时分得的Downloader份额(权重/有Task的爬虫的权重之和)，见QUEUE['FAIR']
+    'WEIGHT': 1,
     # BloomFilter的默认种子
     'SEEDS': ["HELLO", "WORLD", "CATTY", "PYTHON", "APPLE", "THIS", "THAT", "MY", "HI", "NOT"],
     # BloomFilter的分块
     'BLOCKNUM': 1,
+    # 新建BloomFilter的哈希版本，1:每个种子一次md5，2:双重哈希(只计算一次md5)，3:双重哈希，用crc32选择分块。
+    # 已有的BloomFilter沿用其原版本
+    'HASH_VERSION': 3,
+    # BloomFilter分块所在的Redis节点[(host, port, db), ...]，分块按一致性哈希分布，空则使用本机Redis
+    # 已有的BloomFilter改变节点时会拒绝启动(迁移走的分块为空)，需先调用migrate_nodes复制分块或clean重建
+    # 仅用于分块的RedisBloomFilter，mmap、可扩展及时间窗口的BloomFilter设置此项会报错
+    'BLOOM_NODES': [],
+    # 本地缓存最近加入BloomFilter的tid数量，命中则不再查询Redis，0为不使用
+    'LOCAL_CACHE_SIZE': 100000,
+    # 去重后端，'redis'或'mmap'(单机部署，BloomFilter保存在PERSISTENCE['DUMP_PATH']/bloomfilter下的文件中)
+    'DUPE_FILTER_BACKEND': 'redis',
+    # mmap BloomFilter的预计元素数量(未设置BLOOM_CAPACITY时使用)，1千万个元素的文件约为18MB
+    'MMAP_BLOOM_CAPACITY': 10000000,
+    # 可扩展BloomFilter的预计元素数量，写满后自动增加分片，0为使用固定大小的BloomFilter
+    'BLOOM_CAPACITY': 0,
+    # 可扩展BloomFilter的目标误判率
+    'BLOOM_ERROR_RATE': 0.001,
+    # 去重的时间窗口(秒)，只过滤窗口内出现过的请求，0为永久去重。可被meta['dupe_window']覆盖
+    'DUPE_WINDOW': 0,
+    # 时间窗口分为多少代，每代一个BloomFilter，过期自动删除
+    'DUPE_WINDOW_GENERATIONS': 4,
+    # 每代BloomFilter预计的元素数量
+    'DUPE_WINDOW_CAPACITY': 1000000,
     'DUPE_FILTER': False,
     'RETRY': 0,
-    'RETRY_WAIT': 3
+    'RETRY_WAIT': 3,
+    # 重试策略，按异常类名、'exception'、状态码('429')、状态码类别('5xx')、'default'的顺序匹配规则。
+    # 第n次重试的等待时间为base*factor**n(base默认为RETRY_WAIT)，最大为max_delay，并随机减少最多jitter比例；
+    # 有Retry-After头部时至少等待其时间。retry为该规则的最大重试次数(默认为RETRY)，0为不重试。详见catty.libs.retry
+    'RETRY_POLICY': {
+        'default': {'factor': 2, 'max_delay': 300, 'jitter': 0.5},
+        'exception': {'factor': 2, 'max_delay': 60, 'jitter': 0.5},
+        '429': {'base': 10, 'factor': 2, 'max_delay': 600, 'jitter': 0.2},
+    },
 }
 
 # 默认的HTTP请求头部
@@ -48,8 +87,69 @@ NOTSET = 0
 LOG_LEVEL = 10
 # 队列的默认配置
 QUEUE = {
-    # 最大队列长度
-    'MAX_SIZE': 100000
+    # 最大队列长度(高水位)，达到后生产者等待消费者把队列消费到低水位。爬虫的请求队列不受限制
+    'MAX_SIZE': 100000,
+    # 低水位为高水位的比例
+    'LOW_WATERMARK': 0.8,
+    # 按队列名指定(高水位, 低水位)，如{'Catty:Scheduler-Downloader': (10000, 8000)}，(0, 0)为不限制
+    'WATERMARKS': {},
+    # 生产者缓存队列长度的时间(秒)，期间不再查询ZCARD
+    'SIZE_CACHE_TTL': 1,
+    # 批量读写队列时，一次最多移动的Task数
+    'BATCH_SIZE': 100,
+    # 队列为空时阻塞等待新Task(BZPOPMIN，可靠队列为BLPOP '<队列名>:signal'后用Lua脚本出队)，而不是每LOAD_QUEUE_INTERVAL秒轮询一次
+    'BLOCKING_GET': True,
+    # 阻塞等待的超时时间(秒)
+    'BLOCK_TIMEOUT': 5,
+    # Task的序列化方式:'msgpack'(固定字段的紧凑二进制格式，未安装msgpack时退回pickle)或'pickle'
+    'SERIALIZER': 'msgpack',
+    # 序列化后大于该字节数的Task压缩后再存入队列，0为不压缩
+    'COMPRESS_THRESHOLD': 4 * 1024,
+    # 压缩算法:'zlib'或'lz4'(未安装lz4时使用zlib)
+    'COMPRESSION': 'zlib',
+    # 优先级老化:Task每等待一秒提升的优先级，避免低优先级Task被源源不断的高优先级Task饿死。0为不老化。
+    # 入队时计算分数(-优先级+老化速度*入队时间)，出队仍为O(log n)。同一队列的所有进程须使用相同的值
+    'AGING_RATE': 0,
+    # 在Task中记录入队时间，统计出队Task的等待时间分位数(见handler的list_queue_age)
+    'AGE_STATS': False,
+    # 统计等待时间的最近出队Task数
+    'AGE_SAMPLES': 10000,
+    # 可靠队列:出队的Task移入'<队列名>:inflight'，处理完成后确认(ack)才删除，进程崩溃时超时的Task自动放回队列，
+    # 退出时不再需要持久化队列中的Task
+    'RELIABLE': False,
+    # 出队的Task在该秒数内未确认则放回队列，须大于Task的最长处理时间(包括等待域名限速与重试的时间)
+    'VISIBILITY_TIMEOUT': 300,
+    # 检查超时Task的时间间隔(秒)
+    'REQUEUE_INTERVAL': 10,
+    # 进程间队列的后端:'zset'(有序集合)或'stream'(Redis Streams + 消费者组，适合多个Downloader/Parser进程，
+    # 需要Redis 6.2以上，不支持FAIR与AGING_RATE)，'local'为进程内的堆(单机模式，见tests/run_standalone.py，不支持FAIR)
+    'BACKEND': 'zset',
+    # 'stream'后端的优先级分级:每级的最低优先级(降序)，最后一级为其余的Task，高一级为空时才读取低一级
+    'STREAM_PRIORITIES': [10, 0],
+    # 'stream'后端的消费者组
+    'STREAM_GROUP': 'catty',
+    # Scheduler-Downloader队列按爬虫分开，用差额轮询(DRR)按WEIGHT公平出队，避免一个爬虫的大量高优先级Task饿死其他爬虫
+    # 开启或关闭前须先清空Scheduler-Downloader队列，原有的键中剩余的Task不会再被取出
+    'FAIR': False,
+    # 每一轮中权重为1的爬虫最多出队的Task数
+    'FAIR_QUANTUM': 10,
+}
+
+# Response body的外部存储，队列中只传递body的引用
+BODY_STORE = {
+    # ''(不使用),'file'(本地文件，按内容哈希存储)或'redis'(Redis hash)
+    'TYPE': '',
+    # 大于该字节数的body才存入外部存储
+    'MIN_SIZE': 64 * 1024,
+    # 'file'的存储目录
+    'PATH': '../data/body',
+    # 'file'中body的保留时间(秒)，超过后由master_parser定期删除，0为永久保留。须大于Task从下载到解析的最长时间
+    # (持久化的Task保存body本身，不受影响)
+    'FILE_TTL': 24 * 3600,
+    # 检查过期body的时间间隔(秒)
+    'CLEAN_INTERVAL': 600,
+    # 'redis'的hash键名
+    'KEY': 'Catty:Body',
 }
 
 # 持久化的配置
@@ -76,8 +176,18 @@ DOWNLOADER = {
     'CONN_LIMIT': 10000,
     # 单一域名最大并发数
     'LIMIT_PER_HOST': 10000,
-    # 请求完成后强制关闭链接
-    'FORCE_CLOSE': True
+    # 请求完成后强制关闭链接(关闭后可复用Keep-Alive链接)
+    'FORCE_CLOSE': False,
+    # 单一域名每秒最多请求数(令牌桶)，0为不限制
+    'HOST_RATE': 0,
+    # 单一域名同时进行的请求数，0为不限制
+    'HOST_CONCURRENCY': 0,
+    # 所有域名共享的每秒请求数，平均分给活跃的域名(不超过HOST_RATE)，空闲域名的份额由其他域名使用。0为不限制
+    'GLOBAL_RATE': 0,
+    # 指定域名的限制，如{'example.com': {'rate': 1, 'concurrency': 2}}
+    'HOST_LIMITS': {},
+    # 超过该秒数没有请求的域名视为空闲
+    'HOST_IDLE_TIMEOUT': 5,
 }
 
 WEBUI = {
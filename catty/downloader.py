@@ -8,69 +8,95 @@ import asyncio
 import time
 import traceback
 from asyncio import BaseEventLoop
-from functools import partial
+from urllib.parse import urlsplit
 import aiohttp
 
 import catty.config
-from catty.message_queue import AsyncRedisPriorityQueue, get_task, push_task
+from catty.message_queue import AsyncRedisPriorityQueue, AsyncRedisDelayQueue, get_tasks, push_task, \
+    requeue_expired_tasks
+from catty.libs.body_store import get_body_store
+from catty.libs.limiter import HostLimiter, get_host_limiter
 from catty.libs.log import Log
 from catty.libs.request import Request
 from catty.libs.response import Response
+from catty.libs.retry import EXCEPTION_STATUS, get_retry_policy
+from catty.libs.utils import is_handled_status
 
 
 class DownLoader:
+    METHODS = {'GET', 'POST', 'PUT', 'DELETE', 'HEAD', 'OPTIONS', 'PATCH'}
+
     def __init__(self,
                  scheduler_downloader_queue: AsyncRedisPriorityQueue,
                  downloader_parser_queue: AsyncRedisPriorityQueue,
                  loop: BaseEventLoop,
-                 conn_limit: int):
+                 conn_limit: int = catty.config.DOWNLOADER['CONN_LIMIT'],
+                 limit_per_host: int = catty.config.DOWNLOADER['LIMIT_PER_HOST'],
+                 force_close: bool = catty.config.DOWNLOADER['FORCE_CLOSE'],
+                 retry_queue: AsyncRedisDelayQueue = None,
+                 host_limiter: HostLimiter = None):
         """
         :param scheduler_downloader_queue:The redis queue
         :param downloader_parser_queue:The redis queue
         :param loop:EventLoop
         :param conn_limit:Limit of The total number for simultaneous connections.
-        # :param limit_per_host:The limit for simultaneous connections to the same endpoint(host, port, is_ssl).
+        :param limit_per_host:The limit for simultaneous connections to the same endpoint(host, port, is_ssl).
+        :param force_close:Close the connection after each request(disable keep-alive).
+        :param retry_queue:The delay queue of the retry tasks,None to push them back after the delay in their own
+                           asyncio tasks(see push_retry_task_later).
+        :param host_limiter:The rate & concurrency limits per host,default to the HOST_* of DOWNLOADER config.
         """
         self.scheduler_downloader_queue = scheduler_downloader_queue
         self.downloader_parser_queue = downloader_parser_queue
+        self.retry_queue = retry_queue
 
         self.loop = loop
         self.conn_limit = conn_limit
+        self.limit_per_host = limit_per_host
+        self.force_close = force_close
+
+        # shared by all requests,see get_session
+        self.session = None
 
-        # using in conn_limit
+        # number of requests in flight,and the slots of them
         self.count = 0
+        self.semaphore = asyncio.Semaphore(conn_limit, loop=loop)
+        self.host_limiter = host_limiter if host_limiter is not None else get_host_limiter(loop)
+        # bound the requests which wait for their hosts without holding a slot
+        self.parking = asyncio.Semaphore(conn_limit, loop=loop)
         self.logger = Log('Downloader')
 
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Return the shared session.The connector pool is created at the first time and reused by every request."""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.conn_limit,
+                limit_per_host=self.limit_per_host,
+                force_close=self.force_close,
+                verify_ssl=False,
+                loop=self.loop
+            )
+            self.session = aiohttp.ClientSession(connector=connector, loop=self.loop)
+        return self.session
+
+    async def close(self):
+        """Close the shared session and all the keep-alive connections"""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
     async def _request(self, aio_request: Request, loop: BaseEventLoop) -> Response:
         """The real request.It return the Response obj with status 99999 as fail"""
         t_ = time.time()
         self.logger.log_it("Downloading url:{} data:{}".format(aio_request.url, aio_request.data))
+        if aio_request.method not in self.METHODS:
+            self.logger.log_it("Not a vaild method.Request:{}".format(aio_request), level='INFO')
+            return Response(status=-1, body=str("Not a vaild method.Request:{}".format(aio_request)), )
+
         try:
-            async with aiohttp.ClientSession(loop=loop) as session:
-                if aio_request.method == 'GET':
-                    async with session.get(**aio_request.dump_request()) as client:
-                        body = await client.read()
-                elif aio_request.method == 'POST':
-                    async with session.post(**aio_request.dump_request()) as client:
-                        body = await client.read()
-                elif aio_request.method == 'PUT':
-                    async with session.put(**aio_request.dump_request()) as client:
-                        body = await client.read()
-                elif aio_request.method == 'DELETE':
-                    async with session.delete(**aio_request.dump_request()) as client:
-                        body = await client.read()
-                elif aio_request.method == 'HEAD':
-                    async with session.head(**aio_request.dump_request()) as client:
-                        body = await client.read()
-                elif aio_request.method == 'OPTIONS':
-                    async with session.options(**aio_request.dump_request()) as client:
-                        body = await client.read()
-                elif aio_request.method == 'PATCH':
-                    async with session.path(**aio_request.dump_request()) as client:
-                        body = await client.read()
-                else:
-                    self.logger.log_it("Not a vaild method.Request:{}".format(aio_request), level='INFO')
-                    return Response(status=-1, body=str("Not a vaild method.Request:{}".format(aio_request)), )
+            session = await self.get_session()
+            async with session.request(aio_request.method, **aio_request.dump_request()) as client:
+                body = await client.read()
 
                 response = Response(
                     # TODO text accept encoding param to encode the body
@@ -90,61 +116,124 @@ class DownLoader:
         except Exception as e:
             self.logger.log_it("Fail to download url:{} data:{} ErrInfo:{}".format(aio_request.url, aio_request.data,
                                                                                    traceback.format_exc()))
-            response = Response(status=99999, body=str(e), )
+            response = Response(status=EXCEPTION_STATUS, body=str(e), error=type(e).__name__)
 
-        self.count -= 1
         return response
 
-    async def fail_callback(self, task: dict, aio_request: Request):
-        retry = task['meta']['retry']
+    async def fail_callback(self, task: dict, aio_request: Request, response: Response = None):
         retried = task.get('retried', 0)
-        if retry != 0 and retried < retry:
+        delay = get_retry_policy(task['meta']).delay(
+            task['meta'], retried, EXCEPTION_STATUS, response['error'] if response else '')
+        if delay is not None:
             task.update({'retried': retried + 1})
-            self.logger.log_it("Retry url:{} body:{} retried:{}".format(aio_request.url, aio_request.data, retried))
-            # retry wait
-            await asyncio.sleep(task['meta']['retry_wait'], self.loop)
-            await push_task(self.scheduler_downloader_queue, task, self.loop)
+            self.logger.log_it("Retry url:{} body:{} retried:{} delay:{:.1f}".format(
+                aio_request.url, aio_request.data, retried, delay))
+            if self.retry_queue is not None:
+                # the scheduler will push it back when the delay passed
+                await push_task(self.retry_queue, (delay, task), self.loop)
+            else:
+                # don't hold the slot & the host while waiting
+                self.loop.create_task(self.push_retry_task_later(task, delay))
+
+    async def push_retry_task_later(self, task: dict, delay: float):
+        """
+        Push the retry task back after delay without a retry queue(the standalone mode).
+        The task is lost if the process exit while waiting.
+        """
+        await asyncio.sleep(delay, loop=self.loop)
+        # the downloader is the consumer of it,never wait for itself
+        await push_task(self.scheduler_downloader_queue, task, self.loop, block=False)
 
     async def success_callback(self, task: dict, response: Response):
+        body_store = get_body_store(loop=self.loop)
+        # only the bodies to be parsed,the parser never read the others
+        if body_store and is_handled_status(task, response.status) and \
+                isinstance(response.body, bytes) and len(response.body) >= catty.config.BODY_STORE['MIN_SIZE']:
+            # only the reference travel through the queue
+            await response.offload_body(body_store)
         task.update({'response': response})
         await push_task(self.downloader_parser_queue, task, self.loop)
 
-    async def request(self, aio_request: Request, task: dict):
-        """request,update the task and put it in the queue"""
-        response = await self._request(aio_request, self.loop)
-        # TODO:99999 means catch exception during request(or we should uniform the status code and write a doc)
-        if response['status'] != 99999:
-            # success
-            await self.success_callback(task, response)
-        elif response['status'] == -1:
-            # -1 means ignore this status
-            pass
-        else:
-            # fail
-            await self.fail_callback(task, aio_request)
-
-    async def start_crawler(self, connector):
-        """get item from queue and crawl it & push it to queue at last"""
-        task = await get_task(self.scheduler_downloader_queue)
-        if task is not None:
-            self.count += 1
-            aio_request = task['request']
-            self.loop.create_task(self.request(aio_request=aio_request, task=task))
+    async def wait_host(self, host: str):
+        """Wait for the host limiter.The slot is given to the requests of other hosts while waiting."""
+        if self.host_limiter.try_acquire(host):
+            return
 
-            # The limit of concurrent request
-            while self.count > self.conn_limit:
-                await asyncio.sleep(0.5, loop=self.loop)
+        parked = False
+        try:
+            async with self.parking:
+                self.count -= 1
+                self.semaphore.release()
+                parked = True
+                await self.host_limiter.acquire(host)
+        finally:
+            if parked:
+                # out of parking,or the parked requests and the ones waiting for parking hold each other
+                await self.semaphore.acquire()
+                self.count += 1
 
-            self.loop.create_task(self.start_crawler(connector))
-        else:
-            # If the queue is empty,wait and try again.
-            await asyncio.sleep(catty.config.LOAD_QUEUE_INTERVAL, loop=self.loop)
-            self.loop.create_task(self.start_crawler(connector))
+    async def request(self, aio_request: Request, task: dict):
+        """request,update the task and put it in the queue.Release the slot & ack the task at last whatever happen."""
+        host = None
+        try:
+            if self.host_limiter is not None:
+                hostname = urlsplit(str(aio_request.url)).hostname or ''
+                await self.wait_host(hostname)
+                host = hostname
+            response = await self._request(aio_request, self.loop)
+            # TODO:99999 means catch exception during request(or we should uniform the status code and write a doc)
+            if response['status'] == -1:
+                # -1 means ignore this status
+                pass
+            elif response['status'] != EXCEPTION_STATUS:
+                # success
+                await self.success_callback(task, response)
+            else:
+                # fail
+                await self.fail_callback(task, aio_request, response)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            if host is not None:
+                self.host_limiter.release(host)
+            self.count -= 1
+            self.semaphore.release()
+            try:
+                await self.scheduler_downloader_queue.ack(task)
+            except Exception:
+                traceback.print_exc()
+
+    async def start_crawler(self):
+        """
+        get items from queue and crawl them & push them to queue at last.
+        Each request hold a slot of the semaphore,so a freed slot is refilled as soon as the request done.
+        """
+        while True:
+            # The limit of concurrent request
+            await self.semaphore.acquire()
+            # pop as many tasks as the free slots in one round trip
+            n = min(catty.config.QUEUE['BATCH_SIZE'], self.conn_limit - self.count)
+            tasks = await get_tasks(self.scheduler_downloader_queue, n, block=catty.config.QUEUE['BLOCKING_GET'])
+            if not tasks:
+                self.semaphore.release()
+                if not catty.config.QUEUE['BLOCKING_GET']:
+                    # If the queue is empty,wait and try again.
+                    await asyncio.sleep(catty.config.LOAD_QUEUE_INTERVAL, loop=self.loop)
+                continue
+
+            for i, task in enumerate(tasks):
+                if i:
+                    # never block,there are at least n free slots
+                    await self.semaphore.acquire()
+                self.count += 1
+                self.loop.create_task(self.request(aio_request=task['request'], task=task))
 
     def run(self):
         try:
-            crawler = partial(self.start_crawler,connector=aiohttp.TCPConnector(verify_ssl=False))
-            self.loop.create_task(crawler())
+            self.loop.create_task(self.start_crawler())
+            self.loop.create_task(requeue_expired_tasks([self.scheduler_downloader_queue], self.loop))
             self.loop.run_forever()
         except KeyboardInterrupt:
             self.logger.log_it("Bye!", level='INFO')
+        finally:
+            self.loop.run_until_complete(self.close())
@@ -4,6 +4,7 @@
 # Author: Vincent<vincent8280@outlook.com>
 #         http://blog.vincentzhong.cn
 # Created on 2017/4/7 21:24
+import asyncio
 from typing import TYPE_CHECKING
 
 import catty.config
@@ -11,6 +12,7 @@ import catty.config
 from catty.libs.log import Log
 from catty.libs.utils import *
 from catty.libs.rpc import ThreadXMLRPCServer, XMLRPCClient
+from catty.message_queue import AsyncRedisStreamQueue
 from catty import DOWNLOADER_PARSER, PARSER_SCHEDULER, STATUS_CODE
 
 if TYPE_CHECKING:
@@ -22,8 +24,10 @@ class BaseHandleClient:
     """ To connect with WebUI-Server and Scheduler&Parser"""
     logger = Log('HandlerClient')
     scheduler_handler_name = {'pause', 'start', 'run', 'stop', 'update_spider', 'delete_spider', 'list_spiders',
-                              'list_speed', 'set_speed', 'clean_request_queue', 'clean_dupe_filter'}
-    parser_handler_name = {'list_count', 'pause', 'start', 'run', 'stop', 'update_spider', 'delete_spider'}
+                              'list_speed', 'list_speed_stats', 'set_speed', 'clean_request_queue',
+                              'clean_dupe_filter', 'list_queue_age', 'list_pending', 'list_compress_stats'}
+    parser_handler_name = {'list_count', 'pause', 'start', 'run', 'stop', 'update_spider', 'delete_spider',
+                           'list_queue_age', 'list_pending', 'list_compress_stats'}
     scheduler_parser_handler_name = scheduler_handler_name & parser_handler_name
 
     def __init__(self):
@@ -89,6 +93,7 @@ class HandlerClient(BaseHandleClient):
                     else:
                         d = {'success_count': (0, 0, 0, 0),
                              'fail_count': (0, 0, 0, 0), }
+                    d.update({'download_count': spiders_count.get(spider_name + '_download', (0, 0, 0, 0))})
 
                     if spider_name in spiders_speed:
                         d.update({'speed': spiders_speed[spider_name]})
@@ -114,12 +119,16 @@ class HandlerMixin:
             'pause': self.handle_pause_spider, 'start': self.handle_start_spider, 'run': self.handle_run_spider,
             'stop': self.handle_stop_spider, 'update_spider': self.handle_update_spider,
             'delete_spider': self.handle_delete_spider, 'list_spiders': self.handle_list_spiders,
-            'list_speed': self.handle_list_speed, 'set_speed': self.handle_set_speed,
-            'clean_request_queue': self.handle_clean_request_queue, 'clean_dupe_filter': self.handle_clean_dupe_filter}
+            'list_speed': self.handle_list_speed, 'list_speed_stats': self.handle_list_speed_stats,
+            'set_speed': self.handle_set_speed,
+            'clean_request_queue': self.handle_clean_request_queue, 'clean_dupe_filter': self.handle_clean_dupe_filter,
+            'list_queue_age': self.handle_list_queue_age, 'list_pending': self.handle_list_pending,
+            'list_compress_stats': self.handle_list_compress_stats}
         self.parser_handler = {
             'list_count': self.handle_count, 'pause': self.handle_pause_spider, 'start': self.handle_start_spider,
             'run': self.handle_run_spider, 'stop': self.handle_stop_spider, 'update_spider': self.handle_update_spider,
-            'delete_spider': self.handle_delete_spider}
+            'delete_spider': self.handle_delete_spider, 'list_queue_age': self.handle_list_queue_age,
+            'list_pending': self.handle_list_pending, 'list_compress_stats': self.handle_list_compress_stats}
 
         self.all_handler = {}
         self.all_handler.update(self.scheduler_handler)
@@ -256,6 +265,33 @@ class HandlerMixin:
         self._logger.log_it("[start_spider]Success spider:{}".format(spider_name))
         return STATUS_CODE.OK, {}
 
+    def handle_list_queue_age(self: "Scheduler", msg) -> tuple:
+        """The waited seconds percentiles of the queues popped by this process,see QUEUE['AGE_STATS']"""
+        if 'scheduler' in self.name:
+            queues = list(self.requests_queue_conn.values()) + [self.parser_scheduler_queue]
+        else:
+            queues = [self.downloader_parser_queue]
+        return STATUS_CODE.OK, {q.name: q.queue_age() for q in queues}
+
+    def handle_list_compress_stats(self: "Scheduler", msg) -> tuple:
+        """The bytes of the tasks put by this process before and after compressing,see QUEUE['COMPRESS_THRESHOLD']"""
+        if 'scheduler' in self.name:
+            queues = [self.scheduler_downloader_queue] + list(self.requests_queue_conn.values())
+        else:
+            queues = [self.parser_scheduler_queue, self.scheduler_downloader_queue]
+        return STATUS_CODE.OK, {q.name: q.compress_stats() for q in queues}
+
+    def handle_list_pending(self: "Scheduler", msg) -> tuple:
+        """The pending tasks of each consumer of the stream queues,see QUEUE['BACKEND']"""
+        if 'scheduler' in self.name:
+            queues = [self.scheduler_downloader_queue, self.parser_scheduler_queue]
+        else:
+            queues = [self.downloader_parser_queue, self.scheduler_downloader_queue]
+        # run in the thread of xmlrpc server
+        return STATUS_CODE.OK, {
+            q.name: asyncio.run_coroutine_threadsafe(q.pending(), self.loop).result(catty.config.QUEUE['BLOCK_TIMEOUT'])
+            for q in queues if isinstance(q, AsyncRedisStreamQueue)}
+
     # ------------------------SCHEDULER_ONLY----------------------------------
 
     def handle_list_spiders(self: "Scheduler", msg) -> tuple:
@@ -271,11 +307,14 @@ class HandlerMixin:
     def handle_list_speed(self: "Scheduler", msg) -> tuple:
         return STATUS_CODE.OK, self.selector.spider_speed
 
+    def handle_list_speed_stats(self: "Scheduler", msg) -> tuple:
+        return STATUS_CODE.OK, self.selector.speed_stats()
+
     def handle_set_speed(self: "Scheduler", msg) -> tuple:
         spider_name = msg.get('spider_name')
         speed = msg['spider_speed']
         if 'scheduler' in self.name:
-            self.selector.update_speed(spider_name, int(speed))
+            self.selector.update_speed(spider_name, float(speed))
         return STATUS_CODE.OK, {}
 
     def handle_clean_request_queue(self: "Scheduler", msg) -> tuple:
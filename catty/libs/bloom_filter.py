@@ -4,15 +4,42 @@
 # Author: Vincent<vincent8280@outlook.com>
 #         http://blog.vincentzhong.cn
 # Created on 2017/4/18 10:38
+import asyncio
+import bisect
 import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import time
+import zlib
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 import aioredis
+
+import catty.config
 from catty.libs.utils import md5string
 
 
 class Hash(object):
-    def __init__(self, size, seed):
+    """
+    version 1:  a salted md5 per seed,each position cost a md5 & a hexdigest
+    version 2:  double hashing(Kirsch-Mitzenmacher),all positions are derived from one md5 digest
+                position_i = (h1 + i * h2) % size
+    version 3:  the positions of version 2,the block is crc32(string) % blockNum instead of int(string, 16) % blockNum
+    The positions & blocks of the versions are different,a filter must use the version it was built with.
+    """
+
+    def __init__(self, size, seed, version=1):
         self.size = size
         self.seed = seed
+        self.version = version
         self.make_hashfunc()
 
     def make_hashfunc(self):
@@ -26,6 +53,8 @@ class Hash(object):
             seed.append(string)
         self.seed = seed
         self.hashfunc = [hashlib.md5(seed) for seed in self.seed]
+        # the seeds only salt the digest in version 2
+        self.salted_hashfunc = hashlib.md5(b''.join(self.seed))
 
     def hash(self, value):
         if isinstance(value, str):
@@ -33,6 +62,9 @@ class Hash(object):
         else:
             value = str(value).encode('utf-8')
 
+        if self.version >= 2:
+            return self.double_hash(value)
+
         ret = []
         for hashfunc in self.hashfunc:
             h = hashfunc.copy()
@@ -41,9 +73,131 @@ class Hash(object):
 
         return ret
 
+    def double_hash(self, value: bytes) -> list:
+        h = self.salted_hashfunc.copy()
+        h.update(value)
+        digest = h.digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        # odd,never be 0
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(len(self.hashfunc))]
+
+    def block(self, value, block_num: int) -> int:
+        """The index of the block which the string belongs to"""
+        if block_num == 1:
+            return 0
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        elif not isinstance(value, bytes):
+            value = str(value).encode('utf-8')
+
+        if self.version >= 3:
+            return zlib.crc32(value) % block_num
+        return int(value, 16) % block_num
+
+
+def optimal_params(capacity: int, error_rate: float, max_bits: int = 1 << 32) -> tuple:
+    """Return (bits,number of hash functions) of a bloom filter holding capacity items at error_rate"""
+    bits = min(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2), max_bits)
+    k = max(1, math.ceil(-math.log(error_rate, 2)))
+    return bits, k
+
+
+def double_hash_positions(value: bytes, bits: int, k: int, salt: bytes = b'') -> list:
+    digest = hashlib.md5(salt + value).digest()
+    h1 = int.from_bytes(digest[:8], 'big')
+    h2 = int.from_bytes(digest[8:], 'big') | 1
+    return [(h1 + j * h2) % bits for j in range(k)]
+
+
+class ConsistentHashRing(object):
+    """Map the keys to the nodes,adding or removing a node only move about 1/n keys"""
+
+    def __init__(self, nodes: list, replicas: int = 64):
+        self.nodes = list(nodes)
+        self.ring = []
+        for node in self.nodes:
+            for i in range(replicas):
+                self.ring.append((self._hash('{}#{}'.format(node, i)), node))
+        self.ring.sort()
+        self.hashes = [h for h, _ in self.ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def get_node(self, key: str):
+        index = bisect.bisect(self.hashes, self._hash(key)) % len(self.ring)
+        return self.ring[index][1]
+
+
+class LocalSeenCache(object):
+    """
+    A bounded LRU set of the strings this process had added to a filter recently.
+    A hit means the string is in the filter,so the filter in redis need not to be asked.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def contain(self, string) -> bool:
+        if string in self.data:
+            self.data.move_to_end(string)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, string):
+        self.data[string] = None
+        self.data.move_to_end(string)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+
+    def stats(self) -> dict:
+        return {'size': len(self.data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
 
 class RedisBloomFilter(object):
-    def __init__(self, loop, key, seeds, host='localhost', port=6379, db=0, blockNum=1):
+    # set all the bits,return 1 if any of them was unset
+    ADD_IF_ABSENT_SCRIPT = """
+    local absent = 0
+    for i = 1, #ARGV do
+        if redis.call('SETBIT', KEYS[1], ARGV[i], 1) == 0 then
+            absent = 1
+        end
+    end
+    return absent
+    """
+
+    # ADD_IF_ABSENT_SCRIPT for many strings,ARGV[1] is the number of bits per string
+    ADD_MANY_SCRIPT = """
+    local k = tonumber(ARGV[1])
+    local result = {}
+    for i = 1, #KEYS do
+        local absent = 0
+        for j = 1, k do
+            if redis.call('SETBIT', KEYS[i], ARGV[1 + (i - 1) * k + j], 1) == 0 then
+                absent = 1
+            end
+        end
+        result[i] = absent
+    end
+    return result
+    """
+
+    def __init__(self, loop, key, seeds, host='localhost', port=6379, db=0, blockNum=1, hash_version=None,
+                 local_cache_size=0, nodes=None):
         """
         When error_rate=0.001(0.1%),100,000,000 data cost 125MB.
         :param loop:
@@ -53,6 +207,15 @@ class RedisBloomFilter(object):
         :param port:
         :param db:
         :param blockNum:
+        :param hash_version:    The version of Hash.None means read it from redis(a filter built before the
+                                version flag is version 1),and use SPIDER_DEFAULT['HASH_VERSION'] for a new filter.
+        :param local_cache_size:The max number of strings in LocalSeenCache,0 to disable it.
+        :param nodes:           A list of (host, port, db),the blocks are spread on them by a ConsistentHashRing.
+                                The version & nodes keys are on the first node,so it should never be changed.
+                                Default to [(host, port, db)].
+                                Adding or removing a node move some blocks to another node,and they start empty
+                                there,so conn refuse an existing filter with another node set.Call migrate_nodes
+                                to copy the blocks,or clean to rebuild the filter.
         """
         self.host = host
         self.port = port
@@ -60,58 +223,667 @@ class RedisBloomFilter(object):
         self.loop = loop
         self.redis_conn = None
 
+        self.nodes = [tuple(node) for node in nodes] if nodes else [(host, port, db)]
+        self.ring = ConsistentHashRing(self.nodes)
+        self.redis_conns = {}
+
         self.bit_size = 1 << 29  # Redis的String类型最大容量为512M，现使用64M
         self.seeds = seeds
         self.key = key
         self.blockNum = blockNum
-        self.hashfunc = Hash(self.bit_size, self.seeds)
+        self.hash_version = hash_version
+        self.hashfunc = Hash(self.bit_size, self.seeds, hash_version or 1)
+        self._script_sha = {}
+        self.local_cache = LocalSeenCache(local_cache_size) if local_cache_size else None
 
     async def conn(self):
         if not self.redis_conn:
-            self.redis_conn = await aioredis.create_redis(
-                (self.host, self.port), db=self.db, loop=self.loop
-            )
+            await self.connect_nodes()
+            await self.check_nodes()
+            self.redis_conn = self.redis_conns[self.nodes[0]]
+            await self.load_hash_version()
         return self.redis_conn
 
+    async def connect_nodes(self, nodes=None):
+        for node in nodes or self.nodes:
+            if node not in self.redis_conns:
+                host, port, db = node
+                self.redis_conns[node] = await aioredis.create_redis((host, port), db=db, loop=self.loop)
+
+    @staticmethod
+    def dump_nodes(nodes) -> str:
+        return json.dumps(sorted([list(node) for node in nodes]))
+
+    async def check_nodes(self):
+        """Raise ValueError if the filter was built with another node set,record the node set of a new filter"""
+        meta_conn = self.redis_conns[self.nodes[0]]
+        nodes_key = self.key + ':nodes'
+        nodes = await meta_conn.get(nodes_key)
+        if nodes is None and await meta_conn.exists(self.key + ':version'):
+            # built before the nodes flag,on one node
+            nodes = self.dump_nodes([(self.host, self.port, self.db)])
+        if nodes is None:
+            await meta_conn.set(nodes_key, self.dump_nodes(self.nodes))
+        elif json.loads(nodes) != json.loads(self.dump_nodes(self.nodes)):
+            raise ValueError(
+                "BloomFilter {} was built on the nodes {},the blocks which move to another node would be empty."
+                "Call migrate_nodes or clean first.".format(self.key, json.loads(nodes)))
+
+    async def migrate_nodes(self, old_nodes: list):
+        """
+        Copy the blocks which move to another node from the ring of old_nodes to the ring of self.nodes,
+        then record the new node set.Nobody should add to the filter during it.
+        """
+        old_nodes = [tuple(node) for node in old_nodes]
+        old_ring = ConsistentHashRing(old_nodes)
+        await self.connect_nodes(old_nodes)
+        await self.connect_nodes()
+
+        for i in range(self.blockNum):
+            name = self.block_name(i)
+            src, dst = old_ring.get_node(name), self.ring.get_node(name)
+            if src == dst:
+                continue
+            block = await self.redis_conns[src].get(name)
+            if block is not None:
+                await self.redis_conns[dst].set(name, block)
+                await self.redis_conns[src].delete(name)
+
+        meta_conn = self.redis_conns[self.nodes[0]]
+        if old_nodes[0] != self.nodes[0]:
+            version = await self.redis_conns[old_nodes[0]].get(self.key + ':version')
+            if version is not None:
+                await meta_conn.set(self.key + ':version', version)
+        await meta_conn.set(self.key + ':nodes', self.dump_nodes(self.nodes))
+
+    def block_name(self, index: int) -> str:
+        return self.key + ':' + str(index)
+
+    def block_conn(self, name: str):
+        """The connection of the node which the block is on"""
+        return self.redis_conns[self.ring.get_node(name)]
+
+    async def load_hash_version(self):
+        """Use the version the filter was built with"""
+        version_key = self.key + ':version'
+        version = self.hash_version or await self.redis_conn.get(version_key)
+        if not version:
+            blocks = [self.block_name(i) for i in range(self.blockNum)]
+            if any(await asyncio.gather(*[self.block_conn(name).exists(name) for name in blocks])):
+                # built before the version flag
+                version = 1
+            else:
+                version = catty.config.SPIDER_DEFAULT['HASH_VERSION']
+        version = int(version)
+        await self.redis_conn.set(version_key, version)
+        if version != self.hashfunc.version:
+            self.hashfunc = Hash(self.bit_size, self.seeds, version)
+
     async def clean(self):
+        if self.local_cache is not None:
+            self.local_cache.clear()
+        await self.connect_nodes()
         for i in range(self.blockNum):
-            key = self.key + ':' + str(i)
+            key = self.block_name(i)
             try:
-                await self.redis_conn.delete(key)
+                await self.block_conn(key).delete(key)
             except:
                 pass
+        # the filter is empty,it can be rebuilt with the newest version
+        version = self.hash_version or catty.config.SPIDER_DEFAULT['HASH_VERSION']
+        try:
+            meta_conn = self.redis_conns[self.nodes[0]]
+            await meta_conn.set(self.key + ':version', version)
+            await meta_conn.set(self.key + ':nodes', self.dump_nodes(self.nodes))
+        except:
+            pass
+        if version != self.hashfunc.version:
+            self.hashfunc = Hash(self.bit_size, self.seeds, version)
 
-    async def is_contain(self, string):
+    def _locate(self, string) -> tuple:
+        """Return the key of the block & the bits of the string"""
         if isinstance(string, str):
             string = string.encode('utf-8')
         else:
             string = str(string).encode('utf-8')
 
-        # m_string = md5string(string)
-        m_string = string
-        ret = 1
-        name = self.key + ':' + str(int(m_string, 16) % self.blockNum)
-        loc = self.hashfunc.hash(m_string)
+        name = self.block_name(self.hashfunc.block(string, self.blockNum))
+        return name, self.hashfunc.hash(string)
+
+    async def _eval(self, script: str, keys: list, args: list, conn=None):
+        """EVALSHA the script,load it at the first time(or the node had flushed it)"""
+        conn = conn or self.redis_conn
+        sha = self._script_sha.get(script)
+        if sha:
+            try:
+                return await conn.evalsha(sha, keys=keys, args=args)
+            except aioredis.ReplyError as e:
+                if not str(e).startswith('NOSCRIPT'):
+                    raise
+        self._script_sha[script] = await conn.script_load(script)
+        return await conn.evalsha(self._script_sha[script], keys=keys, args=args)
+
+    async def is_contain(self, string):
+        if self.local_cache is not None and self.local_cache.contain(string):
+            return True
 
+        name, loc = self._locate(string)
+
+        pipe = self.block_conn(name).pipeline()
+        for i in loc:
+            pipe.getbit(name, i)
+        r = await pipe.execute()
+
+        return True if 0 not in r else False
+
+    async def add(self, string):
+        name, loc = self._locate(string)
+
+        pipe = self.block_conn(name).pipeline()
         for i in loc:
-            a = await self.redis_conn.getbit(name, i)
-            ret = ret & a
-        return True if ret == 1 else False
+            pipe.setbit(name, i, 1)
+        r = await pipe.execute()
+
+        if self.local_cache is not None:
+            self.local_cache.add(string)
+        return True if 1 not in r else False
+
+    async def add_if_absent(self, string) -> bool:
+        """
+        Add the string & return True if it was not in the filter(any of its bits was unset).
+        It is atomic and cost one round trip.
+        """
+        if self.local_cache is not None and self.local_cache.contain(string):
+            return False
+
+        name, loc = self._locate(string)
+        absent = await self._eval(self.ADD_IF_ABSENT_SCRIPT, keys=[name], args=loc, conn=self.block_conn(name)) == 1
+        if self.local_cache is not None:
+            self.local_cache.add(string)
+        return absent
+
+    async def add_many(self, strings: list) -> list:
+        """
+        add_if_absent for many strings in one round trip per node,the nodes are called concurrently.
+        Return a list of bool,True means the string was new.A repeated string in the list is new only once.
+        """
+        result = [False] * len(strings)
+        # the index of strings which are not in local cache
+        index = [i for i, string in enumerate(strings)
+                 if self.local_cache is None or not self.local_cache.contain(string)]
+        if not index:
+            return result
+
+        # node -> (index, keys, args)
+        groups = {}
+        for i in index:
+            name, loc = self._locate(strings[i])
+            group = groups.setdefault(self.ring.get_node(name), ([], [], [len(self.hashfunc.hashfunc)]))
+            group[0].append(i)
+            group[1].append(name)
+            group[2].extend(loc)
+
+        replies = await asyncio.gather(
+            *[self._eval(self.ADD_MANY_SCRIPT, keys=keys, args=args, conn=self.redis_conns[node])
+              for node, (_, keys, args) in groups.items()]
+        )
+        for (group_index, _, _), reply in zip(groups.values(), replies):
+            for i, absent in zip(group_index, reply):
+                result[i] = absent == 1
+                if self.local_cache is not None:
+                    self.local_cache.add(strings[i])
+        return result
+
+
+class ScalableRedisBloomFilter(RedisBloomFilter):
+    """
+    A scalable bloom filter(Almeida et al.) which is sized by the expected items & the error rate.
+    It begin with one slice,and add a slice with growth times capacity & tightening times error rate when the last
+    slice had been filled with its capacity,so the total error rate stay under error_rate.
+    Slice i is the bitmap '<key>:slice:<i>',its items count & the number of slices are in the hash '<key>:meta'.
+    """
+
+    # Check the old slices & add to the last slice,return {status, slices, is_new...}.
+    # status -1 means that the client's number of slices is out of date.The script stop when the last slice
+    # is full,the rest strings should be sent again with the new slice.
+    ADD_MANY_SCRIPT = """
+    local n = tonumber(ARGV[1])
+    local slices = tonumber(redis.call('HGET', KEYS[1], 'slices') or '1')
+    if slices ~= n then
+        return {-1, slices}
+    end
+    local capacity = tonumber(ARGV[2])
+    local count_field = 'count:' .. (n - 1)
+    local count = tonumber(redis.call('HGET', KEYS[1], count_field) or '0')
+    local result = {0, n}
+    local p = 4
+    for s = 1, tonumber(ARGV[3]) do
+        local seen = false
+        for i = 1, n do
+            local k = tonumber(ARGV[p])
+            p = p + 1
+            if not seen then
+                if i < n then
+                    local all = true
+                    for j = 0, k - 1 do
+                        if redis.call('GETBIT', KEYS[i + 1], ARGV[p + j]) == 0 then
+                            all = false
+                            break
+                        end
+                    end
+                    seen = all
+                else
+                    local absent = false
+                    for j = 0, k - 1 do
+                        if redis.call('SETBIT', KEYS[i + 1], ARGV[p + j], 1) == 0 then
+                            absent = true
+                        end
+                    end
+                    seen = not absent
+                end
+            end
+            p = p + k
+        end
+        if seen then
+            table.insert(result, 0)
+        else
+            table.insert(result, 1)
+            count = count + 1
+        end
+        if count >= capacity then
+            redis.call('HSET', KEYS[1], count_field, count)
+            redis.call('HSET', KEYS[1], 'slices', n + 1)
+            result[2] = n + 1
+            return result
+        end
+    end
+    redis.call('HSET', KEYS[1], count_field, count)
+    return result
+    """
+
+    # Redis的String类型最大容量为512M
+    MAX_SLICE_BITS = 1 << 32
+
+    def __init__(self, loop, key, capacity, error_rate, host='localhost', port=6379, db=0, growth=2,
+                 tightening=0.5, local_cache_size=0):
+        """
+        :param capacity:        The expected items of the first slice
+        :param error_rate:      The target false positive rate of the whole filter
+        :param growth:          The capacity of a new slice is growth times of the last one
+        :param tightening:      The error rate of a new slice is tightening times of the last one
+        """
+        super(ScalableRedisBloomFilter, self).__init__(
+            loop, key, [], host=host, port=port, db=db, local_cache_size=local_cache_size)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.meta_key = self.key + ':meta'
+        self.slices = 1
+
+    async def conn(self):
+        if not self.redis_conn:
+            self.redis_conn = await aioredis.create_redis(
+                (self.host, self.port), db=self.db, loop=self.loop
+            )
+            await self.load_slices()
+        return self.redis_conn
+
+    async def load_slices(self):
+        self.slices = int(await self.redis_conn.hget(self.meta_key, 'slices') or 1)
+
+    def slice_params(self, i: int) -> tuple:
+        """Return (capacity,error rate,bits,number of hash functions) of slice i"""
+        capacity = int(self.capacity * self.growth ** i)
+        error_rate = self.error_rate * (1 - self.tightening) * self.tightening ** i
+        bits, k = optimal_params(capacity, error_rate, self.MAX_SLICE_BITS)
+        return capacity, error_rate, bits, k
+
+    def slice_key(self, i: int) -> str:
+        return '{}:slice:{}'.format(self.key, i)
+
+    def _locate_slice(self, value: bytes, i: int) -> list:
+        _, _, bits, k = self.slice_params(i)
+        return double_hash_positions(value, bits, k, str(i).encode('utf-8'))
+
+    @staticmethod
+    def _encode(string) -> bytes:
+        if isinstance(string, str):
+            return string.encode('utf-8')
+        return str(string).encode('utf-8')
+
+    async def clean(self):
+        if self.local_cache is not None:
+            self.local_cache.clear()
+        await self.load_slices()
+        try:
+            await self.redis_conn.delete(self.meta_key, *[self.slice_key(i) for i in range(self.slices)])
+        except:
+            pass
+        self.slices = 1
+
+    async def is_contain(self, string):
+        if self.local_cache is not None and self.local_cache.contain(string):
+            return True
+
+        value = self._encode(string)
+        pipe = self.redis_conn.pipeline()
+        for i in range(self.slices):
+            for position in self._locate_slice(value, i):
+                pipe.getbit(self.slice_key(i), position)
+        r = await pipe.execute()
+
+        index = 0
+        for i in range(self.slices):
+            k = self.slice_params(i)[3]
+            if 0 not in r[index:index + k]:
+                return True
+            index += k
+        return False
 
     async def add(self, string):
+        return await self.add_if_absent(string)
+
+    async def add_if_absent(self, string) -> bool:
+        return (await self.add_many([string]))[0]
+
+    async def add_many(self, strings: list) -> list:
+        result = [False] * len(strings)
+        index = [i for i, string in enumerate(strings)
+                 if self.local_cache is None or not self.local_cache.contain(string)]
+
+        while index:
+            n = self.slices
+            keys = [self.meta_key] + [self.slice_key(i) for i in range(n)]
+            args = [n, self.slice_params(n - 1)[0], len(index)]
+            for i in index:
+                value = self._encode(strings[i])
+                for slice_index in range(n):
+                    positions = self._locate_slice(value, slice_index)
+                    args.append(len(positions))
+                    args.extend(positions)
+
+            r = await self._eval(self.ADD_MANY_SCRIPT, keys=keys, args=args)
+            self.slices = r[1]
+            if r[0] == -1:
+                # another process had added a slice
+                continue
+
+            for i, absent in zip(index, r[2:]):
+                result[i] = absent == 1
+                if self.local_cache is not None:
+                    self.local_cache.add(strings[i])
+            index = index[len(r) - 2:]
+        return result
+
+    async def info(self) -> dict:
+        """Return the items,capacity,memory(bytes) & estimated false positive rate of the filter"""
+        await self.load_slices()
+        counts = await self.redis_conn.hmget(self.meta_key, *['count:{}'.format(i) for i in range(self.slices)])
+
+        items = capacity = bits = 0
+        not_false_positive = 1.0
+        for i, count in enumerate(counts):
+            count = int(count or 0)
+            slice_capacity, _, slice_bits, k = self.slice_params(i)
+            items += count
+            capacity += slice_capacity
+            bits += slice_bits
+            not_false_positive *= 1 - (1 - math.exp(-k * count / slice_bits)) ** k
+
+        return {
+            'slices': self.slices,
+            'items': items,
+            'capacity': capacity,
+            'memory': bits // 8,
+            'estimated_fpr': 1 - not_false_positive,
+        }
+
+
+class TimeWindowBloomFilter(RedisBloomFilter):
+    """
+    A string is duplicate only if it was added in the last window seconds.
+    The window is split into generations,generation g is the bitmap '<key>:gen:<g>' where g = int(now // (window / n)).
+    A new string is added to the current generation only,and a generation expire when it is out of the window,
+    so the filter never grow beyond n + 1 bitmaps.A string is forgotten between window and window*(1+1/n) seconds
+    after it was added.
+    """
+
+    # KEYS[1] is the current generation,KEYS[2:] are the older ones in the window.
+    # ARGV[1] is the number of bits per string,ARGV[2] is the ttl of the current generation.
+    ADD_MANY_SCRIPT = """
+    local k = tonumber(ARGV[1])
+    local result = {}
+    local added = false
+    for p = 3, #ARGV, k do
+        local seen = false
+        for g = 2, #KEYS do
+            local all = true
+            for j = 0, k - 1 do
+                if redis.call('GETBIT', KEYS[g], ARGV[p + j]) == 0 then
+                    all = false
+                    break
+                end
+            end
+            if all then
+                seen = true
+                break
+            end
+        end
+        local absent = 0
+        if not seen then
+            for j = 0, k - 1 do
+                if redis.call('SETBIT', KEYS[1], ARGV[p + j], 1) == 0 then
+                    absent = 1
+                end
+            end
+            added = true
+        end
+        table.insert(result, absent)
+    end
+    if added then
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+    end
+    return result
+    """
+
+    def __init__(self, loop, key, window, generations=4, capacity=1000000, error_rate=0.001, host='localhost',
+                 port=6379, db=0, clock=time.time):
+        """
+        :param window:          Seconds
+        :param generations:     The number of generations in a window
+        :param capacity:        The expected new strings per generation
+        :param error_rate:      The false positive rate of each generation
+        :param clock:           Return the current time in seconds
+        """
+        super(TimeWindowBloomFilter, self).__init__(loop, key, [], host=host, port=port, db=db)
+        self.window = window
+        self.generations = generations
+        self.generation_length = window / generations
+        self.bits, self.k = optimal_params(capacity, error_rate)
+        self.clock = clock
+
+    async def conn(self):
+        if not self.redis_conn:
+            self.redis_conn = await aioredis.create_redis(
+                (self.host, self.port), db=self.db, loop=self.loop
+            )
+        return self.redis_conn
+
+    def generation_keys(self) -> list:
+        """The keys of the generations in the window,the current one first"""
+        current = int(self.clock() // self.generation_length)
+        return ['{}:gen:{}'.format(self.key, g) for g in range(current, current - self.generations - 1, -1)]
+
+    def _locate_bits(self, string) -> list:
         if isinstance(string, str):
             string = string.encode('utf-8')
         else:
             string = str(string).encode('utf-8')
+        return double_hash_positions(string, self.bits, self.k)
 
-        # m_string = md5string(string)
-        m_string = string
-        name = self.key + ':' + str(int(m_string, 16) % self.blockNum)
-        loc = self.hashfunc.hash(m_string)
+    async def clean(self):
+        try:
+            await self.redis_conn.delete(*self.generation_keys())
+        except:
+            pass
 
+    async def is_contain(self, string):
+        loc = self._locate_bits(string)
         pipe = self.redis_conn.pipeline()
-        for i in loc:
-            pipe.setbit(name, i, 1)
+        keys = self.generation_keys()
+        for key in keys:
+            for i in loc:
+                pipe.getbit(key, i)
         r = await pipe.execute()
+        return any(0 not in r[i:i + self.k] for i in range(0, len(r), self.k))
 
-        return True if 1 not in r else False
+    async def add(self, string):
+        return await self.add_if_absent(string)
+
+    async def add_if_absent(self, string) -> bool:
+        return (await self.add_many([string]))[0]
+
+    async def add_many(self, strings: list) -> list:
+        if not strings:
+            return []
+        # the current generation must live until it is out of the window
+        ttl = math.ceil(self.window + self.generation_length)
+        args = [self.k, ttl]
+        for string in strings:
+            args.extend(self._locate_bits(string))
+        r = await self._eval(self.ADD_MANY_SCRIPT, keys=self.generation_keys(), args=args)
+        return [absent == 1 for absent in r]
+
+
+class MmapBloomFilter(object):
+    """
+    A bloom filter in a memory-mapped file,for the deployments with only one scheduler.
+    Setting a bit is a memory write instead of a round trip to redis,and the page cache write it back to the file,
+    so the filter survive restarts.It is not safe to share a file between processes.
+    add_many check & set the bits of a batch with numpy if it is installed.
+
+    File layout:    b'CBF' + version(1 byte) + bits(uint64) + k(uint32) + padding to 16 bytes + bitmap
+    The bits & k in an existing file are used instead of the parameters.
+    """
+    MAGIC = b'CBF'
+    VERSION = 1
+    HEADER = struct.Struct('>3sBQI')
+    HEADER_SIZE = 16
+
+    def __init__(self, loop, key, capacity=10000000, error_rate=0.001, path=None):
+        """
+        :param capacity:        The expected items
+        :param error_rate:      The false positive rate at capacity
+        :param path:            The file,default to PERSISTENCE['DUMP_PATH']/bloomfilter/<key>
+        """
+        self.loop = loop
+        self.key = key
+        self.path = path or os.path.join(catty.config.PERSISTENCE['DUMP_PATH'], 'bloomfilter', key.replace(':', '_'))
+        self.bits, self.k = optimal_params(capacity, error_rate)
+        self.file = None
+        self.mm = None
+        self.array = None
+
+    async def conn(self):
+        if self.mm is None:
+            self.open()
+        return self.mm
+
+    def open(self):
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.HEADER_SIZE:
+            self.file = open(self.path, 'r+b')
+            magic, version, bits, k = self.HEADER.unpack(self.file.read(self.HEADER.size))
+            if magic != self.MAGIC or version != self.VERSION:
+                self.file.close()
+                raise ValueError("Not a bloom filter file:{}".format(self.path))
+            self.bits, self.k = bits, k
+        else:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = open(self.path, 'w+b')
+            self.file.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.bits, self.k))
+        # the bitmap is a sparse file,the blocks are allocated when they are written
+        size = self.HEADER_SIZE + (self.bits + 7) // 8
+        if os.fstat(self.file.fileno()).st_size < size:
+            self.file.truncate(size)
+        self.mm = mmap.mmap(self.file.fileno(), size)
+        if numpy is not None:
+            self.array = numpy.frombuffer(self.mm, dtype=numpy.uint8, offset=self.HEADER_SIZE)
+
+    def flush(self):
+        if self.mm is not None:
+            self.mm.flush()
+
+    def close(self):
+        if self.mm is not None:
+            # the view must be released before closing the mmap
+            self.array = None
+            self.mm.flush()
+            self.mm.close()
+            self.file.close()
+            self.mm = None
+
+    async def clean(self):
+        if self.mm is None:
+            self.open()
+        self.array = None
+        self.mm.close()
+        # drop the bitmap & make it sparse again
+        self.file.truncate(self.HEADER_SIZE)
+        self.file.close()
+        self.mm = None
+        self.open()
+
+    def _locate(self, string) -> list:
+        if isinstance(string, str):
+            string = string.encode('utf-8')
+        else:
+            string = str(string).encode('utf-8')
+        return double_hash_positions(string, self.bits, self.k)
+
+    async def is_contain(self, string):
+        mm = self.mm
+        for position in self._locate(string):
+            if not mm[self.HEADER_SIZE + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    async def add(self, string):
+        return await self.add_if_absent(string)
+
+    async def add_if_absent(self, string) -> bool:
+        mm = self.mm
+        absent = False
+        for position in self._locate(string):
+            index = self.HEADER_SIZE + (position >> 3)
+            mask = 1 << (position & 7)
+            byte = mm[index]
+            if not byte & mask:
+                mm[index] = byte | mask
+                absent = True
+        return absent
+
+    async def add_many(self, strings: list) -> list:
+        """
+        add_if_absent for many strings.A repeated string in the list is new only once.
+        """
+        if self.array is None or len(strings) < 2:
+            return [await self.add_if_absent(string) for string in strings]
+
+        # the first one of the repeated strings
+        first = {}
+        for i, string in enumerate(strings):
+            first.setdefault(string, i)
+        index = list(first.values())
+
+        positions = numpy.array([self._locate(strings[i]) for i in index], dtype=numpy.uint64)
+        byte_index = (positions >> numpy.uint64(3)).astype(numpy.intp)
+        mask = numpy.left_shift(1, (positions & numpy.uint64(7)).astype(numpy.uint8)).astype(numpy.uint8)
+
+        absent = ((self.array[byte_index] & mask) == 0).any(axis=1)
+        numpy.bitwise_or.at(self.array, byte_index.ravel(), mask.ravel())
+
+        result = [False] * len(strings)
+        for i, new in zip(index, absent.tolist()):
+            result[i] = new
+        return result
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+# Author: Vincent<vincent8280@outlook.com>
+#         http://blog.vincentzhong.cn
+# Created on 2017/10/15 11:08
+import hashlib
+import os
+import time
+
+import aiofiles
+import aioredis
+
+import catty.config
+
+"""
+Store the response body out of the queues.The queue only carry a reference like 'file:<sha1>',
+and the parser load it by Response.load_body before the callbacks run.Identical bodies have the same sha1,
+so they are stored once.
+"""
+
+_stores = {}
+
+
+class BaseBodyStore(object):
+    name = ''
+
+    @staticmethod
+    def make_key(body: bytes) -> str:
+        return hashlib.sha1(body).hexdigest()
+
+    def make_ref(self, key: str) -> str:
+        return '{}:{}'.format(self.name, key)
+
+    async def put(self, body: bytes) -> str:
+        """Save the body & return the reference"""
+        raise NotImplementedError
+
+    async def get(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    async def release(self, key: str):
+        """The reader had done with the body"""
+        pass
+
+
+class FileBodyStore(BaseBodyStore):
+    """
+    A content addressed directory.The file of a body is shared by the tasks,so it is not deleted when one of them
+    release it.The files not written for ttl seconds are deleted by clean_expired instead.
+    """
+    name = 'file'
+
+    def __init__(self, root: str, ttl: float = 0):
+        """
+        :param ttl:     the seconds to keep a body since it was put last time,0 to keep it for ever
+        """
+        self.root = root
+        self.ttl = ttl
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    async def put(self, body: bytes) -> str:
+        key = self.make_key(body)
+        path = self.path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+            async with aiofiles.open(tmp_path, mode='wb') as f:
+                await f.write(body)
+            os.replace(tmp_path, path)
+        else:
+            # put again,don't let it expire
+            os.utime(path)
+        return self.make_ref(key)
+
+    async def get(self, key: str) -> bytes:
+        async with aiofiles.open(self.path(key), mode='rb') as f:
+            return await f.read()
+
+    def clean_expired(self) -> int:
+        """Delete the bodies out of ttl,return the number of them"""
+        if not self.ttl or not os.path.isdir(self.root):
+            return 0
+        deadline = time.time() - self.ttl
+        count = 0
+        for dir_path, _, files in os.walk(self.root):
+            for file_name in files:
+                path = os.path.join(dir_path, file_name)
+                try:
+                    if os.path.getmtime(path) < deadline:
+                        os.remove(path)
+                        count += 1
+                except FileNotFoundError:
+                    pass
+        return count
+
+
+class RedisBodyStore(BaseBodyStore):
+    """
+    Bodies in a redis hash,with a reference count in another hash.
+    The body is deleted when the last reader release it.
+    """
+    name = 'redis'
+
+    RELEASE_SCRIPT = """
+    if redis.call('HINCRBY', KEYS[2], ARGV[1], -1) <= 0 then
+        redis.call('HDEL', KEYS[1], ARGV[1])
+        redis.call('HDEL', KEYS[2], ARGV[1])
+    end
+    """
+
+    def __init__(self, key: str, loop=None, host='localhost', port=6379, db=0):
+        self.key = key
+        self.refs_key = key + ':refs'
+        self.loop = loop
+        self.host = host
+        self.port = port
+        self.db = db
+        self.redis_conn = None
+
+    async def conn(self):
+        if not self.redis_conn:
+            self.redis_conn = await aioredis.create_redis(
+                (self.host, self.port), db=self.db, loop=self.loop
+            )
+        return self.redis_conn
+
+    async def put(self, body: bytes) -> str:
+        key = self.make_key(body)
+        await self.conn()
+        pipe = self.redis_conn.pipeline()
+        pipe.hsetnx(self.key, key, body)
+        pipe.hincrby(self.refs_key, key, 1)
+        await pipe.execute()
+        return self.make_ref(key)
+
+    async def get(self, key: str) -> bytes:
+        await self.conn()
+        return await self.redis_conn.hget(self.key, key)
+
+    async def release(self, key: str):
+        await self.conn()
+        await self.redis_conn.eval(self.RELEASE_SCRIPT, keys=[self.key, self.refs_key], args=[key])
+
+
+def get_body_store(name: str = None, loop=None):
+    """Return the body store of this process,None if BODY_STORE['TYPE'] is empty."""
+    name = name if name is not None else catty.config.BODY_STORE['TYPE']
+    if not name:
+        return
+    if name not in _stores:
+        if name == 'file':
+            _stores[name] = FileBodyStore(catty.config.BODY_STORE['PATH'], catty.config.BODY_STORE['FILE_TTL'])
+        elif name == 'redis':
+            _stores[name] = RedisBodyStore(catty.config.BODY_STORE['KEY'], loop)
+        else:
+            raise ValueError("Unknow body store:{}".format(name))
+    return _stores[name]
+
+
+def split_ref(ref: str) -> tuple:
+    """'file:<sha1>' -> (FileBodyStore,'<sha1>')"""
+    name, key = ref.split(':', 1)
+    return get_body_store(name), key
@@ -26,6 +26,10 @@ class Counter:
         value = self.value_d.setdefault(name + '_fail', 0)
         self.value_d.update({name + '_fail': value + 1})
 
+    def add(self, name, n=1):
+        """Add n to a counter without a pair,such as name + '_download'"""
+        self.value_d[name] = self.value_d.get(name, 0) + n
+
     async def update(self):
         for name, count in self.value_d.items():
             q = self.cache_value.setdefault(name, deque(maxlen=self.max_size))
@@ -38,10 +42,7 @@ class Counter:
 
         result = {}
         for name, q in self.cache_value.items():
-            if '_success' in name:
-                result.update(
-                    {name: (int(sum(q) / len(q)), int(sum(q) / len(q) * 5), int(sum(q) / len(q) * 60), int(sum(q)))})
-            elif '_fail' in name:
-                result.update(
-                    {name: (int(sum(q) / len(q)), int(sum(q) / len(q) * 5), int(sum(q) / len(q) * 60), int(sum(q)))})
+            if name.endswith(('_success', '_fail', '_download')):
+                average = sum(q) / len(q)
+                result.update({name: (int(average), int(average * 5), int(average * 60), int(sum(q)))})
         return result
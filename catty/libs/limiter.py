@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+# Author: Vincent<vincent8280@outlook.com>
+#         http://blog.vincentzhong.cn
+# Created on 2017/10/19 15:32
+import asyncio
+import time
+from collections import deque
+
+import catty.config
+
+
+class TokenBucket(object):
+    """Refill rate tokens per second,hold at most capacity tokens.A rate of 0 means unlimited."""
+
+    def __init__(self, rate: float, capacity: float = None, clock=time.monotonic):
+        self.clock = clock
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.last = clock()
+
+    def set_rate(self, rate: float, capacity: float = None):
+        self._refill()
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def _refill(self):
+        now = self.clock()
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def consume(self, n: float = 1) -> float:
+        """Take n tokens & return 0,or return the seconds to wait for them(nothing is taken)"""
+        if not self.rate:
+            return 0
+        self._refill()
+        if self.tokens >= n:
+            self.tokens -= n
+            return 0
+        return (n - self.tokens) / self.rate
+
+    def take(self, limit: int = None) -> int:
+        """Take all the whole tokens(at most limit) & return the number of them"""
+        self._refill()
+        n = int(self.tokens)
+        if limit is not None:
+            n = min(n, limit)
+        self.tokens -= n
+        return n
+
+
+class _Host(object):
+    def __init__(self, rate, concurrency, clock):
+        self.bucket = TokenBucket(rate, clock=clock)
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.waiters = deque()
+        self.last_seen = clock()
+
+
+class HostLimiter(object):
+    """
+    A token bucket & a concurrency cap per host.
+    With global_rate,the rate of each active host is global_rate / active hosts(at most its own rate),
+    so the budget of the idle hosts goes to the busy ones.A host is idle if it had not been acquired in idle_timeout.
+    """
+
+    def __init__(self, loop, host_rate: float = 0, host_concurrency: int = 0, global_rate: float = 0,
+                 host_limits: dict = None, idle_timeout: float = 5, clock=time.monotonic):
+        """
+        :param host_rate:           requests/s of a host,0 means unlimited
+        :param host_concurrency:    requests in flight of a host,0 means unlimited
+        :param global_rate:         requests/s shared by the active hosts,0 means unlimited
+        :param host_limits:         {host: {'rate': float, 'concurrency': int}} override the above
+        """
+        self.loop = loop
+        self.host_rate = host_rate
+        self.host_concurrency = host_concurrency
+        self.global_rate = global_rate
+        self.host_limits = host_limits or {}
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self.hosts = {}
+        # a host had been added or forgotten since the last sharing of global_rate
+        self.changed = False
+        self.last_rebalance = clock()
+
+    def _get_host(self, host: str) -> _Host:
+        h = self.hosts.get(host)
+        if h is None:
+            limits = self.host_limits.get(host, {})
+            h = self.hosts[host] = _Host(limits.get('rate', self.host_rate),
+                                         limits.get('concurrency', self.host_concurrency), self.clock)
+            self.changed = True
+        h.last_seen = self.clock()
+        return h
+
+    def rebalance(self):
+        """Share global_rate between the active hosts & forget the idle ones"""
+        now = self.clock()
+        if now - self.last_rebalance >= 1:
+            self.last_rebalance = now
+            for host in [host for host, h in self.hosts.items()
+                         if not h.in_flight and not h.waiters and now - h.last_seen > self.idle_timeout]:
+                del self.hosts[host]
+                self.changed = True
+        if not self.global_rate or not self.changed:
+            return
+
+        self.changed = False
+        share = self.global_rate / max(1, len(self.hosts))
+        for host, h in self.hosts.items():
+            rate = self.host_limits.get(host, {}).get('rate', self.host_rate)
+            h.bucket.set_rate(min(rate, share) if rate else share)
+
+    def try_acquire(self, host: str) -> bool:
+        """Take a slot & a token of the host if both are available at once"""
+        h = self._get_host(host)
+        self.rebalance()
+        if h.concurrency and h.in_flight >= h.concurrency:
+            return False
+        if h.bucket.consume():
+            return False
+        h.in_flight += 1
+        return True
+
+    async def acquire(self, host: str):
+        """Wait for a slot & a token of the host"""
+        h = self._get_host(host)
+        self.rebalance()
+        while True:
+            if h.concurrency and h.in_flight >= h.concurrency:
+                waiter = self.loop.create_future()
+                h.waiters.append(waiter)
+                try:
+                    await waiter
+                finally:
+                    if waiter in h.waiters:
+                        h.waiters.remove(waiter)
+                continue
+
+            wait = h.bucket.consume()
+            if not wait:
+                h.in_flight += 1
+                h.last_seen = self.clock()
+                return
+            # never be forgotten as an idle host while waiting
+            h.last_seen = self.clock() + wait
+            await asyncio.sleep(wait, loop=self.loop)
+
+    def release(self, host: str):
+        h = self.hosts.get(host)
+        if h is None:
+            return
+        h.in_flight -= 1
+        h.last_seen = self.clock()
+        while h.waiters:
+            waiter = h.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def stats(self) -> dict:
+        return {host: {'rate': h.bucket.rate, 'in_flight': h.in_flight, 'waiting': len(h.waiters)}
+                for host, h in self.hosts.items()}
+
+
+def get_host_limiter(loop):
+    """Return a HostLimiter of DOWNLOADER config,None if nothing is limited"""
+    config = catty.config.DOWNLOADER
+    if not (config.get('HOST_RATE') or config.get('HOST_CONCURRENCY') or config.get('GLOBAL_RATE') or
+            config.get('HOST_LIMITS')):
+        return
+    return HostLimiter(loop,
+                       host_rate=config.get('HOST_RATE', 0),
+                       host_concurrency=config.get('HOST_CONCURRENCY', 0),
+                       global_rate=config.get('GLOBAL_RATE', 0),
+                       host_limits=config.get('HOST_LIMITS'),
+                       idle_timeout=config.get('HOST_IDLE_TIMEOUT', 5))
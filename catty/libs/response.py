@@ -21,8 +21,11 @@
 
     'body':bytes                    response’s body as bytes.
     'use_time':float                the time cost in request
+    'body_ref':str                  reference of the body in body store(optional),see catty.libs.body_store
+    'error':str                     the exception class name if the request failed(status 99999)
 }
 """
+import copy
 
 
 class Response(object):
@@ -30,19 +33,68 @@ class Response(object):
     #              'cookies', 'status']
 
     def __init__(self, status='', method='', use_time='', url='', body='', cookies='', charset='', content_type='',
-                 headers=''):
+                 headers='', body_ref='', error=''):
         self.status = status
         self.method = method
         self.headers = headers
         self.cookies = cookies
         self.content_type = content_type
         self.charset = charset
-        self.body = body
+        self._body = body
+        self.body_ref = body_ref
+        self.error = error
         self.use_time = use_time
         self.url = url
 
         self.dumped_request = {}
 
+    @property
+    def body(self):
+        """None if the body is in the body store & had not been loaded,see load_body"""
+        return self._body
+
+    @body.setter
+    def body(self, value):
+        self._body = value
+
+    async def offload_body(self, store):
+        """Save the body in store & only keep the reference"""
+        self.body_ref = await store.put(self._body)
+        self._body = None
+
+    async def load_body(self):
+        """
+        Fetch the body from the body store,so reading it never block the event loop.
+        The body is kept in the store until release_body,a redelivered task can load it again.
+        """
+        if self._body is None and self.body_ref:
+            from catty.libs.body_store import split_ref
+            store, key = split_ref(self.body_ref)
+            self._body = await store.get(key)
+
+    async def detach_body(self):
+        """Return a copy with the loaded body & without the reference,the reference is still to be released"""
+        await self.load_body()
+        response = copy.copy(self)
+        response.body_ref = ''
+        return response
+
+    async def release_body(self):
+        """The task had been done,release the body in the body store"""
+        if self.body_ref:
+            from catty.libs.body_store import split_ref
+            store, key = split_ref(self.body_ref)
+            await store.release(key)
+            self.body_ref = ''
+
+    def __setstate__(self, state):
+        # pickled before body_ref
+        if 'body' in state:
+            state['_body'] = state.pop('body')
+        state.setdefault('body_ref', '')
+        state.setdefault('error', '')
+        self.__dict__.update(state)
+
     def __getitem__(self, item):
         return self.__getattribute__(item)
 
@@ -56,6 +108,8 @@ class Response(object):
             'url': self.url
         }
 
+        if self.body_ref:
+            self.dumped_request.update({'body_ref': self.body_ref})
         if self.cookies:
             self.dumped_request.update({'cookies': self.cookies})
         if self.content_type:
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+# Author: Vincent<vincent8280@outlook.com>
+#         http://blog.vincentzhong.cn
+# Created on 2017/10/19 10:05
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import catty.config
+
+"""
+A retry policy is a dict of rules,the rule of a failure is looked up by these keys in order:
+
+    exception class name    'TimeoutError','ClientConnectorError'...(status 99999)
+    'exception'             any exception(status 99999)
+    status code             '429','503'...
+    status class            '4xx','5xx'...
+    'default'
+
+A rule can have:
+
+    'retry':        max retries,default to meta['retry']
+    'base':         the delay of the first retry(seconds),default to meta['retry_wait']
+    'factor':       the delay of the nth retry is base * factor ** n
+    'max_delay':    the max delay(seconds),not for Retry-After
+    'jitter':       0~1,the delay is randomly reduced by at most jitter * delay,so the retries don't come together
+    'retry_after':  honour the Retry-After header,default True
+"""
+
+EXCEPTION_STATUS = 99999
+
+
+class RetryPolicy(object):
+    def __init__(self, rules: dict = None):
+        self.rules = rules if rules is not None else catty.config.SPIDER_DEFAULT['RETRY_POLICY']
+
+    def match(self, status, error: str = '') -> dict:
+        """Return the rule of the failure"""
+        keys = []
+        if status == EXCEPTION_STATUS:
+            if error:
+                keys.append(error)
+            keys.append('exception')
+        else:
+            keys.extend((str(status), '{}xx'.format(str(status)[:1])))
+        keys.append('default')
+
+        for key in keys:
+            if key in self.rules:
+                return self.rules[key]
+        return {}
+
+    @staticmethod
+    def retry_after(headers) -> float:
+        """The seconds in Retry-After header,0 if there isn't"""
+        for k, v in headers or ():
+            if isinstance(k, bytes):
+                k, v = k.decode('latin-1'), v.decode('latin-1')
+            if k.lower() != 'retry-after':
+                continue
+            try:
+                return max(0.0, float(v))
+            except ValueError:
+                pass
+            try:
+                return max(0.0, parsedate_to_datetime(v).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+        return 0
+
+    def delay(self, meta: dict, retried: int, status, error: str = '', headers=None):
+        """
+        Return the seconds to wait before the retried+1 retry,None if it should not be retried.
+        :param meta:        task['meta'],for the default retry & retry_wait
+        :param retried:     the times had been retried
+        """
+        rule = self.match(status, error)
+        if retried >= rule.get('retry', meta.get('retry', 0)):
+            return
+
+        delay = rule.get('base', meta.get('retry_wait', 0)) * rule.get('factor', 1) ** retried
+        delay = min(delay, rule.get('max_delay', delay))
+        delay *= 1 - random.uniform(0, rule.get('jitter', 0))
+        if rule.get('retry_after', True):
+            delay = max(delay, self.retry_after(headers))
+        return delay
+
+
+def get_retry_policy(meta: dict) -> RetryPolicy:
+    """The policy of the task,meta['retry_policy'] or SPIDER_DEFAULT['RETRY_POLICY']"""
+    return RetryPolicy(meta.get('retry_policy'))
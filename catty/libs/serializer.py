@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+# Author: Vincent<vincent8280@outlook.com>
+#         http://blog.vincentzhong.cn
+# Created on 2017/10/14 10:26
+import pickle
+from http.cookies import SimpleCookie
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from catty.libs.request import Request
+from catty.libs.response import Response
+from catty.libs.utils import Task
+
+"""
+Binary layout of a Task(see catty/libs/tasker.py),version 1:
+
+    b'CT' + version(1 byte) + msgpack array
+    [
+        tid, spider_name, priority, retried(None if never retried), meta,
+        request:  [method, url, params, data, headers, allow_redirects, proxy, timeout],
+        downloader, scheduler, parser,
+        response: [status, method, headers, cookies, content_type, charset, body, use_time, url, body_ref, error]
+                  or a dict,
+        callback,
+        extra:    dict of the other keys of the task
+    ]
+
+New fields are only appended to the end of an array,so the decoder of a version can read the shorter arrays
+written before.Something can not be packed(tuples,sets,auth objects...) make the whole task fall back to pickle.
+Pickle payloads start with b'\x80',so they never be confused with b'CT'.
+"""
+
+MAGIC = b'CT'
+VERSION = 1
+
+TASK_FIELDS = ('tid', 'spider_name', 'priority', 'retried', 'meta', 'request', 'downloader', 'scheduler', 'parser',
+               'response', 'callback')
+REQUEST_FIELDS = ('method', 'url', 'params', 'data', 'headers', 'allow_redirects', 'proxy', 'timeout')
+RESPONSE_FIELDS = ('status', 'method', 'headers', 'cookies', 'content_type', 'charset', 'body', 'use_time', 'url',
+                   'body_ref', 'error')
+
+REQUEST_DEFAULT = {'method': 'GET', 'params': None, 'data': None, 'headers': {}, 'auth': None,
+                   'allow_redirects': True, 'proxy': None, 'proxy_auth': None, 'timeout': None}
+RESPONSE_DEFAULT = {'status': '', 'method': '', 'headers': '', 'cookies': '', 'content_type': '', 'charset': '',
+                    '_body': '', 'use_time': '', 'url': '', 'body_ref': '', 'error': ''}
+
+
+class BaseSerializer(object):
+    name = ''
+
+    def dumps(self, obj) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data: bytes):
+        raise NotImplementedError
+
+
+class PickleSerializer(BaseSerializer):
+    name = 'pickle'
+
+    def dumps(self, obj) -> bytes:
+        return pickle.dumps(obj)
+
+    def loads(self, data: bytes):
+        return pickle.loads(data)
+
+
+class MsgpackSerializer(PickleSerializer):
+    """Pack the Task with a fixed field layout.Everything else is pickled."""
+    name = 'msgpack'
+
+    def dumps(self, obj) -> bytes:
+        if isinstance(obj, Task) and isinstance(obj.get('request'), Request):
+            try:
+                return MAGIC + bytes([VERSION]) + msgpack.packb(
+                    self._pack_task(obj), use_bin_type=True, strict_types=True)
+            except (TypeError, ValueError, OverflowError):
+                pass
+        return pickle.dumps(obj)
+
+    def loads(self, data: bytes):
+        if data[:2] == MAGIC:
+            if data[2] != VERSION:
+                raise ValueError("Unknow task version:{}".format(data[2]))
+            return self._unpack_task(msgpack.unpackb(data[3:], raw=False))
+        return pickle.loads(data)
+
+    @staticmethod
+    def _pack_request(request: Request) -> list:
+        if request.auth or request.proxy_auth:
+            # the auth objects are tuples
+            raise TypeError
+        return [request[field] for field in REQUEST_FIELDS]
+
+    @staticmethod
+    def _unpack_request(fields: list) -> Request:
+        request = Request.__new__(Request)
+        request.__dict__.update(REQUEST_DEFAULT)
+        request.__dict__.update(zip(REQUEST_FIELDS, fields))
+        request.dumped_request = {}
+        return request
+
+    @staticmethod
+    def _pack_response(response):
+        if not isinstance(response, Response):
+            return response
+
+        fields = []
+        for field in RESPONSE_FIELDS:
+            if field == 'body':
+                # never load an offloaded body
+                value = response._body
+            else:
+                value = response[field]
+            if field == 'headers' and value:
+                value = [list(i) for i in value]
+            elif field == 'cookies' and value:
+                value = [morsel.OutputString() for morsel in value.values()]
+            elif field == 'url':
+                value = str(value)
+            fields.append(value)
+        return fields
+
+    @staticmethod
+    def _unpack_response(fields):
+        if not isinstance(fields, list):
+            return fields
+
+        response = Response.__new__(Response)
+        response.__dict__.update(RESPONSE_DEFAULT)
+        for field, value in zip(RESPONSE_FIELDS, fields):
+            if field == 'headers' and value:
+                value = tuple(tuple(i) for i in value)
+            elif field == 'cookies' and value:
+                cookies = SimpleCookie()
+                for each in value:
+                    cookies.load(each)
+                value = cookies
+            setattr(response, field, value)
+        response.dumped_request = {}
+        return response
+
+    def _pack_task(self, task: Task) -> list:
+        fields = []
+        for field in TASK_FIELDS:
+            if field == 'request':
+                fields.append(self._pack_request(task['request']))
+            elif field == 'response':
+                fields.append(self._pack_response(task.get('response', {})))
+            else:
+                fields.append(task.get(field))
+        fields.append({k: v for k, v in task.items() if k not in TASK_FIELDS})
+        return fields
+
+    def _unpack_task(self, fields: list) -> Task:
+        task = Task()
+        for field, value in zip(TASK_FIELDS, fields):
+            if field == 'request':
+                value = self._unpack_request(value)
+            elif field == 'response':
+                value = self._unpack_response(value)
+            elif field == 'retried' and value is None:
+                continue
+            task[field] = value
+        if len(fields) > len(TASK_FIELDS):
+            task.update(fields[len(TASK_FIELDS)])
+        return task
+
+
+def get_serializer(name: str = '') -> BaseSerializer:
+    """Return a serializer by name.Fall back to pickle if msgpack is not installed."""
+    if name == 'msgpack' and msgpack is not None:
+        return MsgpackSerializer()
+    return PickleSerializer()
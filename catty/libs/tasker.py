@@ -4,7 +4,8 @@
 # Author: Vincent<vincent8280@outlook.com>
 #         http://blog.vincentzhong.cn
 # Created on 2017/05/06 12:31
-import pickle
+import catty.config
+from catty.libs.serializer import get_serializer
 from catty.libs.utils import md5string, Task
 """
 {
@@ -87,8 +88,8 @@ class Tasker(object):
 
     @staticmethod
     def dump_task(task):
-        return pickle.dumps(task)
+        return get_serializer(catty.config.QUEUE['SERIALIZER']).dumps(task)
 
     @staticmethod
     def load_task(dumped_task):
-        return pickle.loads(dumped_task)
+        return get_serializer(catty.config.QUEUE['SERIALIZER']).loads(dumped_task)
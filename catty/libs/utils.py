@@ -4,6 +4,7 @@
 # Author: Vincent<vincent8280@outlook.com>
 #         http://blog.vincentzhong.cn
 # Created on 2017/2/24 19:50
+import copy
 import hashlib
 import pickle
 import os
@@ -46,6 +47,12 @@ def build_url(url):
     return f.url
 
 
+def is_handled_status(task: dict, status) -> bool:
+    """The response of the status will be parsed,see Spider.handle_status_code"""
+    handle_status_code = task.get('handle_status_code', task['meta'].get('handle_status_code', ()))
+    return isinstance(status, int) and 200 <= status < 400 and status in handle_status_code
+
+
 class PriorityDict(dict):
     def __eq__(self, other):
         return self['priority'] == other['priority']
@@ -58,6 +65,18 @@ class Task(PriorityDict):
     pass
 
 
+# the field of a task popped from a reliable queue,to ack it.See AsyncRedisPriorityQueue.receive
+RECEIPT_KEY = '_receipt'
+
+
+def without_receipt(item):
+    """Return a copy of the task without its receipt,or the item itself if it has none"""
+    if isinstance(item, dict) and RECEIPT_KEY in item:
+        item = copy.copy(item)
+        del item[RECEIPT_KEY]
+    return item
+
+
 def get_eventloop():
     try:
         import uvloop
@@ -84,8 +103,16 @@ def load_pickle_data(root, name):
             return pickle.loads(t)
 
 
+def _task_serializer():
+    # catty.libs.serializer import this module
+    import catty.config
+    from catty.libs.serializer import get_serializer
+    return get_serializer(catty.config.QUEUE['SERIALIZER'])
+
+
 async def dump_task(task, dump_path, dump_type, spider_name):
     """mkdir & save task in sqlite"""
+    data = _task_serializer().dumps(without_receipt(task))
     if not os.path.exists(os.path.join(dump_path, dump_type)):
         os.mkdir(os.path.join(dump_path, dump_type))
 
@@ -93,11 +120,11 @@ async def dump_task(task, dump_path, dump_type, spider_name):
     if not os.path.exists(path):
         async with aiosqlite.connect(path) as conn:
             await conn.execute('CREATE TABLE dump_task (task_data VARCHAR(99999))')
-            await conn.execute('INSERT INTO dump_task (task_data) VALUES (?)', [pickle.dumps(task)])
+            await conn.execute('INSERT INTO dump_task (task_data) VALUES (?)', [data])
             await conn.commit()
     else:
         async with aiosqlite.connect(path) as conn:
-            await conn.execute('INSERT INTO dump_task (task_data) VALUES (?)', [pickle.dumps(task)])
+            await conn.execute('INSERT INTO dump_task (task_data) VALUES (?)', [data])
             await conn.commit()
     return True
 
@@ -108,7 +135,8 @@ async def load_task(dump_path, dump_type, spider_name, delete=True):
     if os.path.exists(path):
         async with aiosqlite.connect(path) as conn:
             cursor = await conn.execute('SELECT task_data FROM dump_task')
-            result = [pickle.loads(i[0]) async for i in cursor]
+            serializer = _task_serializer()
+            result = [serializer.loads(i[0]) async for i in cursor]
 
         if delete:
             os.remove(path)
@@ -5,13 +5,26 @@
 #         http://blog.vincentzhong.cn
 # Created on 2017/2/24 9:53
 
-import pickle
 import traceback
 import asyncio
+import heapq
+import itertools
+import os
+import socket
+import struct
+import time
+import zlib
+from collections import deque
 
 import aioredis
 
-from catty.libs.utils import get_default
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+from catty.libs.serializer import get_serializer
+from catty.libs.utils import PriorityDict, get_default, RECEIPT_KEY, without_receipt
 from catty.exception import AsyncQueueEmpty, AsyncQueueFull
 import catty.config
 
@@ -74,16 +87,98 @@ class BaseAsyncQueue(object):
 
 
 class AsyncRedisPriorityQueue(BaseAsyncQueue):
+    # tags of the compressed payloads,a serialized payload never start with them
+    ZLIB_TAG = b'CZ'
+    LZ4_TAG = b'CL'
+    # tag of the payloads stamped with the enqueue time(a double),before the compressed or serialized payload
+    AGE_TAG = b'CA'
+
+    # KEYS: queue,inflight,inflight score.ARGV: n,deadline.Return {size,items...}
+    POP_RELIABLE_SCRIPT = """
+    local items = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1, 'WITHSCORES')
+    local result = {0}
+    for i = 1, #items, 2 do
+        redis.call('ZADD', KEYS[2], ARGV[2], items[i])
+        redis.call('HSET', KEYS[3], items[i], items[i + 1])
+        table.insert(result, items[i])
+    end
+    if #items > 0 then
+        redis.call('ZREMRANGEBYRANK', KEYS[1], 0, #items / 2 - 1)
+    end
+    result[1] = redis.call('ZCARD', KEYS[1])
+    return result
+    """
+
+    # KEYS: queue,inflight,inflight score,signal.ARGV: now,n.Return the number of the requeued items
+    REQUEUE_SCRIPT = """
+    local items = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+    for _, item in ipairs(items) do
+        redis.call('ZADD', KEYS[1], redis.call('HGET', KEYS[3], item) or 0, item)
+        redis.call('ZREM', KEYS[2], item)
+        redis.call('HDEL', KEYS[3], item)
+    end
+    if #items > 0 then
+        redis.call('LPUSH', KEYS[4], 1)
+        redis.call('LTRIM', KEYS[4], 0, 0)
+    end
+    return #items
+    """
+
     def __init__(self, name, loop, host='localhost', port=6379, db=0,
-                 queue_maxsize=10000, password=None, pool_maxsize=10):
+                 queue_maxsize=10000, password=None, pool_maxsize=10, serializer=None,
+                 compress_threshold=catty.config.QUEUE['COMPRESS_THRESHOLD'],
+                 aging_rate=catty.config.QUEUE['AGING_RATE'],
+                 age_stats=catty.config.QUEUE['AGE_STATS'],
+                 reliable=catty.config.QUEUE['RELIABLE'],
+                 visibility_timeout=catty.config.QUEUE['VISIBILITY_TIMEOUT']):
+        """
+        :param serializer:          catty.libs.serializer.BaseSerializer,QUEUE['SERIALIZER'] by default
+        :param compress_threshold:  compress the payloads bigger than it(bytes),0 to disable
+        :param aging_rate:          the priority a task gain per second of waiting,0 to disable.
+                                    The score is -priority + aging_rate * enqueue time,so popping is still O(log n)
+        :param age_stats:           stamp the payloads with the enqueue time & keep the ages of the popped items
+        :param reliable:            move the popped items to '<name>:inflight' until they are acked,
+                                    see requeue_expired
+        :param visibility_timeout:  the seconds a popped item can be processed before it is requeued
+        """
         super(AsyncRedisPriorityQueue, self).__init__(name, loop, host, port, db, password, pool_maxsize)
         self.queue_maxsize = queue_maxsize
+        # the in-flight items scored by the deadline,and their scores in the queue
+        self.reliable = reliable
+        self.visibility_timeout = visibility_timeout
+        self.inflight_key = name + ':inflight'
+        self.inflight_score_key = name + ':inflight:score'
+        # a reliable queue push it after each put,to wake up a blocked get_wait
+        self.signal_key = name + ':signal'
+        # put wait when the size reach the high watermark,until the consumers drain it to the low watermark.
+        # QUEUE['WATERMARKS'] override them by the name of the queue,0 means unbounded
+        self.high_watermark, self.low_watermark = catty.config.QUEUE['WATERMARKS'].get(
+            name, (queue_maxsize, int(queue_maxsize * catty.config.QUEUE['LOW_WATERMARK'])))
+        # the consumer publish it when the size fall to the low watermark
+        self.drained_channel = name + ':drained'
+        self.drained = None
+        self.drained_conn = None
+        # the time of last_qsize,it is increased by the puts of this process between two ZCARD
+        self.last_qsize_time = 0
+        self.serializer = serializer if serializer else get_serializer(catty.config.QUEUE['SERIALIZER'])
+        self.compress_threshold = compress_threshold
+        self.aging_rate = aging_rate
+        self.age_stats = age_stats
+
+        # seconds waited in queue of the last popped items,see queue_age
+        self.ages = deque(maxlen=catty.config.QUEUE['AGE_SAMPLES'])
+
+        # bytes of payloads before and after compressing,for the items had been put by this process
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.compressed_count = 0
         self.last_qsize = 0
         self.loop = loop
 
     async def qsize(self):
         try:
             self.last_qsize = await self.redis_conn.zcard(self.name)
+            self.last_qsize_time = time.time()
             return self.last_qsize
         except:
             pass
@@ -101,29 +196,983 @@ class AsyncRedisPriorityQueue(BaseAsyncQueue):
         else:
             return False
 
+    def dumps(self, item) -> bytes:
+        """serialize & compress it if it is big enough"""
+        data = self.serializer.dumps(without_receipt(item))
+        self.raw_bytes += len(data)
+        if self.compress_threshold and len(data) > self.compress_threshold:
+            if lz4 is not None and catty.config.QUEUE['COMPRESSION'] == 'lz4':
+                compressed = self.LZ4_TAG + lz4.frame.compress(data)
+            else:
+                compressed = self.ZLIB_TAG + zlib.compress(data)
+            if len(compressed) < len(data):
+                data = compressed
+                self.compressed_count += 1
+        if self.age_stats:
+            data = self.AGE_TAG + struct.pack('!d', time.time()) + data
+        self.stored_bytes += len(data)
+        return data
+
+    def loads(self, data: bytes):
+        if data[:2] == self.AGE_TAG:
+            self.ages.append(time.time() - struct.unpack('!d', data[2:10])[0])
+            data = data[10:]
+        if data[:2] == self.ZLIB_TAG:
+            data = zlib.decompress(data[2:])
+        elif data[:2] == self.LZ4_TAG:
+            if lz4 is None:
+                raise ValueError("The payload is compressed by lz4,install lz4 to decode it")
+            data = lz4.frame.decompress(data[2:])
+        return self.serializer.loads(data)
+
+    def compress_stats(self) -> dict:
+        return {
+            'raw_bytes': self.raw_bytes,
+            'stored_bytes': self.stored_bytes,
+            'saved_bytes': self.raw_bytes - self.stored_bytes,
+            'compressed_count': self.compressed_count,
+        }
+
+    def queue_age(self) -> dict:
+        """Percentiles of the seconds waited in queue of the last QUEUE['AGE_SAMPLES'] popped items"""
+        ages = sorted(self.ages)
+        if not ages:
+            return {'count': 0}
+        return {
+            'count': len(ages),
+            'p50': ages[int(len(ages) * 0.5)],
+            'p90': ages[int(len(ages) * 0.9)],
+            'p99': ages[int(len(ages) * 0.99)],
+            'max': ages[-1],
+        }
+
+    def _get_priority(self, item):
+        """Return the (score,item) of an item.The item can be a (priority,item) tuple."""
+        if isinstance(item, tuple):
+            priority, item = item
+        else:
+            priority = get_default(item, 'priority', 0)
+        if self.aging_rate:
+            # an older task is ahead of a newer one unless the newer one's priority is aging_rate * elapsed higher
+            return -priority + self.aging_rate * time.time(), item
+        return -priority, item
+
+    async def approx_qsize(self) -> int:
+        """The size cached for QUEUE['SIZE_CACHE_TTL'] seconds,so the producers don't ZCARD for each put"""
+        if time.time() - self.last_qsize_time > catty.config.QUEUE['SIZE_CACHE_TTL']:
+            await self.qsize()
+        return self.last_qsize or 0
+
+    async def _listen_drained(self):
+        self.drained_conn = await aioredis.create_redis((self.host, self.port), db=self.db, loop=self.loop)
+        channel, = await self.drained_conn.subscribe(self.drained_channel)
+        while await channel.wait_message():
+            await channel.get()
+            self.drained.set()
+
+    async def wait_for_space(self):
+        """
+        Return at once if the size is under the high watermark.
+        Or wait until a consumer drain it to the low watermark,it is notified by pub/sub,
+        and checked again every QUEUE['BLOCK_TIMEOUT'] seconds in case of a lost message.
+        """
+        if not self.high_watermark or await self.approx_qsize() < self.high_watermark:
+            return
+
+        if self.drained is None:
+            self.drained = asyncio.Event(loop=self.loop)
+            self.loop.create_task(self._listen_drained())
+        while True:
+            self.drained.clear()
+            size = await self.qsize()
+            if size is None or size <= self.low_watermark:
+                return
+            try:
+                await asyncio.wait_for(self.drained.wait(), catty.config.QUEUE['BLOCK_TIMEOUT'], loop=self.loop)
+            except asyncio.TimeoutError:
+                pass
+
+    async def notify_drained(self, remaining: int, popped: int):
+        """Wake up the producers if the size had fallen to the low watermark by this pop"""
+        self.last_qsize = remaining
+        self.last_qsize_time = time.time()
+        if self.high_watermark and remaining <= self.low_watermark < remaining + popped:
+            await self.redis_conn.publish(self.drained_channel, remaining)
+
+    def receive(self, payloads: list, receipts: list = None) -> list:
+        """
+        Load the popped payloads.An in-flight item carry its receipt(the payload by default) in item[RECEIPT_KEY]
+        to ack it,dumps strip it,so it never go to another queue.The items of a reliable queue should be dicts,
+        the others are never acked & requeued after visibility_timeout.
+        A payload can't be loaded is logged & skipped,so it doesn't drop the others of the batch.
+        It is never acked,so a reliable queue give it to another process(which may have lz4) after the timeout.
+        Raise Empty if none of them can be loaded.
+        """
+        items = []
+        for payload, receipt in zip(payloads, receipts or payloads):
+            try:
+                item = self.loads(payload)
+            except Exception:
+                traceback.print_exc()
+                continue
+            if self.reliable and isinstance(item, dict):
+                item[RECEIPT_KEY] = receipt
+            items.append(item)
+        if not items:
+            raise self.Empty
+        return items
+
+    @staticmethod
+    def pop_receipts(items) -> list:
+        return [item.pop(RECEIPT_KEY) for item in items if isinstance(item, dict) and RECEIPT_KEY in item]
+
+    async def ack(self, *items):
+        """The items popped by this process had been done,remove them from in-flight.Do nothing if not reliable."""
+        payloads = self.pop_receipts(items)
+        if not payloads:
+            return
+        tr = self.redis_conn.multi_exec()
+        tr.zrem(self.inflight_key, *payloads)
+        tr.hdel(self.inflight_score_key, *payloads)
+        await tr.execute()
+
+    async def requeue_expired(self, n=catty.config.QUEUE['BATCH_SIZE']) -> int:
+        """Move at most n in-flight items which are out of visibility_timeout back to the queue"""
+        return await self.redis_conn.eval(self.REQUEUE_SCRIPT, keys=[self.name, self.inflight_key,
+                                                                     self.inflight_score_key, self.signal_key],
+                                          args=[time.time(), n])
+
+    async def inflight_size(self) -> int:
+        return await self.redis_conn.zcard(self.inflight_key)
+
     async def get(self):
+        return (await self.get_many(1))[0]
+
+    async def get_many(self, n):
+        """Pop at most n items in one round trip.Raise Empty if the queue is empty."""
+        if self.reliable:
+            result = await self.redis_conn.eval(
+                self.POP_RELIABLE_SCRIPT, keys=[self.name, self.inflight_key, self.inflight_score_key],
+                args=[n, time.time() + self.visibility_timeout])
+            remaining, result = result[0], result[1:]
+            count = len(result)
+        else:
+            tr = self.redis_conn.multi_exec()
+            tr.zrange(self.name, 0, n - 1)
+            tr.zremrangebyrank(self.name, 0, n - 1)
+            tr.zcard(self.name)
+            result, count, remaining = await tr.execute()
+        if not result:
+            raise self.Empty
+
+        await self.notify_drained(remaining, count)
+        return self.receive(result)
+
+    async def get_wait(self, timeout=catty.config.QUEUE['BLOCK_TIMEOUT']):
+        """
+        Block until an item is pushed(BZPOPMIN on a dedicated connection of the pool).
+        Raise Empty if nothing come in timeout seconds.
+        A reliable queue BLPOP the signal instead & pop by POP_RELIABLE_SCRIPT,so an item is always in the queue
+        or in-flight.Each put wake up one waiter,the others wait for the next put or the timeout.
+        """
+        if self.reliable:
+            return await self._get_wait_signal(timeout)
+
+        pool = await self.conn_pool()
+        with await pool as conn:
+            result = await conn.execute(b'BZPOPMIN', self.name, timeout)
+        if not result:
+            raise self.Empty
+        return self.receive([result[1]])[0]
+
+    async def _get_wait_signal(self, timeout):
+        """get_many(1) until it get an item,BLPOP the signal between them"""
+        deadline = self.loop.time() + timeout
+        while True:
+            try:
+                return (await self.get_many(1))[0]
+            except self.Empty:
+                pass
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                raise self.Empty
+            pool = await self.conn_pool()
+            with await pool as conn:
+                await conn.execute(b'BLPOP', self.signal_key, max(1, int(remaining)))
+
+    async def _zadd(self, pairs: list):
+        """ZADD the (score,member) pairs,and push the signal if it is reliable"""
+        if not self.reliable:
+            await self.redis_conn.zadd(self.name, *pairs)
+            return
         tr = self.redis_conn.multi_exec()
-        tr.zrange(self.name, 0, 0)
-        tr.zremrangebyrank(self.name, 0, 0)
-        result, count = await tr.execute()
+        tr.zadd(self.name, *pairs)
+        tr.lpush(self.signal_key, 1)
+        tr.ltrim(self.signal_key, 0, 0)
+        await tr.execute()
+
+    async def put(self, item, block=True):
+        """
+        :param block:   wait for the space if the queue is full.Don't block the consumer of this queue,
+                        or the consumer wait for itself
+        """
+        if block:
+            await self.wait_for_space()
+        priority, item = self._get_priority(item)
+        await self._zadd([priority, self.dumps(item)])
+        self.last_qsize += 1
+        return True
+
+    async def put_many(self, items, block=True):
+        """Push all the items in one ZADD"""
+        if block:
+            await self.wait_for_space()
+        pairs = []
+        for item in items:
+            priority, item = self._get_priority(item)
+            pairs.extend((priority, self.dumps(item)))
+        if pairs:
+            await self._zadd(pairs)
+            self.last_qsize += len(pairs) // 2
+        return True
+
+    async def clear(self):
+        try:
+            await self.redis_conn.delete(self.name, self.inflight_key, self.inflight_score_key, self.signal_key)
+        except:
+            pass
+
+
+class AsyncRedisDelayQueue(AsyncRedisPriorityQueue):
+    """
+    A ZSET scored by the due time(unix time).get & get_many only pop the items whose due time had come,
+    so a delayed item cost nothing but a member in redis,and it survive the restart of the workers.
+    put accept (delay,item) like (priority,item) of AsyncRedisPriorityQueue.
+    """
+
+    POP_DUE_SCRIPT = """
+    local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+    if #items > 0 then
+        redis.call('ZREM', KEYS[1], unpack(items))
+    end
+    return items
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncRedisDelayQueue, self).__init__(*args, **kwargs)
+        # a due item is moved to another queue at once,it is never in-flight
+        self.reliable = False
+
+    @staticmethod
+    def _get_priority(item):
+        """Return the (due time,item) of an item.The item can be a (delay,item) tuple."""
+        if isinstance(item, tuple):
+            return time.time() + item[0], item[1]
+        else:
+            return time.time(), item
+
+    async def get_many(self, n):
+        """Pop at most n due items in one round trip.Raise Empty if none is due."""
+        result = await self.redis_conn.eval(self.POP_DUE_SCRIPT, keys=[self.name], args=[time.time(), n])
         if not result:
             raise self.Empty
 
-        return pickle.loads(result[0])
+        return self.receive(result)
 
-    async def put(self, item):
-        # FIXME:the limit of queue size make out of memory
-        # is_full = await self.full()
-        # if is_full:
-        #     raise self.Full
+    async def get_wait(self, timeout=catty.config.QUEUE['BLOCK_TIMEOUT']):
+        """
+        Wait until an item is due.Sleep until the earliest due time(at most LOAD_QUEUE_INTERVAL,
+        an earlier item may be put meanwhile) and pop again.Raise Empty if nothing is due in timeout seconds.
+        """
+        deadline = time.time() + timeout
+        while True:
+            try:
+                return (await self.get_many(1))[0]
+            except self.Empty:
+                pass
+            now = time.time()
+            if now >= deadline:
+                raise self.Empty
+            earliest = await self.redis_conn.zrange(self.name, 0, 0, withscores=True)
+            wait = earliest[0][1] - now if earliest else catty.config.LOAD_QUEUE_INTERVAL
+            await asyncio.sleep(max(0.0, min(wait, catty.config.LOAD_QUEUE_INTERVAL, deadline - now)), loop=self.loop)
+
+
+class AsyncRedisFairQueue(AsyncRedisPriorityQueue):
+    """
+    A ZSET per spider('<name>:queue:<spider_name>'),popped by deficit round robin,so a spider with a deep
+    high-priority backlog can't starve the others.In each turn a spider get weight * quantum credits,
+    and each popped task cost one credit.The priority only orders the tasks of the same spider.
+
+        <name>:ring     LIST of the spiders which have tasks,the head is the spider of the current turn
+        <name>:active   SET of the spiders in the ring
+        <name>:weights  HASH spider -> weight,see set_weight
+        <name>:deficit  HASH spider -> unused credits
+        <name>:popped   HASH spider -> total popped tasks
+        <name>:signal   LIST to wake up a blocked get_wait
+        <name>:size     the number of tasks in all the spider queues
+    """
+
+    # ARGV: prefix of the spider queues,then [spider_name, count, score, member...] for each spider
+    PUSH_SCRIPT = """
+    local p = 2
+    while p <= #ARGV do
+        local spider = ARGV[p]
+        local count = tonumber(ARGV[p + 1])
+        local args = {}
+        for i = p + 2, p + 1 + count * 2 do
+            table.insert(args, ARGV[i])
+        end
+        redis.call('INCRBY', KEYS[7], redis.call('ZADD', ARGV[1] .. spider, unpack(args)))
+        if redis.call('SADD', KEYS[2], spider) == 1 then
+            redis.call('RPUSH', KEYS[1], spider)
+        end
+        p = p + 2 + count * 2
+    end
+    redis.call('LPUSH', KEYS[6], 1)
+    redis.call('LTRIM', KEYS[6], 0, 0)
+    """
+
+    # ARGV: prefix of the spider queues,n,quantum,default weight,deadline of the in-flight items(0 if not reliable).
+    # Return {size,items...}
+    POP_SCRIPT = """
+    local n = tonumber(ARGV[2])
+    local quantum = tonumber(ARGV[3])
+    local deadline = tonumber(ARGV[5])
+    local items = {0}
+    while #items <= n do
+        local spider = redis.call('LINDEX', KEYS[1], 0)
+        if not spider then
+            break
+        end
+        local q = ARGV[1] .. spider
+        local deficit = tonumber(redis.call('HGET', KEYS[4], spider) or '0')
+        if deficit < 1 then
+            -- a new turn
+            deficit = deficit + quantum * tonumber(redis.call('HGET', KEYS[3], spider) or ARGV[4])
+        end
+        local take = math.min(math.floor(deficit), n + 1 - #items)
+        if take > 0 then
+            local got = redis.call('ZRANGE', q, 0, take - 1, 'WITHSCORES')
+            local count = #got / 2
+            if count > 0 then
+                redis.call('ZREMRANGEBYRANK', q, 0, count - 1)
+                redis.call('HINCRBY', KEYS[5], spider, count)
+                for i = 1, #got, 2 do
+                    table.insert(items, got[i])
+                    if deadline > 0 then
+                        redis.call('ZADD', KEYS[8], deadline, got[i])
+                        redis.call('HSET', KEYS[9], got[i], got[i + 1] .. ':' .. spider)
+                    end
+                end
+            end
+            deficit = deficit - count
+        end
+        if redis.call('ZCARD', q) == 0 then
+            -- an idle spider don't save its credits
+            redis.call('LPOP', KEYS[1])
+            redis.call('SREM', KEYS[2], spider)
+            redis.call('HDEL', KEYS[4], spider)
+        else
+            redis.call('HSET', KEYS[4], spider, deficit)
+            if deficit < 1 then
+                -- the turn is over
+                redis.call('RPUSH', KEYS[1], redis.call('LPOP', KEYS[1]))
+            end
+        end
+    end
+    items[1] = redis.call('DECRBY', KEYS[7], #items - 1)
+    return items
+    """
+
+    # ARGV: prefix of the spider queues,now,n.Return the number of the requeued items
+    REQUEUE_SCRIPT = """
+    local items = redis.call('ZRANGEBYSCORE', KEYS[8], '-inf', ARGV[2], 'LIMIT', 0, ARGV[3])
+    for _, item in ipairs(items) do
+        local value = redis.call('HGET', KEYS[9], item)
+        if value then
+            local sep = string.find(value, ':', 1, true)
+            local spider = string.sub(value, sep + 1)
+            redis.call('INCRBY', KEYS[7], redis.call('ZADD', ARGV[1] .. spider, string.sub(value, 1, sep - 1), item))
+            if redis.call('SADD', KEYS[2], spider) == 1 then
+                redis.call('RPUSH', KEYS[1], spider)
+            end
+        end
+        redis.call('ZREM', KEYS[8], item)
+        redis.call('HDEL', KEYS[9], item)
+    end
+    if #items > 0 then
+        redis.call('LPUSH', KEYS[6], 1)
+        redis.call('LTRIM', KEYS[6], 0, 0)
+    end
+    return #items
+    """
+
+    def __init__(self, name, loop, host='localhost', port=6379, db=0,
+                 queue_maxsize=10000, password=None, pool_maxsize=10, serializer=None,
+                 compress_threshold=catty.config.QUEUE['COMPRESS_THRESHOLD'],
+                 aging_rate=catty.config.QUEUE['AGING_RATE'],
+                 age_stats=catty.config.QUEUE['AGE_STATS'],
+                 reliable=catty.config.QUEUE['RELIABLE'],
+                 visibility_timeout=catty.config.QUEUE['VISIBILITY_TIMEOUT'],
+                 quantum=catty.config.QUEUE['FAIR_QUANTUM']):
+        """
+        :param quantum:     the credits of a spider of weight 1 in each turn
+        """
+        super(AsyncRedisFairQueue, self).__init__(name, loop, host, port, db, queue_maxsize, password, pool_maxsize,
+                                                  serializer, compress_threshold, aging_rate, age_stats, reliable,
+                                                  visibility_timeout)
+        self.quantum = quantum
+        self.queue_prefix = name + ':queue:'
+        self.keys = [name + ':ring', name + ':active', name + ':weights', name + ':deficit', name + ':popped',
+                     name + ':signal', name + ':size']
+        self.ring_key, self.active_key, self.weights_key, self.deficit_key, self.popped_key, self.signal_key, \
+            self.size_key = self.keys
+        # the in-flight score is '<score>:<spider_name>',to requeue it to its spider
+        self.reliable_keys = self.keys + [self.inflight_key, self.inflight_score_key]
+
+    async def set_weight(self, spider_name: str, weight: float):
+        """The share of the spider is weight / the sum of the weights of the spiders which have tasks"""
+        if weight <= 0:
+            raise ValueError("The weight must be positive:{}".format(weight))
+        await self.redis_conn.hset(self.weights_key, spider_name, weight)
+
+    async def popped_counts(self) -> dict:
+        """{spider_name: the total number of popped tasks}"""
+        result = await self.redis_conn.hgetall(self.popped_key)
+        return {k.decode(): int(v) for k, v in result.items()}
+
+    async def qsize(self):
+        try:
+            self.last_qsize = int(await self.redis_conn.get(self.size_key) or 0)
+            self.last_qsize_time = time.time()
+            return self.last_qsize
+        except:
+            pass
+
+    async def get_many(self, n):
+        """Pop at most n items of the spiders in turn.Raise Empty if the queue is empty."""
+        result = await self.redis_conn.eval(
+            self.POP_SCRIPT, keys=self.reliable_keys,
+            args=[self.queue_prefix, n, self.quantum, catty.config.SPIDER_DEFAULT['WEIGHT'],
+                  time.time() + self.visibility_timeout if self.reliable else 0])
+        remaining, result = result[0], result[1:]
+        if not result:
+            raise self.Empty
+
+        await self.notify_drained(remaining, len(result))
+        return self.receive(result)
+
+    async def requeue_expired(self, n=catty.config.QUEUE['BATCH_SIZE']) -> int:
+        return await self.redis_conn.eval(self.REQUEUE_SCRIPT, keys=self.reliable_keys,
+                                          args=[self.queue_prefix, time.time(), n])
+
+    async def get_wait(self, timeout=catty.config.QUEUE['BLOCK_TIMEOUT']):
+        """
+        Block until an item is pushed(BLPOP the signal on a dedicated connection of the pool).
+        Each push wake up one waiter,the others wait for the next push or the timeout.
+        Raise Empty if nothing come in timeout seconds.
+        """
+        return await self._get_wait_signal(timeout)
+
+    async def put(self, item, block=True):
+        return await self.put_many([item], block)
+
+    async def put_many(self, items, block=True):
+        """Push all the items in one round trip"""
+        if block:
+            await self.wait_for_space()
+        spiders = {}
+        for item in items:
+            priority, item = self._get_priority(item)
+            spiders.setdefault(item['spider_name'], []).extend((priority, self.dumps(item)))
+        if spiders:
+            args = [self.queue_prefix]
+            for spider_name, pairs in spiders.items():
+                args.extend((spider_name, len(pairs) // 2))
+                args.extend(pairs)
+            await self.redis_conn.eval(self.PUSH_SCRIPT, keys=self.keys, args=args)
+            self.last_qsize += len(items)
+        return True
+
+    async def clear(self):
+        try:
+            spiders = await self.redis_conn.smembers(self.active_key)
+            await self.redis_conn.delete(self.name, self.inflight_key, self.inflight_score_key, *self.keys,
+                                         *[self.queue_prefix + spider.decode() for spider in spiders])
+        except:
+            pass
+
+
+class AsyncRedisStreamQueue(AsyncRedisPriorityQueue):
+    """
+    Redis Streams read by a consumer group,so many downloaders or parsers share the tasks without racing on a ZSET.
+    A priority level is a stream('<name>:stream:<i>'),priorities are the lowest priority of each level in
+    descending order and the last stream take the rest.A level is read only when the higher levels are empty.
+    Each process is a consumer of the group,the read entries are pending on it until they are acked(see pending).
+    A queue which is not reliable read with NOACK & delete the read entries in one script(READ_DELETE_SCRIPT),
+    so nothing is pending,and an entry is never left in a stream after the group had passed it.
+    The acked entries are deleted,so the streams only hold the unread & pending tasks.
+    """
+
+    # KEYS: the streams from the highest level.ARGV: group,consumer,count.
+    # Return {{stream,id,payload...},{the last generated id of each stream if nothing is read}}
+    READ_DELETE_SCRIPT = """
+    local count = tonumber(ARGV[3])
+    local entries = {}
+    for _, stream in ipairs(KEYS) do
+        if count <= 0 then
+            break
+        end
+        local reply = redis.call('XREADGROUP', 'GROUP', ARGV[1], ARGV[2], 'COUNT', count, 'NOACK',
+                                 'STREAMS', stream, '>')
+        if reply then
+            for _, entry in ipairs(reply[1][2]) do
+                local payload = false
+                for i = 1, #entry[2], 2 do
+                    if entry[2][i] == 'd' then
+                        payload = entry[2][i + 1]
+                    end
+                end
+                redis.call('XDEL', stream, entry[1])
+                table.insert(entries, stream)
+                table.insert(entries, entry[1])
+                table.insert(entries, payload)
+                count = count - 1
+            end
+        end
+    end
+    local last_ids = {}
+    if #entries == 0 then
+        for i, stream in ipairs(KEYS) do
+            local info = redis.call('XINFO', 'STREAM', stream)
+            for j = 1, #info, 2 do
+                if info[j] == 'last-generated-id' then
+                    last_ids[i] = info[j + 1]
+                end
+            end
+        end
+    end
+    return {entries, last_ids}
+    """
+
+    def __init__(self, name, loop, host='localhost', port=6379, db=0,
+                 queue_maxsize=10000, password=None, pool_maxsize=10, serializer=None,
+                 compress_threshold=catty.config.QUEUE['COMPRESS_THRESHOLD'],
+                 age_stats=catty.config.QUEUE['AGE_STATS'],
+                 reliable=catty.config.QUEUE['RELIABLE'],
+                 visibility_timeout=catty.config.QUEUE['VISIBILITY_TIMEOUT'],
+                 priorities=catty.config.QUEUE['STREAM_PRIORITIES'],
+                 group=catty.config.QUEUE['STREAM_GROUP'],
+                 consumer=None):
+        """
+        :param priorities:  the lowest priority of each stream but the last one
+        :param group:       the consumer group
+        :param consumer:    the name of this consumer,'<hostname>-<pid>' by default
+        """
+        # the score is never used,so there is no aging
+        super(AsyncRedisStreamQueue, self).__init__(name, loop, host, port, db, queue_maxsize, password,
+                                                    pool_maxsize, serializer, compress_threshold, 0, age_stats,
+                                                    reliable, visibility_timeout)
+        self.priorities = sorted(priorities, reverse=True)
+        self.streams = ['{}:stream:{}'.format(name, i) for i in range(len(self.priorities) + 1)]
+        self.group = group
+        self.consumer = consumer or '{}-{}'.format(socket.gethostname(), os.getpid())
+        # the entries of a reliable blocking read on all the streams but the first one
+        self.buffer = deque()
+        self.group_created = False
+
+    async def conn(self):
+        await super(AsyncRedisStreamQueue, self).conn()
+        if not self.group_created:
+            for stream in self.streams:
+                try:
+                    await self.redis_conn.xgroup_create(stream, self.group, latest_id='0', mkstream=True)
+                except aioredis.ReplyError as e:
+                    if 'BUSYGROUP' not in str(e):
+                        raise
+            self.group_created = True
+        return self.redis_conn
+
+    def level(self, priority) -> int:
+        """The index of the stream of the priority"""
+        for i, lowest in enumerate(self.priorities):
+            if priority >= lowest:
+                return i
+        return len(self.priorities)
+
+    @staticmethod
+    def _parse(result) -> list:
+        """XREADGROUP/XAUTOCLAIM reply -> [(stream,id,payload)],the payload is None if the entry had been deleted"""
+        entries = []
+        for stream, stream_entries in result or ():
+            for entry_id, fields in stream_entries:
+                fields = dict(zip(fields[::2], fields[1::2])) if fields else {}
+                entries.append((stream, entry_id, fields.get(b'd')))
+        return entries
+
+    async def _read(self, conn, streams, count, block=None) -> list:
+        args = [b'XREADGROUP', b'GROUP', self.group, self.consumer, b'COUNT', count]
+        if block is not None:
+            args.extend((b'BLOCK', block))
+        args.append(b'STREAMS')
+        args.extend(streams)
+        args.extend([b'>'] * len(streams))
+        try:
+            entries = self._parse(await conn.execute(*args))
+        except aioredis.ReplyError as e:
+            if 'NOGROUP' not in str(e):
+                raise
+            # the streams had been cleared
+            self.group_created = False
+            await self.conn()
+            return []
+        return entries
+
+    async def _read_delete(self, count) -> tuple:
+        """Run READ_DELETE_SCRIPT,return ([(stream,id,payload)],[the last id of each stream if nothing is read])"""
+        try:
+            result = await self.redis_conn.eval(self.READ_DELETE_SCRIPT, keys=self.streams,
+                                                args=[self.group, self.consumer, count])
+        except aioredis.ReplyError as e:
+            if 'NOGROUP' not in str(e):
+                raise
+            self.group_created = False
+            await self.conn()
+            return [], []
+        entries, last_ids = result
+        return [tuple(entries[i:i + 3]) for i in range(0, len(entries), 3)], last_ids
+
+    def _receive_entries(self, entries) -> list:
+        """receive the entries,the receipt of an entry is (stream,id)"""
+        return self.receive([payload for _, _, payload in entries],
+                            [(stream, entry_id) for stream, entry_id, _ in entries])
+
+    async def _ack_entries(self, entries):
+        tr = self.redis_conn.multi_exec()
+        for stream, entry_id in entries:
+            tr.xack(stream, self.group, entry_id)
+            tr.xdel(stream, entry_id)
+        await tr.execute()
+
+    async def ack(self, *items):
+        entries = self.pop_receipts(items)
+        if entries:
+            await self._ack_entries(entries)
+
+    async def requeue_expired(self, n=catty.config.QUEUE['BATCH_SIZE']) -> int:
+        """Claim the entries pending longer than visibility_timeout(XAUTOCLAIM) & add them to the streams again"""
+        count = 0
+        for stream in self.streams:
+            result = await self.redis_conn.execute(b'XAUTOCLAIM', stream, self.group, self.consumer,
+                                                   int(self.visibility_timeout * 1000), b'0-0', b'COUNT', n)
+            entries = self._parse([(stream, result[1])])
+            if not entries:
+                continue
+            tr = self.redis_conn.multi_exec()
+            for _, entry_id, payload in entries:
+                if payload is not None:
+                    tr.xadd(stream, {b'd': payload})
+                    count += 1
+                tr.xack(stream, self.group, entry_id)
+                tr.xdel(stream, entry_id)
+            await tr.execute()
+        return count
+
+    async def pending(self) -> dict:
+        """{consumer: the number of its pending tasks}"""
+        result = {}
+        for stream in self.streams:
+            summary = await self.redis_conn.xpending(stream, self.group)
+            for consumer, count in summary[3] or ():
+                consumer = consumer.decode()
+                result[consumer] = result.get(consumer, 0) + int(count)
+        return result
+
+    async def inflight_size(self) -> int:
+        return sum((await self.pending()).values())
+
+    async def qsize(self):
+        """The unread tasks"""
+        try:
+            tr = self.redis_conn.pipeline()
+            for stream in self.streams:
+                tr.xlen(stream)
+                tr.xpending(stream, self.group)
+            result = await tr.execute()
+            self.last_qsize = sum(result[0::2]) - sum(summary[0] for summary in result[1::2])
+            self.last_qsize_time = time.time()
+            return self.last_qsize
+        except:
+            pass
+
+    async def get_many(self, n):
+        """Read at most n tasks of the highest levels.Raise Empty if all the streams are empty."""
+        if not self.reliable:
+            entries, _ = await self._read_delete(n)
+        else:
+            entries = []
+            while self.buffer and len(entries) < n:
+                entries.append(self.buffer.popleft())
+            for stream in self.streams:
+                if len(entries) >= n:
+                    break
+                entries.extend(await self._read(self.redis_conn, [stream], n - len(entries)))
+        if not entries:
+            raise self.Empty
+
+        if self.high_watermark:
+            await self.notify_drained(await self.qsize() or 0, len(entries))
+        return self._receive_entries(entries)
+
+    async def get_wait(self, timeout=catty.config.QUEUE['BLOCK_TIMEOUT']):
+        """
+        Block until a task is added to any stream(XREADGROUP BLOCK on a dedicated connection of the pool).
+        Raise Empty if nothing come in timeout seconds.
+        A queue which is not reliable XREAD BLOCK from the last ids of the streams instead,and read & delete
+        by READ_DELETE_SCRIPT when it is woken up.
+        """
+        if not self.reliable:
+            return await self._get_wait_deleting(timeout)
+
+        try:
+            return (await self.get_many(1))[0]
+        except self.Empty:
+            pass
+
+        pool = await self.conn_pool()
+        with await pool as conn:
+            entries = await self._read(conn, self.streams, 1, int(timeout * 1000))
+        if not entries:
+            raise self.Empty
+
+        # a read on many streams return an entry of each stream which had got one
+        entries.sort(key=lambda entry: self.streams.index(entry[0].decode()))
+        self.buffer.extend(entries[1:])
+        return self._receive_entries(entries[:1])[0]
+
+    async def _get_wait_deleting(self, timeout):
+        deadline = self.loop.time() + timeout
+        while True:
+            entries, last_ids = await self._read_delete(1)
+            if entries:
+                if self.high_watermark:
+                    await self.notify_drained(await self.qsize() or 0, len(entries))
+                return self._receive_entries(entries)[0]
+            remaining = deadline - self.loop.time()
+            if remaining <= 0 or not last_ids:
+                raise self.Empty
+            # an entry added after the script wake it up at once
+            pool = await self.conn_pool()
+            with await pool as conn:
+                await conn.execute(b'XREAD', b'COUNT', 1, b'BLOCK', max(1, int(remaining * 1000)),
+                                   b'STREAMS', *self.streams, *last_ids)
+
+    async def put(self, item, block=True):
+        return await self.put_many([item], block)
+
+    async def put_many(self, items, block=True):
+        """Add the items to the streams of their priorities in one round trip"""
+        if block:
+            await self.wait_for_space()
+        if not items:
+            return True
+        tr = self.redis_conn.pipeline()
+        for item in items:
+            if isinstance(item, tuple):
+                priority, item = item
+            else:
+                priority = get_default(item, 'priority', 0)
+            tr.xadd(self.streams[self.level(priority)], {b'd': self.dumps(item)})
+        await tr.execute()
+        self.last_qsize += len(items)
+        return True
+
+    async def clear(self):
+        try:
+            await self.redis_conn.delete(*self.streams)
+            self.group_created = False
+            self.buffer.clear()
+        except:
+            pass
+
+
+class AsyncLocalPriorityQueue(object):
+    """
+    An in-process heap with the interface of AsyncRedisPriorityQueue,for a standalone crawler which run
+    all the components on one event loop(see tests/run_standalone.py).
+    The items are passed by reference without serializing,so a producer must not change an item after putting it.
+    A Task is ordered by Task.__lt__(the higher priority first),the items of the same priority are FIFO.
+    Everything in it is lost when the process exit,so it is never reliable.
+    """
+    Empty = AsyncQueueEmpty
+    Full = AsyncQueueFull
+
+    def __init__(self, name, loop, queue_maxsize=10000,
+                 aging_rate=catty.config.QUEUE['AGING_RATE'],
+                 age_stats=catty.config.QUEUE['AGE_STATS'],
+                 **kwargs):
+        """
+        :param kwargs:  the other args of AsyncRedisPriorityQueue(host,serializer,reliable...),they are ignored
+        """
+        self.name = name
+        self.loop = loop
+        self.queue_maxsize = queue_maxsize
+        self.high_watermark, self.low_watermark = catty.config.QUEUE['WATERMARKS'].get(
+            name, (queue_maxsize, int(queue_maxsize * catty.config.QUEUE['LOW_WATERMARK'])))
+        self.aging_rate = aging_rate
+        self.age_stats = age_stats
+        self.ages = deque(maxlen=catty.config.QUEUE['AGE_SAMPLES'])
+        self.reliable = False
+        # there is no connection,conn() do nothing
+        self.redis_conn = None
+
+        # [key,sequence,enqueue time,item]
+        self.heap = []
+        self.sequence = itertools.count()
+        self.not_empty = asyncio.Event(loop=loop)
+        # set when a pop fall to the low watermark
+        self.drained = asyncio.Event(loop=loop)
+
+    def __repr__(self):
+        return self.name
+
+    async def conn(self):
+        return self
+
+    async def qsize(self):
+        return len(self.heap)
+
+    async def empty(self):
+        return not self.heap
+
+    async def full(self):
+        return bool(self.queue_maxsize) and len(self.heap) >= self.queue_maxsize
+
+    def queue_age(self) -> dict:
+        return AsyncRedisPriorityQueue.queue_age(self)
+
+    def compress_stats(self) -> dict:
+        # nothing is serialized
+        return {'raw_bytes': 0, 'stored_bytes': 0, 'saved_bytes': 0, 'compressed_count': 0}
+
+    def _entry(self, item) -> list:
+        """Return the heap entry of an item.The item can be a (priority,item) tuple."""
         if isinstance(item, tuple):
-            priority = -item[0]
-            item = item[1]
+            priority, item = item
+            key = PriorityDict(priority=priority)
+        elif isinstance(item, PriorityDict) and 'priority' in item:
+            key = item
         else:
-            priority = -get_default(item, 'priority', 0)
-        await self.redis_conn.zadd(self.name, priority, pickle.dumps(item))
+            key = PriorityDict(priority=get_default(item, 'priority', 0))
+        if self.aging_rate:
+            key = PriorityDict(priority=key['priority'] - self.aging_rate * time.time())
+        return [key, next(self.sequence), time.time() if self.age_stats else 0, item]
+
+    def _pop(self, n) -> list:
+        items = []
+        now = time.time()
+        while self.heap and len(items) < n:
+            key, sequence, enqueue_time, item = heapq.heappop(self.heap)
+            if self.age_stats:
+                self.ages.append(now - enqueue_time)
+            items.append(item)
+        if not self.heap:
+            self.not_empty.clear()
+        remaining = len(self.heap)
+        if self.high_watermark and remaining <= self.low_watermark < remaining + len(items):
+            self.drained.set()
+        return items
+
+    async def wait_for_space(self):
+        """Return at once if the size is under the high watermark,or wait until it fall to the low watermark"""
+        if not self.high_watermark or len(self.heap) < self.high_watermark:
+            return
+        while len(self.heap) > self.low_watermark:
+            self.drained.clear()
+            await self.drained.wait()
+
+    async def ack(self, *items):
+        pass
+
+    async def requeue_expired(self, n=catty.config.QUEUE['BATCH_SIZE']) -> int:
+        return 0
+
+    async def inflight_size(self) -> int:
+        return 0
+
+    async def get(self):
+        return (await self.get_many(1))[0]
+
+    async def get_many(self, n):
+        """Pop at most n items.Raise Empty if the queue is empty."""
+        items = self._pop(n)
+        if not items:
+            raise self.Empty
+        return items
+
+    async def get_wait(self, timeout=catty.config.QUEUE['BLOCK_TIMEOUT']):
+        """Wait until an item is put.Raise Empty if nothing come in timeout seconds."""
+        deadline = self.loop.time() + timeout
+        while not self.heap:
+            try:
+                await asyncio.wait_for(self.not_empty.wait(), deadline - self.loop.time(), loop=self.loop)
+            except asyncio.TimeoutError:
+                raise self.Empty
+        return self._pop(1)[0]
+
+    async def put(self, item, block=True):
+        """
+        :param block:   wait for the space if the queue is full.Don't block the consumer of this queue,
+                        or the consumer wait for itself
+        """
+        if block:
+            await self.wait_for_space()
+        heapq.heappush(self.heap, self._entry(item))
+        self.not_empty.set()
+        return True
+
+    async def put_many(self, items, block=True):
+        if block:
+            await self.wait_for_space()
+        for item in items:
+            heapq.heappush(self.heap, self._entry(item))
+        if self.heap:
+            self.not_empty.set()
         return True
 
+    async def clear(self):
+        self.heap.clear()
+        self.not_empty.clear()
+        self.drained.set()
+
+
+def create_queue(name, loop, fair=False, **kwargs) -> AsyncRedisPriorityQueue:
+    """
+    Return a queue of QUEUE['BACKEND']:
+        'zset':     AsyncRedisPriorityQueue,or AsyncRedisFairQueue if fair
+        'stream':   AsyncRedisStreamQueue,fair is ignored
+        'local':    AsyncLocalPriorityQueue,fair is ignored.Only for the standalone mode
+    """
+    backend = catty.config.QUEUE['BACKEND']
+    if backend == 'local':
+        return AsyncLocalPriorityQueue(name, loop, **kwargs)
+    elif backend == 'stream':
+        return AsyncRedisStreamQueue(name, loop, **kwargs)
+    elif backend == 'zset':
+        if fair:
+            return AsyncRedisFairQueue(name, loop, **kwargs)
+        return AsyncRedisPriorityQueue(name, loop, **kwargs)
+    raise ValueError("Unknow queue backend:{}".format(backend))
+
+
+def create_requests_queue(spider_name, loop) -> AsyncRedisPriorityQueue:
+    """The unbounded requests queue of a spider,a ZSET unless QUEUE['BACKEND'] is 'local'"""
+    name = "{}:requests".format(spider_name)
+    if catty.config.QUEUE['BACKEND'] == 'local':
+        return AsyncLocalPriorityQueue(name, loop, queue_maxsize=0)
+    return AsyncRedisPriorityQueue(name, loop=loop, queue_maxsize=0)
+
 
 async def get_task(q):
     """
@@ -143,22 +1192,94 @@ async def get_task(q):
         return
 
 
-async def push_task(q, task, loop):
+async def get_tasks(q, n=catty.config.QUEUE['BATCH_SIZE'], block=False):
+    """
+    Get at most n tasks from queue in one round trip.Return a empty list if queue is empty.
+    :param q:       Redis-Queue
+    :param n:       The max number of tasks
+    :param block:   Wait for the first task instead of returning at once if the queue is empty
+    """
+    try:
+        if not block:
+            return await q.get_many(n)
+
+        tasks = [await q.get_wait()]
+        if n > 1:
+            try:
+                tasks.extend(await q.get_many(n - 1))
+            except AsyncQueueEmpty:
+                pass
+        return tasks
+    except AttributeError:
+        await q.conn()
+    except AsyncQueueEmpty:
+        pass
+    except Exception:
+        traceback.print_exc()
+        await q.conn()
+        if block:
+            # the caller will call again at once,don't make it a busy loop
+            await asyncio.sleep(catty.config.LOAD_QUEUE_INTERVAL, loop=q.loop)
+    return []
+
+
+async def push_task(q, task, loop, block=True):
     """
     Push a task to ququq
     :param q:       Redis-Queue
+    :param block:   Wait for the space if the queue is full
     """
     done = False
     while not done:
         try:
-            if await q.put(task):
+            if await q.put(task, block):
                 done = True
         except AttributeError:
             await q.conn()
         except AsyncQueueFull:
-            # FIXME:when the queue full,it run put method all over and all over,it will out of memory
             await asyncio.sleep(catty.config.LOAD_QUEUE_INTERVAL, loop=loop)
         except Exception:
             traceback.print_exc()
             await q.conn()
             await asyncio.sleep(catty.config.LOAD_QUEUE_INTERVAL, loop=loop)
+
+
+async def push_tasks(q, tasks, loop, block=True):
+    """
+    Push a list of tasks to queue in one round trip
+    :param q:       Redis-Queue
+    :param block:   Wait for the space if the queue is full
+    """
+    if not tasks:
+        return
+    done = False
+    while not done:
+        try:
+            if await q.put_many(tasks, block):
+                done = True
+        except AttributeError:
+            await q.conn()
+        except AsyncQueueFull:
+            await asyncio.sleep(catty.config.LOAD_QUEUE_INTERVAL, loop=loop)
+        except Exception:
+            traceback.print_exc()
+            await q.conn()
+            await asyncio.sleep(catty.config.LOAD_QUEUE_INTERVAL, loop=loop)
+
+
+async def requeue_expired_tasks(queues, loop):
+    """
+    Move the expired in-flight tasks of the reliable queues back every QUEUE['REQUEUE_INTERVAL'] seconds.
+    :param queues:  Redis-Queues,it can be a live view like dict.values()
+    """
+    while True:
+        for q in list(queues):
+            if not q.reliable:
+                continue
+            try:
+                await q.requeue_expired()
+            except AttributeError:
+                await q.conn()
+            except Exception:
+                traceback.print_exc()
+        await asyncio.sleep(catty.config.QUEUE['REQUEUE_INTERVAL'], loop=loop)
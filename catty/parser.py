@@ -11,18 +11,22 @@ import threading
 import time
 import traceback
 from asyncio import BaseEventLoop
-from copy import deepcopy
+from copy import copy, deepcopy
 from functools import partial
 
 import catty.config
 from catty import PARSER_SCHEDULER, DOWNLOADER_PARSER
-from catty.message_queue import AsyncRedisPriorityQueue, get_task, push_task
+from catty.message_queue import AsyncRedisPriorityQueue, AsyncRedisDelayQueue, AsyncRedisFairQueue, get_task, \
+    get_tasks, push_task, push_tasks, requeue_expired_tasks
 from catty.handler import HandlerMixin
 from catty.exception import Retry_current_task
+from catty.libs.body_store import FileBodyStore, get_body_store
 from catty.libs.count import Counter
 from catty.libs.handle_module import SpiderModuleHandle
 from catty.libs.log import Log
-from catty.libs.utils import dump_task, load_task, dump_pickle_data, load_pickle_data
+from catty.libs.response import Response
+from catty.libs.retry import get_retry_policy
+from catty.libs.utils import dump_task, load_task, dump_pickle_data, load_pickle_data, is_handled_status
 
 
 class Parser(HandlerMixin):
@@ -31,11 +35,13 @@ class Parser(HandlerMixin):
                  parser_scheduler_queue: AsyncRedisPriorityQueue,
                  scheduler_downloader_queue: AsyncRedisPriorityQueue,
                  loop: BaseEventLoop,
-                 name: str):
+                 name: str,
+                 retry_queue: AsyncRedisDelayQueue = None):
         """
         :param downloader_parser_queue:The redis queue
         :param parser_scheduler_queue:The redis queue
         :param loop:EventLoop
+        :param retry_queue:The delay queue of the retry tasks,None to sleep retry_wait before pushing them back.
         """
         super(Parser, self).__init__()
         self.name = name
@@ -43,6 +49,7 @@ class Parser(HandlerMixin):
         self.downloader_parser_queue = downloader_parser_queue
         self.parser_scheduler_queue = parser_scheduler_queue
         self.scheduler_downloader_queue = scheduler_downloader_queue
+        self.retry_queue = retry_queue
         self.loop = loop
 
         self.spider_started = set()
@@ -63,12 +70,10 @@ class Parser(HandlerMixin):
         tasks = await load_task(catty.config.PERSISTENCE['DUMP_PATH'], '{}_{}'.format(self.name, which_q), spider_name)
         if tasks:
             self.logger.log_it("[load_tasks]Load tasks:{}".format(tasks))
-            for each_task in tasks:
-                # push each task to request-queue
-                if which_q == PARSER_SCHEDULER:
-                    await push_task(self.parser_scheduler_queue, each_task, self.loop)
-                elif which_q == DOWNLOADER_PARSER:
-                    await push_task(self.downloader_parser_queue, each_task, self.loop)
+            if which_q == PARSER_SCHEDULER:
+                await push_tasks(self.parser_scheduler_queue, tasks, self.loop)
+            elif which_q == DOWNLOADER_PARSER:
+                await push_tasks(self.downloader_parser_queue, tasks, self.loop)
 
     async def dump_tasks(self, which_q: str):
         """ dump the task which in queue """
@@ -76,17 +81,26 @@ class Parser(HandlerMixin):
             while await self.parser_scheduler_queue.qsize():
                 task = await get_task(self.parser_scheduler_queue)
                 if task is not None:
-                    await dump_task(task, catty.config.PERSISTENCE['DUMP_PATH'], "{}_{}".format(self.name, which_q),
-                                    task['spider_name'])
+                    await self.dump_task_with_body(task, "{}_{}".format(self.name, which_q))
+                    await self.parser_scheduler_queue.ack(task)
                     self.logger.log_it("[dump_task]Dump task:{}".format(task))
         elif which_q == DOWNLOADER_PARSER:
             while await self.downloader_parser_queue.qsize():
                 task = await get_task(self.downloader_parser_queue)
                 if task is not None:
-                    await dump_task(task, catty.config.PERSISTENCE['DUMP_PATH'], "{}_{}".format(self.name, which_q),
-                                    task['spider_name'])
+                    await self.dump_task_with_body(task, "{}_{}".format(self.name, which_q))
+                    await self.downloader_parser_queue.ack(task)
+                    await self.release_body(task)
                     self.logger.log_it("[dump_task]Dump task:{}".format(task))
 
+    @staticmethod
+    async def dump_task_with_body(task: dict, dump_type: str):
+        """Dump the task with its body instead of the reference,the body store may expire it before it is loaded"""
+        if isinstance(task.get('response'), Response) and task['response'].body_ref:
+            task = copy(task)
+            task['response'] = await task['response'].detach_body()
+        await dump_task(task, catty.config.PERSISTENCE['DUMP_PATH'], dump_type, task['spider_name'])
+
     def dump_count(self):
         counter_date = {'value_d': self.counter.value_d, 'cache_value': self.counter.cache_value}
         root = os.path.join(catty.config.PERSISTENCE['DUMP_PATH'], 'parser')
@@ -154,14 +168,18 @@ class Parser(HandlerMixin):
         # for task in asyncio.Task.all_tasks():
         #     task.cancel()
 
-        if catty.config.PERSISTENCE['PERSIST_BEFORE_EXIT']:
+        # the unacked tasks of a reliable queue will be requeued,no need to dump them
+        if catty.config.PERSISTENCE['PERSIST_BEFORE_EXIT'] and not catty.config.QUEUE['RELIABLE']:
             self.loop.create_task(self.dump_tasks(PARSER_SCHEDULER))
             self.loop.create_task(self.dump_tasks(DOWNLOADER_PARSER))
 
         self.dump_count()
         self.dump_status()
 
-        self.loop.create_task(self.check_end())
+        if catty.config.QUEUE['RELIABLE']:
+            self.ready_to_exit = True
+        else:
+            self.loop.create_task(self.check_end())
 
     def get_spider_method(self, spider_name: str, method_name: str):
         """Return a bound method if spider have this method,return None if not."""
@@ -200,7 +218,7 @@ class Parser(HandlerMixin):
                     parser_return = method(_response)
         except Retry_current_task:
             # handle it like a new task
-            self.loop.create_task(push_task(self.parser_scheduler_queue, task, self.loop))
+            await push_task(self.parser_scheduler_queue, task, self.loop)
             return
         except:
             # The except from user spiders
@@ -214,53 +232,89 @@ class Parser(HandlerMixin):
                 task['parser'].update({'item': parser_return})
             await push_task(self.parser_scheduler_queue, task, self.loop)
         elif isinstance(parser_return, list):
-            # task_list
-            for each_return_task in parser_return:
-                await push_task(self.scheduler_downloader_queue, each_return_task, self.loop)
+            # task_list,never wait for the downloader which may be waiting for this parser
+            await push_tasks(self.scheduler_downloader_queue, parser_return, self.loop, block=False)
         elif parser_return is None:
             pass
 
+    async def handle_and_ack(self, task: dict):
+        """
+        Ack the task after its callbacks had pushed their results,so a reliable queue never lose them.
+        Release the body after the ack,so a redelivered task never refer to a released body.
+        """
+        try:
+            await self.handle_task(task)
+        finally:
+            await self.downloader_parser_queue.ack(task)
+            await self.release_body(task)
+
+    @staticmethod
+    async def release_body(task: dict):
+        if isinstance(task['response'], Response):
+            await task['response'].release_body()
+
+    async def handle_task(self, task: dict):
+        """run the done task & wait for the callbacks pushing their results"""
+        if 'status' in task['response']:
+            if is_handled_status(task, task['response']['status']):
+                self.counter.add_success(task['spider_name'])
+                if task['spider_name'] in self.spider_started:
+                    if isinstance(task['response'], Response):
+                        # fetch the body from the body store before it is copied to each callback
+                        await task['response'].load_body()
+                    callback = task['callback']
+                    spider_name = task['spider_name']
+                    parsers = []
+                    for callback_method_name in callback:
+                        # number of task that parser return depend on the number of callbacks
+                        each_task = deepcopy(task)
+                        parser_method_name = callback_method_name.get('parser', None)
+
+                        if parser_method_name:
+                            parsers.append(self._run_ins_func(spider_name, parser_method_name, each_task))
+                    await asyncio.gather(*parsers, loop=self.loop)
+
+                elif task['spider_name'] in self.spider_paused:
+                    # persist
+                    await self.dump_task_with_body(task, 'parser')
+            else:
+                # a retried task get a new response
+                retried = task.get('retried', 0)
+                delay = get_retry_policy(task['meta']).delay(
+                    task['meta'], retried, task['response']['status'], headers=task['response']['headers'])
+                if delay is not None:
+                    task.update({'retried': retried + 1})
+                    retry_method, _ = self.get_spider_method(task['spider_name'], 'retry')
+
+                    # it could be return a list
+                    retry_tasks = retry_method(task)
+                    if not isinstance(retry_tasks, list):
+                        retry_tasks = [retry_tasks]
+                    if self.retry_queue is not None:
+                        # don't hold the worker,the scheduler will push them back when the delay passed
+                        await push_tasks(self.retry_queue, [(delay, retry_task) for retry_task in retry_tasks],
+                                         self.loop)
+                    else:
+                        self.loop.create_task(self.push_retry_tasks_later(retry_tasks, delay))
+                self.counter.add_fail(task['spider_name'])
+
+    async def push_retry_tasks_later(self, retry_tasks: list, delay: float):
+        """
+        Push the retry tasks back after delay without a retry queue(the standalone mode).
+        It doesn't hold the batch of make_tasks,but the tasks are lost if the process exit while waiting.
+        """
+        await asyncio.sleep(delay, loop=self.loop)
+        await push_tasks(self.scheduler_downloader_queue, retry_tasks, self.loop, block=False)
+
     async def make_tasks(self):
-        """run the done task & push them"""
-        task = await get_task(self.downloader_parser_queue)
-        if task:
+        """get a batch of done tasks & run them"""
+        tasks = await get_tasks(self.downloader_parser_queue, block=catty.config.QUEUE['BLOCKING_GET'])
+        if tasks:
+            self.loop.create_task(self.make_tasks())
+            await asyncio.gather(*[self.handle_and_ack(task) for task in tasks], loop=self.loop)
+        elif catty.config.QUEUE['BLOCKING_GET']:
+            # had waited in get_tasks
             self.loop.create_task(self.make_tasks())
-            if 'status' in task['response']:
-                if 200 <= task['response']['status'] < 400 and \
-                                task['response']['status'] in task['handle_status_code']:
-                    self.counter.add_success(task['spider_name'])
-                    if task['spider_name'] in self.spider_started:
-                        callback = task['callback']
-                        spider_name = task['spider_name']
-                        for callback_method_name in callback:
-                            # number of task that parser return depend on the number of callbacks
-                            each_task = deepcopy(task)
-                            parser_method_name = callback_method_name.get('parser', None)
-
-                            if parser_method_name:
-                                self.loop.create_task(self._run_ins_func(spider_name, parser_method_name, each_task))
-
-                    elif task['spider_name'] in self.spider_paused:
-                        # persist
-                        await dump_task(task, catty.config.PERSISTENCE['DUMP_PATH'], 'parser', task['spider_name'])
-                    elif task['spider_name'] in self.spider_stopped:
-                        pass
-                else:
-                    retry = task['meta']['retry']
-                    retried = task.get('retried', 0)
-                    if retry != 0 and retried < retry:
-                        task.update({'retried': retried + 1})
-                        retry_method, _ = self.get_spider_method(task['spider_name'], 'retry')
-
-                        # it could be return a list
-                        retry_tasks = retry_method(task)
-                        if not isinstance(retry_tasks, list):
-                            retry_tasks = [retry_tasks]
-                        for each_retry_task in retry_tasks:
-                            await asyncio.sleep(task['meta']['retry_wait'], self.loop)
-                            await push_task(self.scheduler_downloader_queue, each_retry_task, self.loop)
-                    self.counter.add_fail(task['spider_name'])
-
         else:
             # if no task in downloader_parser queue,wait it
             self.loop.call_later(catty.config.LOAD_QUEUE_INTERVAL, lambda: self.loop.create_task(self.make_tasks()))
@@ -273,10 +327,48 @@ class Parser(HandlerMixin):
         self.logger.log_it("Bye!", level='INFO')
         os._exit(0)
 
-    def run_parser(self):
+    async def count_downloads(self):
+        """Count the tasks popped by the downloaders of each spider,as spider_name + '_download'"""
+        last = None
+        while True:
+            try:
+                popped = await self.scheduler_downloader_queue.popped_counts()
+            except AttributeError:
+                await self.scheduler_downloader_queue.conn()
+            except Exception:
+                traceback.print_exc()
+            else:
+                if last is not None:
+                    for spider_name, count in popped.items():
+                        self.counter.add(spider_name + '_download', max(0, count - last.get(spider_name, 0)))
+                last = popped
+            await asyncio.sleep(self.counter.interval, loop=self.loop)
+
+    async def clean_bodies(self, body_store: FileBodyStore):
+        """Delete the expired bodies of the file body store every BODY_STORE['CLEAN_INTERVAL'] seconds"""
+        while True:
+            try:
+                count = await self.loop.run_in_executor(None, body_store.clean_expired)
+                if count:
+                    self.logger.log_it("[clean_bodies]Deleted {} expired bodies".format(count))
+            except Exception:
+                traceback.print_exc()
+            await asyncio.sleep(catty.config.BODY_STORE['CLEAN_INTERVAL'], loop=self.loop)
+
+    def start_parser(self):
+        """Create the tasks of parser without running the loop"""
         for i in range(catty.config.NUM_OF_PARSER_MAKE_TASK):
             self.loop.create_task(self.make_tasks())
         self.loop.create_task(self.counter.update())
+        self.loop.create_task(requeue_expired_tasks([self.downloader_parser_queue], self.loop))
+        if self.name == 'master_parser' and isinstance(self.scheduler_downloader_queue, AsyncRedisFairQueue):
+            self.loop.create_task(self.count_downloads())
+        body_store = get_body_store(loop=self.loop)
+        if self.name == 'master_parser' and isinstance(body_store, FileBodyStore) and body_store.ttl:
+            self.loop.create_task(self.clean_bodies(body_store))
+
+    def run_parser(self):
+        self.start_parser()
         self.loop.run_forever()
 
     def run(self):
@@ -5,7 +5,6 @@
 #         http://blog.vincentzhong.cn
 # Created on 2017/2/24 13:14
 import asyncio
-import math
 import os
 import threading
 import time
@@ -14,10 +13,13 @@ from functools import partial
 
 import catty.config
 from catty import SCHEDULER_DOWNLOADER
-from catty.message_queue import AsyncRedisPriorityQueue, get_task, push_task
+from catty.message_queue import AsyncRedisPriorityQueue, AsyncRedisDelayQueue, AsyncRedisFairQueue, get_task, \
+    get_tasks, push_task, push_tasks, requeue_expired_tasks, create_requests_queue
 from catty.handler import HandlerMixin
-from catty.libs.bloom_filter import RedisBloomFilter
+from catty.libs.bloom_filter import RedisBloomFilter, ScalableRedisBloomFilter, TimeWindowBloomFilter, \
+    MmapBloomFilter
 from catty.libs.handle_module import SpiderModuleHandle
+from catty.libs.limiter import TokenBucket
 from catty.libs.log import Log
 from catty.libs.utils import get_default, Task, dump_task, load_task, dump_pickle_data, load_pickle_data
 
@@ -27,19 +29,24 @@ class Scheduler(HandlerMixin):
                  scheduler_downloader_queue: AsyncRedisPriorityQueue,
                  parser_scheduler_queue: AsyncRedisPriorityQueue,
                  loop: asyncio.BaseEventLoop,
-                 name: str):
+                 name: str,
+                 retry_queue: AsyncRedisDelayQueue = None):
         """
         :param scheduler_downloader_queue:The redis queue
         :param parser_scheduler_queue:The redis queue
         :param loop:EventLoop
+        :param retry_queue:The delay queue of the retry tasks,the due tasks are moved to scheduler_downloader_queue
         """
         super().__init__()
         self.name = name
         self.scheduler_downloader_queue = scheduler_downloader_queue
         self.parser_scheduler_queue = parser_scheduler_queue
+        self.retry_queue = retry_queue
         # connection of all requests-queue
         self.requests_queue_conn = {}
         self.bloom_filter = {}
+        # spider_name -> {window: TimeWindowBloomFilter}
+        self.window_bloom_filter = {}
         self.loop = loop
 
         # spider_ready_start: means that you start a spider,it will run from begin.
@@ -102,15 +109,13 @@ class Scheduler(HandlerMixin):
                                 spider_name)
         if tasks:
             self.logger.log_it("[load_tasks]Load tasks:{}".format(tasks))
-            for each_task in tasks:
-                # push each task to request-queue
-                await push_task(self.scheduler_downloader_queue, each_task, self.loop)
+            await push_tasks(self.scheduler_downloader_queue, tasks, self.loop)
 
     async def dump_tasks(self, spider_name: str):
         """ dump the task which in queue """
         request_q = self.requests_queue_conn.setdefault(
             "{}:requests".format(spider_name),
-            AsyncRedisPriorityQueue("{}:requests".format(spider_name), loop=self.loop)
+            create_requests_queue(spider_name, self.loop)
 
         )
 
@@ -121,6 +126,7 @@ class Scheduler(HandlerMixin):
             if task is not None:
                 await dump_task(task, catty.config.PERSISTENCE['DUMP_PATH'],
                                 'request_queue_{}'.format(self.name), task['spider_name'])
+                await request_q.ack(task)
                 self.logger.log_it("[dump_task]Dump task:{}".format(task))
 
     async def dump_all_paused_task(self):
@@ -171,7 +177,7 @@ class Scheduler(HandlerMixin):
         """Clean the spider's requests queue"""
         request_q = self.requests_queue_conn.setdefault(
             "{}:requests".format(spider_name),
-            AsyncRedisPriorityQueue("{}:requests".format(spider_name), loop=self.loop)
+            create_requests_queue(spider_name, self.loop)
         )
         if not request_q.redis_conn:
             await request_q.conn()
@@ -181,7 +187,7 @@ class Scheduler(HandlerMixin):
     async def get_requests_queue_size(self, spider_name: str):
         request_q = self.requests_queue_conn.setdefault(
             "{}:requests".format(spider_name),
-            AsyncRedisPriorityQueue("{}:requests".format(spider_name), loop=self.loop)
+            create_requests_queue(spider_name, self.loop)
         )
         await request_q.qsize()
 
@@ -191,6 +197,11 @@ class Scheduler(HandlerMixin):
         if bloomfilter:
             await bloomfilter.conn()
             await bloomfilter.clean()
+            if isinstance(bloomfilter, MmapBloomFilter):
+                bloomfilter.close()
+        for window_bloomfilter in self.window_bloom_filter.pop(spider_name, {}).values():
+            await window_bloomfilter.conn()
+            await window_bloomfilter.clean()
         try:
             self.bloom_filter.pop(spider_name)
         except KeyError:
@@ -230,8 +241,12 @@ class Scheduler(HandlerMixin):
 
         self.dump_speed()
         self.dump_status()
+        for bloom_filter in self.bloom_filter.values():
+            if isinstance(bloom_filter, MmapBloomFilter):
+                bloom_filter.close()
 
-        if catty.config.PERSISTENCE['PERSIST_BEFORE_EXIT']:
+        # the unacked tasks of a reliable queue will be requeued,no need to dump them
+        if catty.config.PERSISTENCE['PERSIST_BEFORE_EXIT'] and not catty.config.QUEUE['RELIABLE']:
             for spider_set in self.all_spider_set:
                 for spider_name in spider_set:
                     self.loop.create_task(self.dump_tasks(spider_name))
@@ -239,44 +254,109 @@ class Scheduler(HandlerMixin):
         else:
             self.done_all_things = True
 
-    async def push_requests(self, task, spider_ins, spider_name):
-        """Filter request & push it in requests queue"""
-        # DupeFilter
-        f = True
-        if task['meta']['dupe_filter']:
+    def get_bloom_filter(self, spider_name, spider_ins, window=0):
+        """
+        Return the spider's DupeFilter,create it at the first time.
+        A window(seconds) return a TimeWindowBloomFilter.
+        """
+        if window:
+            return self.get_window_bloom_filter(spider_name, spider_ins, window)
+
+        bloom_filter = self.bloom_filter.get(spider_name)
+        if bloom_filter is None:
+            nodes = get_default(spider_ins, 'bloom_nodes', catty.config.SPIDER_DEFAULT['BLOOM_NODES'])
             seeds = get_default(spider_ins, 'seeds', catty.config.SPIDER_DEFAULT['SEEDS'])
             blocknum = get_default(spider_ins, 'blocknum', catty.config.SPIDER_DEFAULT['BLOCKNUM'])
-            bloom_filter = self.bloom_filter.setdefault(
-                task['spider_name'],
-                RedisBloomFilter(self.loop, task['spider_name'] + ':DupeFilter', seeds, blockNum=blocknum)
+            local_cache_size = get_default(spider_ins, 'local_cache_size',
+                                           catty.config.SPIDER_DEFAULT['LOCAL_CACHE_SIZE'])
+            backend = get_default(spider_ins, 'dupe_filter_backend',
+                                  catty.config.SPIDER_DEFAULT['DUPE_FILTER_BACKEND'])
+            capacity = get_default(spider_ins, 'bloom_capacity', catty.config.SPIDER_DEFAULT['BLOOM_CAPACITY'])
+            error_rate = get_default(spider_ins, 'bloom_error_rate', catty.config.SPIDER_DEFAULT['BLOOM_ERROR_RATE'])
+            if nodes and (backend == 'mmap' or capacity):
+                raise ValueError("bloom_nodes is only for the blocks of RedisBloomFilter,"
+                                 "not for the mmap or scalable filter of {}".format(spider_name))
+            if backend == 'mmap':
+                bloom_filter = MmapBloomFilter(self.loop, spider_name + ':DupeFilter',
+                                               capacity or catty.config.SPIDER_DEFAULT['MMAP_BLOOM_CAPACITY'],
+                                               error_rate)
+            elif capacity:
+                bloom_filter = ScalableRedisBloomFilter(self.loop, spider_name + ':ScalableDupeFilter', capacity,
+                                                        error_rate, local_cache_size=local_cache_size)
+            else:
+                bloom_filter = RedisBloomFilter(self.loop, spider_name + ':DupeFilter', seeds, blockNum=blocknum,
+                                                local_cache_size=local_cache_size, nodes=nodes)
+            bloom_filter = self.bloom_filter.setdefault(spider_name, bloom_filter)
+        return bloom_filter
+
+    def get_window_bloom_filter(self, spider_name, spider_ins, window):
+        window_bloom_filter = self.window_bloom_filter.setdefault(spider_name, {})
+        bloom_filter = window_bloom_filter.get(window)
+        if bloom_filter is None:
+            if get_default(spider_ins, 'bloom_nodes', catty.config.SPIDER_DEFAULT['BLOOM_NODES']):
+                raise ValueError("bloom_nodes is only for the blocks of RedisBloomFilter,"
+                                 "not for the window filter of {}".format(spider_name))
+            generations = get_default(spider_ins, 'dupe_window_generations',
+                                      catty.config.SPIDER_DEFAULT['DUPE_WINDOW_GENERATIONS'])
+            capacity = get_default(spider_ins, 'dupe_window_capacity',
+                                   catty.config.SPIDER_DEFAULT['DUPE_WINDOW_CAPACITY'])
+            error_rate = get_default(spider_ins, 'bloom_error_rate', catty.config.SPIDER_DEFAULT['BLOOM_ERROR_RATE'])
+            bloom_filter = window_bloom_filter.setdefault(
+                window,
+                TimeWindowBloomFilter(self.loop, '{}:WindowDupeFilter:{}'.format(spider_name, window), window,
+                                      generations=generations, capacity=capacity, error_rate=error_rate)
             )
+        return bloom_filter
 
-            if not bloom_filter.redis_conn:
-                await bloom_filter.conn()
+    async def push_requests(self, task, spider_ins, spider_name):
+        """Filter request & push it in requests queue"""
+        await self.push_requests_many([task], spider_ins, spider_name)
 
-            if not await bloom_filter.is_contain(task['tid']):
-                await bloom_filter.add(task['tid'])
-            else:
-                self.logger.log_it("[run_ins_func]Filtered tid:{} url:{} data:{} params:{}".format(
-                    task['tid'],
-                    task['request'].url,
-                    task['request'].data,
-                    task['request'].params
-                ), level='INFO')
-                f = False
-
-        if f:
+    async def push_requests_many(self, tasks: list, spider_ins, spider_name):
+        """Filter the requests & push them in requests queue,in one round trip per dupe window"""
+        # DupeFilter
+        filter_tasks = [task for task in tasks if task['meta']['dupe_filter']]
+        filtered = set()
+        # window -> tasks,meta['dupe_window'] override the spider's
+        default_window = get_default(spider_ins, 'dupe_window', catty.config.SPIDER_DEFAULT['DUPE_WINDOW'])
+        window_tasks = {}
+        for task in filter_tasks:
+            window_tasks.setdefault(task['meta'].get('dupe_window', default_window), []).append(task)
+
+        for window, each_tasks in window_tasks.items():
+            bloom_filter = self.get_bloom_filter(spider_name, spider_ins, window)
+
+            await bloom_filter.conn()
+
+            is_new = await bloom_filter.add_many([task['tid'] for task in each_tasks])
+            for task, new in zip(each_tasks, is_new):
+                if not new:
+                    self.logger.log_it("[run_ins_func]Filtered tid:{} url:{} data:{} params:{}".format(
+                        task['tid'],
+                        task['request'].url,
+                        task['request'].data,
+                        task['request'].params
+                    ), level='INFO')
+                    filtered.add(id(task))
+
+        new_tasks = []
+        for task in tasks:
+            if id(task) in filtered:
+                continue
             self.logger.log_it("[run_ins_func]New request tid:{} url:{} data:{} params:{}".format(
                 task['tid'],
                 task['request'].url,
                 task['request'].data,
                 task['request'].params
             ), level='INFO')
+            new_tasks.append(task)
+
+        if new_tasks:
             request_q = self.requests_queue_conn.setdefault(
                 "{}:requests".format(spider_name),
-                AsyncRedisPriorityQueue("{}:requests".format(spider_name), loop=self.loop)
+                create_requests_queue(spider_name, self.loop)
             )
-            await push_task(request_q, task, self.loop)
+            await push_tasks(request_q, new_tasks, self.loop)
 
     def get_spider_method(self, spider_name: str, method_name: str):
         """Return a bound method if spider have this method,return None if not."""
@@ -316,60 +396,93 @@ class Scheduler(HandlerMixin):
 
         # return how many request mean it make how many task
         if isinstance(func_return_task, list):
+            tasks = []
             for each_task in func_return_task:
                 if not isinstance(each_task, Task):
                     self.logger.log_it("[run_ins_func]Not return a Task in {}".format(spider_name), 'WARN')
                     continue
-                self.loop.create_task(self.push_requests(each_task, spider_ins, spider_name))
+                tasks.append(each_task)
+            await self.push_requests_many(tasks, spider_ins, spider_name)
 
-    async def make_tasks(self):
-        """run the ready_start spider & run the done task & push them"""
-        # start the "ready_start" spiders
+    async def set_spider_weight(self, spider_name: str):
+        """Set the spider's share of downloader if scheduler_downloader_queue is fair"""
+        if not isinstance(self.scheduler_downloader_queue, AsyncRedisFairQueue):
+            return
+        spider_ins = self.spider_module_handle.spider_instantiation.get(spider_name)
+        weight = get_default(spider_ins, 'weight', catty.config.SPIDER_DEFAULT['WEIGHT'])
+        try:
+            await self.scheduler_downloader_queue.set_weight(spider_name, weight)
+        except ValueError:
+            self.logger.log_it("[set_spider_weight]Invalid weight:{} spider:{}".format(weight, spider_name), 'WARN')
+
+    async def start_ready_spiders(self):
+        """run the ready_start spider"""
         had_started_ = set()
         for spider_name in self.spider_ready_start:
             # start the spider's start method
             self.logger.log_it('[make_tasks]Starting spider:{}'.format(spider_name), 'INFO')
+            self.loop.create_task(self.set_spider_weight(spider_name))
             self.loop.create_task(self._run_ins_func(spider_name, 'start'))
             self.spider_started.add(spider_name)
             had_started_.add(spider_name)
 
         self.spider_ready_start -= had_started_
 
-        # from done task
-        task = await get_task(self.parser_scheduler_queue)
-        if task:
+        await asyncio.sleep(catty.config.SELECTOR_INTERVAL, loop=self.loop)
+        self.loop.create_task(self.start_ready_spiders())
+
+    async def make_tasks(self):
+        """run the done task & push them"""
+        tasks = await get_tasks(self.parser_scheduler_queue, block=catty.config.QUEUE['BLOCKING_GET'])
+        if tasks:
+            self.loop.create_task(self.make_tasks())
+            await asyncio.gather(*[self.handle_and_ack(task) for task in tasks], loop=self.loop)
+        elif catty.config.QUEUE['BLOCKING_GET']:
+            # had waited in get_tasks
             self.loop.create_task(self.make_tasks())
-            spider_name = task['spider_name']
+        else:
+            self.loop.call_later(catty.config.LOAD_QUEUE_INTERVAL, lambda: self.loop.create_task(self.make_tasks()))
 
-            if task['spider_name'] in self.spider_started:
-                callback = task['callback']
+    async def handle_and_ack(self, task: dict):
+        """Ack the task after its requests had been pushed,so a reliable queue never lose them"""
+        try:
+            await self.handle_task(task)
+        finally:
+            await self.parser_scheduler_queue.ack(task)
 
-                for callback_method_name in callback:
-                    fetcher_method_name = callback_method_name.get('fetcher', None)
+    async def handle_task(self, task: dict):
+        """run the fetchers of a done task & wait for their requests being pushed"""
+        spider_name = task['spider_name']
 
-                    if not fetcher_method_name:
-                        continue
+        if task['spider_name'] in self.spider_started:
+            callback = task['callback']
+            fetchers = []
 
-                    if not isinstance(fetcher_method_name, list):
-                        fetcher_method_name = [fetcher_method_name]
+            for callback_method_name in callback:
+                fetcher_method_name = callback_method_name.get('fetcher', None)
 
-                    # a task can have many fetcher callbacks
-                    for each_fetcher_method_name in fetcher_method_name:
-                        # make a new task,if use need to save the data from last task(meta etc..),must handle it.
-                        self.logger.log_it(
-                            '[make_tasks]{}.{} making task'.format(spider_name, each_fetcher_method_name))
-                        self.loop.create_task(self._run_ins_func(spider_name, each_fetcher_method_name, task))
+                if not fetcher_method_name:
+                    continue
 
-            elif task['spider_name'] in self.spider_paused:
-                # persist
-                dump_task(task, catty.config.PERSISTENCE['DUMP_PATH'], 'scheduler', task['spider_name'])
-                self.loop.create_task(self.dump_tasks(spider_name))
-            elif task['spider_name'] in self.spider_stopped:
-                pass
-            elif task['spider_name'] in self.spider_todo:
-                pass
-        else:
-            self.loop.call_later(catty.config.LOAD_QUEUE_INTERVAL, lambda: self.loop.create_task(self.make_tasks()))
+                if not isinstance(fetcher_method_name, list):
+                    fetcher_method_name = [fetcher_method_name]
+
+                # a task can have many fetcher callbacks
+                for each_fetcher_method_name in fetcher_method_name:
+                    # make a new task,if use need to save the data from last task(meta etc..),must handle it.
+                    self.logger.log_it(
+                        '[make_tasks]{}.{} making task'.format(spider_name, each_fetcher_method_name))
+                    fetchers.append(self._run_ins_func(spider_name, each_fetcher_method_name, task))
+            await asyncio.gather(*fetchers, loop=self.loop)
+
+        elif task['spider_name'] in self.spider_paused:
+            # persist
+            await dump_task(task, catty.config.PERSISTENCE['DUMP_PATH'], 'scheduler', task['spider_name'])
+            self.loop.create_task(self.dump_tasks(spider_name))
+        elif task['spider_name'] in self.spider_stopped:
+            pass
+        elif task['spider_name'] in self.spider_todo:
+            pass
 
     def quit(self):
         self.logger.log_it("[Ending]Doing the last thing...")
@@ -382,10 +495,28 @@ class Scheduler(HandlerMixin):
                 # doesn't block the thread
                 time.sleep(1)
 
-    def run_scheduler(self):
+    async def promote_retry_tasks(self):
+        """Move the due retry tasks to scheduler_downloader_queue"""
+        while True:
+            tasks = await get_tasks(self.retry_queue)
+            if tasks:
+                await push_tasks(self.scheduler_downloader_queue, tasks, self.loop)
+            if len(tasks) < catty.config.QUEUE['BATCH_SIZE']:
+                await asyncio.sleep(catty.config.RETRY_PROMOTE_INTERVAL, loop=self.loop)
+
+    def start_scheduler(self):
+        """Create the tasks of scheduler without running the loop,see tests/run_standalone.py"""
         self.loop.create_task(self.selector.select_task())
+        self.loop.create_task(self.start_ready_spiders())
+        if self.retry_queue is not None:
+            self.loop.create_task(self.promote_retry_tasks())
+        self.loop.create_task(requeue_expired_tasks([self.parser_scheduler_queue], self.loop))
+        self.loop.create_task(requeue_expired_tasks(self.requests_queue_conn.values(), self.loop))
         for i in range(catty.config.NUM_OF_SCHEDULER_MAKE_TASK):
             self.loop.create_task(self.make_tasks())
+
+    def run_scheduler(self):
+        self.start_scheduler()
         self.loop.run_forever()
 
     def run(self):
@@ -406,6 +537,12 @@ class Scheduler(HandlerMixin):
 
 
 class Selector:
+    """
+    Move the tasks from the requests queue of each started spider to scheduler-downloader queue at its speed.
+    Each spider has a token bucket refilled speed tokens per second,it is checked every SELECTOR_TICK seconds,
+    so the tasks are emitted smoothly at fractional(0.3/s) or high(2500/s) speeds.
+    """
+
     def __init__(self,
                  spider_speed: dict,
                  scheduler_downloader_queue: AsyncRedisPriorityQueue,
@@ -415,15 +552,14 @@ class Selector:
                  spider_started: set,
                  spider_ready_start: set,
                  spider_todo: set,
-                 loop: asyncio.BaseEventLoop):
+                 loop: asyncio.BaseEventLoop,
+                 clock=time.monotonic):
+        """:param clock:   Return the current time in seconds,for the token buckets & the emitted speed"""
         self.logger = Log('Selector')
         self.scheduler_downloader_queue = scheduler_downloader_queue
         self.requests_queue = requests_queue
         self.loop = loop
-
-        # time from begin to now
-        self.running_time = 0
-        self.run_at = int(time.time())
+        self.clock = clock
 
         self.spider_stopped = spider_stopped
         self.spider_paused = spider_paused
@@ -431,51 +567,112 @@ class Selector:
         self.spider_ready_start = spider_ready_start
         self.spider_todo = spider_todo
         self.spider_speed = spider_speed
-        self.spider_speed_reciprocal = {}
+        self.spider_bucket = {}
+        # the spiders which are moving tasks,a spider has one selecting at most
+        self.selecting = set()
+
+        # the number of emitted tasks of each spider,and the emitted speed of last SELECTOR_STATS_INTERVAL
+        self.emitted = {}
+        self.emitted_speed = {}
+        self.last_emitted = {}
+        self.last_stats_time = clock()
 
         self.init_speed()
 
+    @staticmethod
+    def _capacity(speed: float) -> float:
+        # at most two ticks of tokens,a spider which can't get enough tasks don't burst later
+        return max(1.0, speed * catty.config.SELECTOR_TICK * 2)
+
     def init_speed(self):
         """init all spider speed"""
-        self.spider_speed_reciprocal = {k: math.ceil(1 / v) for k, v in self.spider_speed.items()}
+        self.spider_bucket = {k: TokenBucket(v, self._capacity(v), clock=self.clock)
+                              for k, v in self.spider_speed.items()}
 
-    def update_speed(self, spider_name: str, speed: int):
+    def update_speed(self, spider_name: str, speed: float):
         """update a spider speed"""
         self.spider_speed.update({spider_name: speed})
-        self.spider_speed_reciprocal.update({spider_name: math.ceil(1 / speed)})
+        bucket = self.spider_bucket.get(spider_name)
+        if bucket is None:
+            self.spider_bucket[spider_name] = TokenBucket(speed, self._capacity(speed), clock=self.clock)
+        else:
+            bucket.set_rate(speed, self._capacity(speed))
 
-    async def _select_task(self, requests_q, spider_name):
-        task = await get_task(requests_q)
-        if task:
+    async def _select_task(self, requests_q, spider_name, n=1) -> int:
+        """
+        move at most n tasks from the spider's requests queue to scheduler-downloader queue in one round trip.
+        Return the number of the moved tasks.
+        """
+        tasks = await get_tasks(requests_q, n)
+        selected = []
+        for task in tasks:
             if task['spider_name'] in self.spider_started:
-                await push_task(self.scheduler_downloader_queue, task, self.loop)
+                selected.append(task)
                 self.logger.log_it('[select_task]{} tid:{}'.format(spider_name, task['tid']))
             elif task['spider_name'] in self.spider_paused:
-                dump_task(task, catty.config.PERSISTENCE['DUMP_PATH'], 'scheduler',
-                          task['spider_name'])
+                await dump_task(task, catty.config.PERSISTENCE['DUMP_PATH'], 'scheduler',
+                                task['spider_name'])
             elif task['spider_name'] in self.spider_stopped:
                 pass
+        await push_tasks(self.scheduler_downloader_queue, selected, self.loop)
+        await requests_q.ack(*tasks)
+        return len(selected)
 
-    async def select_task(self):
-        # TODO 时间粒度
-        last_running_time = self.running_time
-        self.running_time = int(time.time()) - self.run_at
+    async def _select_tasks(self, requests_q, spider_name, n):
+        """move n tasks in batches of QUEUE['BATCH_SIZE']"""
+        try:
+            while n > 0:
+                batch = min(n, catty.config.QUEUE['BATCH_SIZE'])
+                emitted = await self._select_task(requests_q, spider_name, batch)
+                self.emitted[spider_name] = self.emitted.get(spider_name, 0) + emitted
+                if emitted < batch:
+                    # the requests queue is empty
+                    break
+                n -= batch
+        finally:
+            self.selecting.discard(spider_name)
+
+    def update_stats(self):
+        """Compute the emitted speed every SELECTOR_STATS_INTERVAL seconds"""
+        now = self.clock()
+        elapsed = now - self.last_stats_time
+        if elapsed < catty.config.SELECTOR_STATS_INTERVAL:
+            return
 
-        for spider_name in self.spider_started:
-            speed_reciprocal = self.spider_speed_reciprocal[spider_name]
-            requests_q = self.requests_queue.setdefault(
-                "{}:requests".format(spider_name),
-                AsyncRedisPriorityQueue("{}:requests".format(spider_name), loop=self.loop)
-            )
-            for each_diff_time in range(last_running_time, self.running_time):
-                # time's up
-                if each_diff_time % speed_reciprocal == 0:
-                    # if speed bigger than 1,means that at last 1 request per sec.
-                    if self.spider_speed[spider_name] > 1:
-                        for i in range(self.spider_speed[spider_name]):
-                            self.loop.create_task(self._select_task(requests_q, spider_name))
-                    else:
-                        self.loop.create_task(self._select_task(requests_q, spider_name))
+        self.last_stats_time = now
+        for spider_name, emitted in self.emitted.items():
+            self.emitted_speed[spider_name] = (emitted - self.last_emitted.get(spider_name, 0)) / elapsed
+            self.last_emitted[spider_name] = emitted
+            if spider_name in self.spider_started:
+                self.logger.log_it('[select_task]{} target speed:{} emitted speed:{:.2f}'.format(
+                    spider_name, self.spider_speed.get(spider_name), self.emitted_speed[spider_name]))
 
-        await asyncio.sleep(catty.config.SELECTOR_INTERVAL, loop=self.loop)
-        self.loop.create_task(self.select_task())
+    def speed_stats(self) -> dict:
+        """{spider_name: {'target': speed, 'emitted': speed}}"""
+        return {spider_name: {'target': speed, 'emitted': self.emitted_speed.get(spider_name, 0)}
+                for spider_name, speed in self.spider_speed.items()}
+
+    async def select_task(self):
+        while True:
+            for spider_name in self.spider_started:
+                if spider_name in self.selecting:
+                    continue
+                bucket = self.spider_bucket.get(spider_name)
+                if bucket is None:
+                    self.update_speed(spider_name, self.spider_speed.get(spider_name,
+                                                                         catty.config.SPIDER_DEFAULT['SPEED']))
+                    bucket = self.spider_bucket[spider_name]
+                if bucket.rate <= 0:
+                    continue
+
+                n = bucket.take()
+                if n:
+                    requests_q = self.requests_queue.setdefault(
+                        "{}:requests".format(spider_name),
+                        create_requests_queue(spider_name, self.loop)
+                    )
+                    self.selecting.add(spider_name)
+                    self.loop.create_task(self._select_tasks(requests_q, spider_name, n))
+
+            self.update_stats()
+            await asyncio.sleep(catty.config.SELECTOR_TICK, loop=self.loop)
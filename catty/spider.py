@@ -13,9 +13,13 @@ from catty.libs.tasker import Tasker
 
 class BaseSpider(metaclass=abc.ABCMeta):
     speed = catty.config.SPIDER_DEFAULT['SPEED']
+    # the share of downloader,see AsyncRedisFairQueue
+    weight = catty.config.SPIDER_DEFAULT['WEIGHT']
     seeds = catty.config.SPIDER_DEFAULT['SEEDS']
     blocknum = catty.config.SPIDER_DEFAULT['BLOCKNUM']
-    handle_status_code = catty.config.SPIDER_DEFAULT('HANDLE_STATUS_CODE', [])
+    handle_status_code = catty.config.SPIDER_DEFAULT.get('HANDLE_STATUS_CODE', [])
+    # see catty.libs.retry,None to use SPIDER_DEFAULT['RETRY_POLICY']
+    retry_policy = None
 
     @abc.abstractmethod
     def start(self):
@@ -43,6 +47,8 @@ class BaseSpider(metaclass=abc.ABCMeta):
         meta.setdefault('retry_wait', catty.config.SPIDER_DEFAULT.get('RETRY_WAIT', 3))
         meta.setdefault('dupe_filter', catty.config.SPIDER_DEFAULT.get('DUPE_FILTER', False))
         meta.setdefault('handle_status_code', self.handle_status_code)
+        if self.retry_policy is not None:
+            meta.setdefault('retry_policy', self.retry_policy)
 
         return Tasker.make_task({
             'spider_name': self.name,
@@ -17,7 +17,7 @@ $(document).ready(function () {
     $(".speed").click(function () {
         var spider_name = $(this).data('spider_name');
         UIkit.modal.prompt('Speed:', '', function (val) {
-            val = parseInt(val)
+            val = parseFloat(val)
             console.log(spider_name)
             if (isNaN(val)) {
                 UIkit.modal.alert("Is not a digital!")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+# Author: Vincent<vincent8280@outlook.com>
+#         http://blog.vincentzhong.cn
+# Created on 2017/10/18 15:40
+"""
+Compare the cost per key of the Hash versions,and the throughput of RedisBloomFilter & MmapBloomFilter.
+A local redis is needed.
+Run: python ./tests/run_bloom_benchmark.py [total] [batch]
+"""
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import catty.config
+from catty.libs.bloom_filter import Hash, RedisBloomFilter, MmapBloomFilter
+from catty.libs.utils import md5string
+
+
+def run_hash(tids):
+    for version in (1, 2):
+        hashfunc = Hash(1 << 29, catty.config.SPIDER_DEFAULT['SEEDS'], version=version)
+        t_ = time.time()
+        for tid in tids:
+            hashfunc.hash(tid)
+        print("Hash version {}:\t{:.2f}us per key".format(version, (time.time() - t_) / len(tids) * 1e6))
+
+
+async def run(bloom_filter, tids, batch):
+    await bloom_filter.conn()
+    await bloom_filter.clean()
+
+    t_ = time.time()
+    for tid in tids[:len(tids) // 10]:
+        await bloom_filter.add_if_absent(tid)
+    add_if_absent = len(tids) // 10 / (time.time() - t_)
+
+    t_ = time.time()
+    for i in range(0, len(tids), batch):
+        await bloom_filter.add_many(tids[i:i + batch])
+    add_many = len(tids) / (time.time() - t_)
+
+    await bloom_filter.clean()
+    return add_if_absent, add_many
+
+
+async def main(total, batch):
+    loop = asyncio.get_event_loop()
+    tids = [md5string(str(i)) for i in range(total)]
+    run_hash(tids[:10000])
+    root = tempfile.mkdtemp()
+
+    redis_bloom_filter = RedisBloomFilter(loop, 'Benchmark', catty.config.SPIDER_DEFAULT['SEEDS'], hash_version=3)
+    mmap_bloom_filter = MmapBloomFilter(loop, 'Benchmark', capacity=total, path=os.path.join(root, 'Benchmark'))
+    result = {
+        'RedisBloomFilter': await run(redis_bloom_filter, tids, batch),
+        'MmapBloomFilter': await run(mmap_bloom_filter, tids, batch),
+    }
+    redis_bloom_filter.redis_conn.close()
+    await redis_bloom_filter.redis_conn.wait_closed()
+    mmap_bloom_filter.close()
+    shutil.rmtree(root)
+
+    for name, (add_if_absent, add_many) in result.items():
+        print("{}:\tadd_if_absent {:.0f} keys/s\tadd_many({}) {:.0f} keys/s".format(
+            name, add_if_absent, batch, add_many))
+
+
+if __name__ == '__main__':
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    batch = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    asyncio.get_event_loop().run_until_complete(main(total, batch))
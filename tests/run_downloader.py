@@ -5,7 +5,7 @@
 #         http://blog.vincentzhong.cn
 # Created on 2017/3/27 23:29
 
-from catty.message_queue import AsyncRedisPriorityQueue
+from catty.message_queue import AsyncRedisDelayQueue, create_queue
 from catty.config import QUEUE, DOWNLOADER
 from catty.downloader import DownLoader
 from catty.libs.utils import get_eventloop
@@ -13,11 +13,13 @@ from catty.libs.utils import get_eventloop
 if __name__ == '__main__':
     loop = get_eventloop()
 
-    scheduler_downloader_queue = AsyncRedisPriorityQueue(
-        'Catty:Scheduler-Downloader', loop, queue_maxsize=QUEUE['MAX_SIZE'])
-    downloader_parser_queue = AsyncRedisPriorityQueue(
+    scheduler_downloader_queue = create_queue(
+        'Catty:Scheduler-Downloader', loop, fair=QUEUE['FAIR'], queue_maxsize=QUEUE['MAX_SIZE'])
+    downloader_parser_queue = create_queue(
         'Catty:Downloader-Parser', loop, queue_maxsize=QUEUE['MAX_SIZE'])
+    retry_queue = AsyncRedisDelayQueue('Catty:Retry', loop, queue_maxsize=0)
 
+    loop.run_until_complete(retry_queue.conn())
     loop.run_until_complete(scheduler_downloader_queue.conn())
     loop.run_until_complete(downloader_parser_queue.conn())
 
@@ -25,6 +27,9 @@ if __name__ == '__main__':
         scheduler_downloader_queue,
         downloader_parser_queue,
         loop,
-        conn_limit=DOWNLOADER['CONN_LIMIT'])
+        conn_limit=DOWNLOADER['CONN_LIMIT'],
+        limit_per_host=DOWNLOADER['LIMIT_PER_HOST'],
+        force_close=DOWNLOADER['FORCE_CLOSE'],
+        retry_queue=retry_queue)
 
     downloader.run()
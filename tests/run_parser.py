@@ -5,19 +5,22 @@
 #         http://blog.vincentzhong.cn
 # Created on 2017/3/27 23:29
 import catty.config
-from catty.message_queue import AsyncRedisPriorityQueue
+from catty.message_queue import AsyncRedisDelayQueue, create_queue
 from catty.parser import Parser
 from catty.libs.utils import get_eventloop
 
 if __name__ == '__main__':
     loop = get_eventloop()
-    downloader_parser_queue = AsyncRedisPriorityQueue(
+    downloader_parser_queue = create_queue(
         'Catty:Downloader-Parser', loop=loop, queue_maxsize=catty.config.QUEUE['MAX_SIZE'])
-    parser_scheduler_queue = AsyncRedisPriorityQueue(
+    parser_scheduler_queue = create_queue(
         'Catty:Parser-Scheduler', loop=loop, queue_maxsize=catty.config.QUEUE['MAX_SIZE'])
-    scheduler_downloader_queue = AsyncRedisPriorityQueue(
-        'Catty:Scheduler-Downloader', loop=loop, queue_maxsize=catty.config.QUEUE['MAX_SIZE'])
+    scheduler_downloader_queue = create_queue(
+        'Catty:Scheduler-Downloader', loop, fair=catty.config.QUEUE['FAIR'],
+        queue_maxsize=catty.config.QUEUE['MAX_SIZE'])
+    retry_queue = AsyncRedisDelayQueue('Catty:Retry', loop=loop, queue_maxsize=0)
 
+    loop.run_until_complete(retry_queue.conn())
     loop.run_until_complete(parser_scheduler_queue.conn())
     loop.run_until_complete(downloader_parser_queue.conn())
     loop.run_until_complete(scheduler_downloader_queue.conn())
@@ -27,7 +30,8 @@ if __name__ == '__main__':
         parser_scheduler_queue,
         scheduler_downloader_queue,
         loop,
-        'master_parser'
+        'master_parser',
+        retry_queue=retry_queue
     )
 
     parser.run()
@@ -4,25 +4,28 @@
 # Author: Vincent<vincent8280@outlook.com>
 #         http://blog.vincentzhong.cn
 # Created on 2017/3/27 23:28
-from catty.message_queue import AsyncRedisPriorityQueue
+from catty.message_queue import AsyncRedisDelayQueue, create_queue
 from catty.scheduler import Scheduler
 from catty.config import QUEUE
 from catty.libs.utils import get_eventloop
 
 loop = get_eventloop()
 if __name__ == '__main__':
-    scheduler_downloader_queue = AsyncRedisPriorityQueue(
-        'Catty:Scheduler-Downloader', loop=loop, queue_maxsize=QUEUE['MAX_SIZE'])
-    parser_scheduler_queue = AsyncRedisPriorityQueue(
+    scheduler_downloader_queue = create_queue(
+        'Catty:Scheduler-Downloader', loop, fair=QUEUE['FAIR'], queue_maxsize=QUEUE['MAX_SIZE'])
+    parser_scheduler_queue = create_queue(
         'Catty:Parser-Scheduler', loop=loop, queue_maxsize=QUEUE['MAX_SIZE'])
+    retry_queue = AsyncRedisDelayQueue('Catty:Retry', loop=loop, queue_maxsize=0)
     loop.run_until_complete(scheduler_downloader_queue.conn())
     loop.run_until_complete(parser_scheduler_queue.conn())
+    loop.run_until_complete(retry_queue.conn())
 
     scheduler = Scheduler(
         scheduler_downloader_queue,
         parser_scheduler_queue,
         loop,
-        'master_scheduler'
+        'master_scheduler',
+        retry_queue=retry_queue
     )
 
     scheduler.run()
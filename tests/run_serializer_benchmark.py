@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+# Author: Vincent<vincent8280@outlook.com>
+#         http://blog.vincentzhong.cn
+# Created on 2017/10/14 16:40
+"""
+Compare encode/decode time and bytes per task of the serializers.
+Run: python ./tests/run_serializer_benchmark.py [times]
+"""
+import os
+import sys
+import time
+
+from catty.libs.serializer import MsgpackSerializer, PickleSerializer
+from tests.test_serializer import make_task
+
+
+def realistic_tasks():
+    """A task before downloading,and a task with a 50KB page after parsing"""
+    new_task = make_task()
+    new_task['response'] = {}
+    new_task['parser'] = {}
+
+    done_task = make_task()
+    done_task['response'].body = os.urandom(25 * 1024).hex().encode()
+    done_task['parser'] = {'item': {'article_url': ['http://applehater.cn/{}'.format(i) for i in range(50)]}}
+    return [('new task', new_task), ('done task', done_task)]
+
+
+def bench(serializer, task, times):
+    data = serializer.dumps(task)
+
+    t_ = time.time()
+    for i in range(times):
+        serializer.dumps(task)
+    dumps_time = (time.time() - t_) / times
+
+    t_ = time.time()
+    for i in range(times):
+        serializer.loads(data)
+    loads_time = (time.time() - t_) / times
+
+    return len(data), dumps_time, loads_time
+
+
+if __name__ == '__main__':
+    times = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print("{:<10}{:<10}{:>10}{:>14}{:>14}".format('task', 'format', 'bytes', 'encode(us)', 'decode(us)'))
+    for task_name, task in realistic_tasks():
+        for serializer in (PickleSerializer(), MsgpackSerializer()):
+            size, dumps_time, loads_time = bench(serializer, task, times)
+            print("{:<10}{:<10}{:>10}{:>14.2f}{:>14.2f}".format(
+                task_name, serializer.name, size, dumps_time * 1e6, loads_time * 1e6))
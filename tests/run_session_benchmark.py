@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+# Author: Vincent<vincent8280@outlook.com>
+#         http://blog.vincentzhong.cn
+# Created on 2017/10/12 20:41
+"""
+Compare requests/sec of a new ClientSession per request with the shared session of DownLoader.
+Run: python ./tests/run_session_benchmark.py [total] [concurrency]
+"""
+import asyncio
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+import catty.config
+
+catty.config.LOG_LEVEL = 30
+
+from catty.downloader import DownLoader
+from catty.libs.request import Request
+
+HOST = '127.0.0.1'
+PORT = 8001
+
+
+async def hello(request):
+    return web.json_response({'hello': 'world'})
+
+
+async def start_server(loop):
+    app = web.Application()
+    app.router.add_get('/', hello)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, HOST, PORT)
+    await site.start()
+    return runner
+
+
+async def fetch_without_reuse(request, loop):
+    async with aiohttp.ClientSession(loop=loop) as session:
+        async with session.get(**request.dump_request()) as client:
+            await client.read()
+
+
+async def run(fetch, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(i):
+        async with semaphore:
+            await fetch(Request(url='http://{}:{}/?a={}'.format(HOST, PORT, i)))
+
+    t_ = time.time()
+    await asyncio.gather(*[bounded(i) for i in range(total)])
+    return total / (time.time() - t_)
+
+
+async def main(total, concurrency):
+    loop = asyncio.get_event_loop()
+    runner = await start_server(loop)
+
+    without_reuse = await run(lambda r: fetch_without_reuse(r, loop), total, concurrency)
+
+    downloader = DownLoader(None, None, loop, conn_limit=concurrency, limit_per_host=concurrency, force_close=False)
+    with_reuse = await run(lambda r: downloader._request(r, loop), total, concurrency)
+    await downloader.close()
+
+    await runner.cleanup()
+
+    print("Without session reuse:\t{:.1f} requests/s".format(without_reuse))
+    print("With session reuse:\t{:.1f} requests/s".format(with_reuse))
+
+
+if __name__ == '__main__':
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    asyncio.get_event_loop().run_until_complete(main(total, concurrency))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+# Author: Vincent<vincent8280@outlook.com>
+#         http://blog.vincentzhong.cn
+# Created on 2017/10/24 21:06
+"""
+Run scheduler,downloader & parser in one process on one event loop.
+The queues between them are AsyncLocalPriorityQueue,so the tasks are passed by reference without Redis & pickle.
+Set SPIDER_DEFAULT['DUPE_FILTER_BACKEND'] to 'mmap' to run without Redis at all.
+"""
+import os
+import threading
+import time
+from functools import partial
+
+import catty.config
+
+catty.config.QUEUE['BACKEND'] = 'local'
+# the local queues die with the process,dump them before exit instead
+catty.config.QUEUE['RELIABLE'] = False
+
+from catty.message_queue import create_queue, get_task
+from catty.scheduler import Scheduler
+from catty.parser import Parser
+from catty.downloader import DownLoader
+from catty.libs.utils import get_eventloop, dump_task
+
+QUEUE = catty.config.QUEUE
+
+
+async def dump_scheduler_downloader_queue(scheduler):
+    """Dump the tasks as the requests of scheduler,they are pushed to scheduler-downloader queue at next start"""
+    while await scheduler.scheduler_downloader_queue.qsize():
+        task = await get_task(scheduler.scheduler_downloader_queue)
+        if task is not None:
+            await dump_task(task, catty.config.PERSISTENCE['DUMP_PATH'], 'request_queue_{}'.format(scheduler.name),
+                            task['spider_name'])
+    scheduler.logger.log_it("[dump_scheduler_downloader_queue]Done")
+
+
+def quit_standalone(loop, scheduler, parser):
+    scheduler.logger.log_it("[Ending]Doing the last thing...", level='INFO')
+    loop.call_soon_threadsafe(loop.create_task, scheduler.on_end())
+    loop.call_soon_threadsafe(loop.create_task, parser.on_end())
+    if catty.config.PERSISTENCE['PERSIST_BEFORE_EXIT']:
+        loop.call_soon_threadsafe(loop.create_task, dump_scheduler_downloader_queue(scheduler))
+    while not (scheduler.done_all_things and parser.ready_to_exit):
+        time.sleep(1)
+    scheduler.logger.log_it("Bye!", level='INFO')
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    loop = get_eventloop()
+
+    scheduler_downloader_queue = create_queue('Catty:Scheduler-Downloader', loop, queue_maxsize=QUEUE['MAX_SIZE'])
+    downloader_parser_queue = create_queue('Catty:Downloader-Parser', loop, queue_maxsize=QUEUE['MAX_SIZE'])
+    parser_scheduler_queue = create_queue('Catty:Parser-Scheduler', loop, queue_maxsize=QUEUE['MAX_SIZE'])
+
+    # no retry queue,a retry task wait its delay in its own asyncio task(see Parser.push_retry_tasks_later)
+    scheduler = Scheduler(scheduler_downloader_queue, parser_scheduler_queue, loop, 'master_scheduler')
+    parser = Parser(downloader_parser_queue, parser_scheduler_queue, scheduler_downloader_queue, loop,
+                    'master_parser')
+    downloader = DownLoader(
+        scheduler_downloader_queue,
+        downloader_parser_queue,
+        loop,
+        conn_limit=catty.config.DOWNLOADER['CONN_LIMIT'],
+        limit_per_host=catty.config.DOWNLOADER['LIMIT_PER_HOST'],
+        force_close=catty.config.DOWNLOADER['FORCE_CLOSE'])
+
+    try:
+        scheduler.on_begin()
+        parser.on_begin()
+        scheduler.start_scheduler()
+        parser.start_parser()
+        loop.create_task(downloader.start_crawler())
+
+        for handler in (scheduler, parser):
+            threading.Thread(target=partial(handler.xmlrpc_run, name=handler.name), daemon=True).start()
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+
+        while True:
+            r = input()
+            if r == 'Q':
+                quit_standalone(loop, scheduler, parser)
+    except KeyboardInterrupt:
+        quit_standalone(loop, scheduler, parser)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+# Author: Vincent<vincent8280@outlook.com>
+#         http://blog.vincentzhong.cn
+# Created on 2017/10/24 22:30
+"""
+Compare tasks/sec through the hops of a task(requests,scheduler-downloader,downloader-parser,parser-scheduler)
+on the Redis queues with the in-process queues of the standalone mode.Downloading & parsing are not included.
+Run: python ./tests/run_standalone_benchmark.py [total]
+"""
+import asyncio
+import sys
+import time
+
+import catty.config
+
+catty.config.LOG_LEVEL = 30
+
+from catty.message_queue import AsyncRedisPriorityQueue, AsyncLocalPriorityQueue, get_tasks, push_tasks
+from catty.libs.utils import get_eventloop
+from tests.test_serializer import make_task
+
+def make_tasks(start, n) -> list:
+    """Tasks of different tids,the same payloads are one member of a ZSET"""
+    tasks = []
+    for i in range(start, start + n):
+        task = make_task()
+        task['tid'] = str(i)
+        tasks.append(task)
+    return tasks
+
+
+HOPS = ('Catty:Bench:Scheduler-Downloader', 'Catty:Bench:Downloader-Parser', 'Catty:Bench:Parser-Scheduler')
+
+
+async def forward(q_in, q_out, total, loop):
+    """Move total tasks from q_in to q_out,like a downloader or a parser doing nothing"""
+    moved = 0
+    while moved < total:
+        tasks = await get_tasks(q_in, block=True)
+        await push_tasks(q_out, tasks, loop)
+        moved += len(tasks)
+
+
+async def drain(q, total):
+    received = 0
+    while received < total:
+        received += len(await get_tasks(q, block=True))
+
+
+async def run(queue_class, total, loop):
+    queues = [queue_class(name, loop, queue_maxsize=0) for name in HOPS]
+    for q in queues:
+        await q.conn()
+        await q.clear()
+    # the requests queue,filled before the clock start
+    source = queue_class('Catty:Bench:Requests', loop, queue_maxsize=0)
+    await source.conn()
+    await source.clear()
+    batch_size = catty.config.QUEUE['BATCH_SIZE']
+    for i in range(0, total, batch_size):
+        await push_tasks(source, make_tasks(i, min(batch_size, total - i)), loop)
+
+    t_ = time.time()
+    await asyncio.gather(
+        forward(source, queues[0], total, loop),
+        forward(queues[0], queues[1], total, loop),
+        forward(queues[1], queues[2], total, loop),
+        drain(queues[2], total),
+        loop=loop)
+    return total / (time.time() - t_)
+
+
+if __name__ == '__main__':
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    loop = get_eventloop()
+    print("{:<10}{:>14}".format('queue', 'tasks/s'))
+    for name, queue_class in (('redis', AsyncRedisPriorityQueue), ('local', AsyncLocalPriorityQueue)):
+        print("{:<10}{:>14.0f}".format(name, loop.run_until_complete(run(queue_class, total, loop))))
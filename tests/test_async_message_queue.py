@@ -4,9 +4,13 @@
 # Author: Vincent<vincent8280@outlook.com>
 #         http://blog.vincentzhong.cn
 # Created on 2017/3/8 19:35
+import asyncio
+
 import asynctest
 
-from catty.message_queue import AsyncRedisPriorityQueue
+from catty.message_queue import AsyncRedisPriorityQueue, AsyncRedisDelayQueue, AsyncRedisFairQueue, \
+    AsyncRedisStreamQueue, AsyncLocalPriorityQueue
+from catty.libs.utils import Task, RECEIPT_KEY
 
 
 class Test(asynctest.TestCase):
@@ -61,6 +65,259 @@ class Test(asynctest.TestCase):
             await self.queue.qsize(), 0
         )
 
+    async def test_put_many_get_many(self):
+        await self.queue.put_many([
+            {'test': 'testing1', 'priority': 0},
+            {'test': 'testing3', 'priority': 2},
+            (1, {'test': 'testing2', 'priority': 1}),
+        ])
+
+        self.assertEqual(
+            await self.queue.qsize(), 3
+        )
+
+        self.assertEqual(
+            await self.queue.get_many(2),
+            [{'test': 'testing3', 'priority': 2}, {'test': 'testing2', 'priority': 1}]
+        )
+        self.assertEqual(
+            await self.queue.get_many(2),
+            [{'test': 'testing1', 'priority': 0}]
+        )
+
+        with self.assertRaises(self.queue.Empty):
+            await self.queue.get_many(2)
+
+    async def test_get_wait(self):
+        with self.assertRaises(self.queue.Empty):
+            await self.queue.get_wait(timeout=1)
+
+        self.loop.call_later(0.1, lambda: self.loop.create_task(self.queue.put({'test': 'testing1', 'priority': 0})))
+        self.assertEqual(
+            await self.queue.get_wait(timeout=5),
+            {'test': 'testing1', 'priority': 0}
+        )
+
+    async def test_compress(self):
+        item = {'test': 'testing' * 10000, 'priority': 0}
+        await self.queue.put(item)
+
+        raw = await self.queue.redis_conn.zrange('MySpider:parser_scheduler', 0, -1)
+        self.assertTrue(raw[0].startswith(self.queue.ZLIB_TAG))
+        self.assertGreater(self.queue.compress_stats()['saved_bytes'], 0)
+        self.assertEqual(await self.queue.get(), item)
+
+    async def test_undecodable_payload(self):
+        await self.queue.put({'test': 'testing1', 'priority': 1})
+        # written by a process with lz4,this one has no lz4 or the payload is broken
+        await self.queue.redis_conn.zadd('MySpider:parser_scheduler', -2, self.queue.LZ4_TAG + b'broken')
+        # the broken one is skipped,the others of the batch are not dropped
+        self.assertEqual(await self.queue.get_many(10), [{'test': 'testing1', 'priority': 1}])
+
+    async def test_backpressure(self):
+        queue = AsyncRedisPriorityQueue(name='MySpider:bounded', loop=self.loop, queue_maxsize=10)
+        await queue.conn()
+        await queue.clear()
+        await queue.put_many([{'i': i} for i in range(10)])
+
+        producer = self.loop.create_task(queue.put({'i': 10}))
+        await asyncio.sleep(0.2)
+        self.assertFalse(producer.done())
+        # the size is still above the low watermark(8)
+        await queue.get_many(1)
+        await asyncio.sleep(0.2)
+        self.assertFalse(producer.done())
+
+        await queue.get_many(2)
+        await asyncio.wait_for(producer, 1)
+        self.assertEqual(await queue.qsize(), 8)
+
+        # never block the consumer's own pushes
+        await queue.put_many([{'i': i} for i in range(20, 30)], block=False)
+        self.assertEqual(await queue.qsize(), 18)
+        await queue.clear()
+
+    async def test_reliable(self):
+        queue = AsyncRedisPriorityQueue(name='MySpider:reliable', loop=self.loop, reliable=True,
+                                        visibility_timeout=0.2)
+        await queue.conn()
+        await queue.clear()
+        await queue.put_many([{'i': 0, 'priority': 0}, {'i': 1, 'priority': 1}, {'i': 2, 'priority': 2}])
+
+        done, crashed = await queue.get_many(2)
+        self.assertEqual((done['i'], crashed['i']), (2, 1))
+        self.assertEqual(await queue.inflight_size(), 2)
+        await queue.ack(done)
+        self.assertEqual(await queue.inflight_size(), 1)
+
+        self.assertEqual(await queue.requeue_expired(), 0)
+        await asyncio.sleep(0.3)
+        self.assertEqual(await queue.requeue_expired(), 1)
+        self.assertEqual(await queue.inflight_size(), 0)
+        # requeued with its priority,the receipts are carried by the items & dropped by ack
+        tasks = await queue.get_many(2)
+        self.assertIn(RECEIPT_KEY, tasks[0])
+        await queue.ack(*tasks)
+        self.assertEqual(tasks, [{'i': 1, 'priority': 1}, {'i': 0, 'priority': 0}])
+        self.assertEqual(await queue.inflight_size(), 0)
+
+        # a blocked get_wait is woken up by the put,and the item is in-flight
+        self.loop.call_later(0.1, lambda: self.loop.create_task(queue.put({'i': 3})))
+        task = await queue.get_wait(timeout=5)
+        self.assertEqual(task['i'], 3)
+        self.assertEqual(await queue.inflight_size(), 1)
+        # the receipt never go to another queue
+        self.assertEqual(queue.loads(queue.dumps(task)), {'i': 3})
+        with self.assertRaises(queue.Empty):
+            await queue.get_wait(timeout=0.1)
+        await queue.clear()
+
+        queue = AsyncRedisFairQueue(name='MySpider:fair', loop=self.loop, reliable=True, visibility_timeout=0.2)
+        await queue.conn()
+        await queue.clear()
+        await queue.put_many([{'spider_name': 'a', 'i': 0}, {'spider_name': 'b', 'i': 0}])
+        self.assertEqual(len(await queue.get_many(10)), 2)
+        self.assertEqual(await queue.qsize(), 0)
+        await asyncio.sleep(0.3)
+        self.assertEqual(await queue.requeue_expired(), 2)
+        self.assertEqual(await queue.qsize(), 2)
+        tasks = await queue.get_many(10)
+        self.assertEqual(sorted(t['spider_name'] for t in tasks), ['a', 'b'])
+        await queue.ack(*tasks)
+        self.assertEqual(await queue.inflight_size(), 0)
+        await queue.clear()
+
+    async def test_stream_queue(self):
+        queue = AsyncRedisStreamQueue(name='MySpider:stream', loop=self.loop, priorities=[10, 0], reliable=True,
+                                      visibility_timeout=0.2, consumer='downloader-1')
+        await queue.conn()
+        await queue.clear()
+        await queue.conn()
+        other = AsyncRedisStreamQueue(name='MySpider:stream', loop=self.loop, priorities=[10, 0],
+                                      consumer='downloader-2')
+        await other.conn()
+
+        await queue.put_many([{'i': 0, 'priority': -1}, {'i': 1, 'priority': 5}, {'i': 2, 'priority': 20},
+                              {'i': 3, 'priority': 5}])
+        self.assertEqual(await queue.qsize(), 4)
+        tasks = await queue.get_many(2)
+        self.assertEqual([t['i'] for t in tasks], [2, 1])
+        self.assertEqual(await queue.pending(), {'downloader-1': 2})
+        self.assertEqual(await queue.qsize(), 2)
+
+        # the other consumer is not reliable,nothing it read is pending or left in the streams
+        self.assertEqual([t['i'] for t in await other.get_many(10)], [3, 0])
+        self.assertEqual(await queue.pending(), {'downloader-1': 2})
+        self.assertEqual(sum([await queue.redis_conn.xlen(stream) for stream in queue.streams]), 2)
+        with self.assertRaises(other.Empty):
+            await other.get_many(1)
+
+        await queue.ack(tasks[0])
+        self.assertEqual(await queue.inflight_size(), 1)
+        await asyncio.sleep(0.3)
+        self.assertEqual(await queue.requeue_expired(), 1)
+        self.assertEqual(await queue.inflight_size(), 0)
+        self.assertEqual(await other.get_many(10), [{'i': 1, 'priority': 5}])
+
+        self.loop.call_later(0.1, lambda: self.loop.create_task(queue.put({'i': 4})))
+        self.assertEqual(await other.get_wait(timeout=5), {'i': 4})
+        self.assertEqual(await queue.qsize(), 0)
+        await queue.clear()
+
+    async def test_local_queue(self):
+        queue = AsyncLocalPriorityQueue(name='MySpider:local', loop=self.loop, queue_maxsize=4)
+        tasks = [Task(i=i, priority=p) for i, p in enumerate([0, 5, 5, 20])]
+        await queue.put_many(tasks)
+        await queue.put((10, {'i': 4}), block=False)
+        self.assertEqual(await queue.qsize(), 5)
+
+        popped = await queue.get_many(3)
+        self.assertEqual([t['i'] for t in popped], [3, 4, 1])
+        # never serialized
+        self.assertIs(popped[0], tasks[3])
+
+        await queue.put_many([Task(i=5, priority=5), Task(i=6, priority=1)], block=False)
+        # wait until the size fall to the low watermark(3)
+        producer = self.loop.create_task(queue.put(Task(i=7, priority=5)))
+        await asyncio.sleep(0.1)
+        self.assertFalse(producer.done())
+        await queue.get()
+        await asyncio.wait_for(producer, 1)
+        # FIFO in the same priority
+        self.assertEqual([t['i'] for t in await queue.get_many(10)], [5, 7, 6, 0])
+        with self.assertRaises(queue.Empty):
+            await queue.get_many(1)
+
+        self.loop.call_later(0.1, lambda: self.loop.create_task(queue.put(Task(i=8, priority=0))))
+        self.assertEqual((await queue.get_wait(timeout=5))['i'], 8)
+        with self.assertRaises(queue.Empty):
+            await queue.get_wait(timeout=0.1)
+
+    async def test_aging(self):
+        queue = AsyncRedisPriorityQueue(name='MySpider:aging', loop=self.loop, aging_rate=10, age_stats=True)
+        await queue.conn()
+        await queue.clear()
+        await queue.put({'test': 'old', 'priority': 0})
+        await asyncio.sleep(0.3)
+        # 0.3s gained 3 priority
+        await queue.put({'test': 'new', 'priority': 2})
+        await queue.put({'test': 'urgent', 'priority': 5})
+
+        self.assertEqual([i['test'] for i in await queue.get_many(3)], ['urgent', 'old', 'new'])
+        age = queue.queue_age()
+        self.assertEqual(age['count'], 3)
+        self.assertGreaterEqual(age['max'], 0.3)
+        self.assertLess(age['p50'], 0.3)
+        await queue.clear()
+
+    async def test_delay_queue(self):
+        queue = AsyncRedisDelayQueue(name='MySpider:retry', loop=self.loop)
+        await queue.conn()
+        await queue.clear()
+        await queue.put_many([(0, {'test': 'testing1'}), (100, {'test': 'testing2'})])
+        await queue.put((0.2, {'test': 'testing3'}))
+
+        self.assertEqual(await queue.get_many(10), [{'test': 'testing1'}])
+        with self.assertRaises(queue.Empty):
+            await queue.get()
+
+        await asyncio.sleep(0.3)
+        self.assertEqual(await queue.get_many(10), [{'test': 'testing3'}])
+        self.assertEqual(await queue.qsize(), 1)
+
+        await queue.put((0.2, {'test': 'testing4'}))
+        self.assertEqual(await queue.get_wait(timeout=1), {'test': 'testing4'})
+        with self.assertRaises(queue.Empty):
+            await queue.get_wait(timeout=0.1)
+        await queue.clear()
+
+    async def test_fair_queue(self):
+        queue = AsyncRedisFairQueue(name='MySpider:fair', loop=self.loop, quantum=2)
+        await queue.conn()
+        await queue.clear()
+        await queue.set_weight('heavy', 2)
+        # the backlog of heavy has higher priority,but it can't starve light
+        await queue.put_many([{'spider_name': 'heavy', 'i': i, 'priority': 10} for i in range(100)])
+        await queue.put_many([{'spider_name': 'light', 'i': i, 'priority': i} for i in range(10)])
+        self.assertEqual(await queue.qsize(), 110)
+
+        tasks = await queue.get_many(30)
+        self.assertEqual(len([t for t in tasks if t['spider_name'] == 'heavy']), 20)
+        self.assertEqual([t['i'] for t in tasks if t['spider_name'] == 'light'], list(range(9, -1, -1)))
+
+        # light is empty,heavy get all
+        tasks = await queue.get_many(100)
+        self.assertEqual(len(tasks), 80)
+        self.assertEqual(await queue.popped_counts(), {'heavy': 100, 'light': 10})
+        with self.assertRaises(queue.Empty):
+            await queue.get_many(1)
+
+        self.loop.call_later(0.1, lambda: self.loop.create_task(queue.put({'spider_name': 'light', 'i': 0})))
+        self.assertEqual(await queue.get_wait(timeout=5), {'spider_name': 'light', 'i': 0})
+        with self.assertRaises(ValueError):
+            await queue.set_weight('light', 0)
+        await queue.clear()
+
 
 if __name__ == '__main__':
     asynctest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+# Author: Vincent<vincent8280@outlook.com>
+#         http://blog.vincentzhong.cn
+# Created on 2017/10/16 10:12
+import hashlib
+import unittest
+
+import catty.config
+from catty.libs.bloom_filter import Hash, ConsistentHashRing
+from catty.libs.utils import md5string
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.size = 1 << 29
+        self.seeds = catty.config.SPIDER_DEFAULT['SEEDS']
+        self.tids = [md5string(str(i)) for i in range(10000)]
+
+    def test_version_1_unchanged(self):
+        hashfunc = Hash(self.size, self.seeds, version=1)
+        tid = self.tids[0]
+        expected = [int(hashlib.md5(seed.encode('utf-8') + tid.encode('utf-8')).hexdigest(), 16) % self.size
+                    for seed in self.seeds]
+        self.assertEqual(hashfunc.hash(tid), expected)
+
+    def test_version_2(self):
+        hashfunc = Hash(self.size, self.seeds, version=2)
+        loc = hashfunc.hash(self.tids[0])
+        self.assertEqual(len(loc), len(self.seeds))
+        self.assertEqual(len(set(loc)), len(self.seeds))
+        self.assertTrue(all(0 <= i < self.size for i in loc))
+        self.assertEqual(loc, Hash(self.size, self.seeds, version=2).hash(self.tids[0]))
+        self.assertNotEqual(loc, Hash(self.size, ['OTHER'] * 10, version=2).hash(self.tids[0]))
+
+    def test_block(self):
+        tid = self.tids[0]
+        for version in (1, 2):
+            self.assertEqual(Hash(self.size, self.seeds, version=version).block(tid, 7), int(tid, 16) % 7)
+        hashfunc = Hash(self.size, self.seeds, version=3)
+        self.assertEqual(hashfunc.hash(tid), Hash(self.size, self.seeds, version=2).hash(tid))
+        counts = [0] * 8
+        for tid in self.tids:
+            counts[hashfunc.block(tid, 8)] += 1
+        self.assertLess(max(counts) - min(counts), len(self.tids) / 8 * 0.2)
+
+    def test_consistent_hash_ring(self):
+        nodes = [('127.0.0.1', 6379 + i, 0) for i in range(4)]
+        ring = ConsistentHashRing(nodes)
+        keys = ['Test:{}'.format(i) for i in range(1000)]
+        mapping = {key: ring.get_node(key) for key in keys}
+        self.assertEqual(set(mapping.values()), set(nodes))
+        self.assertEqual(mapping, {key: ConsistentHashRing(nodes).get_node(key) for key in keys})
+
+        # only the keys on the removed node move
+        smaller = ConsistentHashRing(nodes[:3])
+        moved = [key for key in keys if smaller.get_node(key) != mapping[key]]
+        self.assertTrue(all(mapping[key] == nodes[3] for key in moved))
+
+
+if __name__ == '__main__':
+    unittest.main()
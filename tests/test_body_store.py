@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+# Author: Vincent<vincent8280@outlook.com>
+#         http://blog.vincentzhong.cn
+# Created on 2017/10/15 15:21
+import os
+import shutil
+import tempfile
+import time
+
+import asynctest
+
+from catty.libs import body_store
+from catty.libs.body_store import FileBodyStore, RedisBodyStore
+from catty.libs.response import Response
+from catty.libs.serializer import MsgpackSerializer
+from catty.libs.utils import Task
+
+
+class Test(asynctest.TestCase):
+    use_default_loop = True
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = FileBodyStore(self.root)
+        body_store._stores['file'] = self.store
+
+    def tearDown(self):
+        body_store._stores.pop('file', None)
+        shutil.rmtree(self.root)
+
+    async def test_dedupe(self):
+        ref1 = await self.store.put(b'hello world')
+        ref2 = await self.store.put(b'hello world')
+        self.assertEqual(ref1, ref2)
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(self.root)), 1)
+        self.assertEqual(await self.store.get(ref1.split(':', 1)[1]), b'hello world')
+
+    async def test_lazy_body(self):
+        response = Response(status=200, body=b'<html>hello</html>')
+        await response.offload_body(self.store)
+        self.assertIsNone(response._body)
+        self.assertTrue(response.body_ref.startswith('file:'))
+
+        task = Task(priority=0, response=response)
+        loaded = MsgpackSerializer().loads(MsgpackSerializer().dumps(task))['response']
+        self.assertIsNone(loaded.body)
+        await loaded.load_body()
+        self.assertEqual(loaded.body, b'<html>hello</html>')
+
+    async def test_clean_expired(self):
+        store = FileBodyStore(self.root, ttl=60)
+        old_key = (await store.put(b'old')).split(':', 1)[1]
+        new_key = (await store.put(b'new')).split(':', 1)[1]
+        os.utime(store.path(old_key), (time.time() - 120, time.time() - 120))
+        self.assertEqual(store.clean_expired(), 1)
+        self.assertFalse(os.path.exists(store.path(old_key)))
+        self.assertEqual(await store.get(new_key), b'new')
+
+    async def test_release_unread_body(self):
+        store = RedisBodyStore('Catty:TestBody', self.loop)
+        body_store._stores['redis'] = store
+        try:
+            response = Response(status=404, body=b'not found')
+            await response.offload_body(store)
+            await response.release_body()
+            self.assertEqual(response.body_ref, '')
+            self.assertEqual(await store.redis_conn.hlen('Catty:TestBody'), 0)
+            self.assertEqual(await store.redis_conn.hlen('Catty:TestBody:refs'), 0)
+        finally:
+            body_store._stores.pop('redis', None)
+
+    async def test_release_after_load(self):
+        store = RedisBodyStore('Catty:TestBody', self.loop)
+        body_store._stores['redis'] = store
+        try:
+            response = Response(status=200, body=b'<html>hello</html>')
+            await response.offload_body(store)
+            # kept until the task is acked,a redelivered task can load it again
+            await response.load_body()
+            self.assertEqual(await store.get(response.body_ref.split(':', 1)[1]), b'<html>hello</html>')
+
+            # a dumped task hold the body itself
+            detached = await response.detach_body()
+            self.assertEqual((detached.body, detached.body_ref), (b'<html>hello</html>', ''))
+
+            await response.release_body()
+            self.assertEqual(await store.redis_conn.hlen('Catty:TestBody'), 0)
+        finally:
+            body_store._stores.pop('redis', None)
+
+
+if __name__ == '__main__':
+    asynctest.main()
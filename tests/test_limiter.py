@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+# Author: Vincent<vincent8280@outlook.com>
+#         http://blog.vincentzhong.cn
+# Created on 2017/10/19 17:02
+import asyncio
+
+import asynctest
+
+from catty.libs.limiter import TokenBucket, HostLimiter
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Test(asynctest.TestCase):
+    use_default_loop = True
+
+    def test_token_bucket(self):
+        clock = Clock()
+        bucket = TokenBucket(2, clock=clock)
+        self.assertEqual([bucket.consume(), bucket.consume()], [0, 0])
+        self.assertEqual(bucket.consume(), 0.5)
+        clock.now += 0.5
+        self.assertEqual(bucket.consume(), 0)
+        self.assertEqual(TokenBucket(0).consume(), 0)
+
+    def test_rebalance(self):
+        clock = Clock()
+        limiter = HostLimiter(self.loop, host_rate=10, global_rate=12, host_limits={'c.com': {'rate': 1}},
+                              clock=clock)
+        limiter.try_acquire('a.com')
+        self.assertEqual(limiter.stats()['a.com']['rate'], 10)
+        limiter.try_acquire('b.com')
+        limiter.try_acquire('c.com')
+        self.assertEqual({host: s['rate'] for host, s in limiter.stats().items()},
+                         {'a.com': 4, 'b.com': 4, 'c.com': 1})
+
+        # b.com & c.com are idle,a.com take their budget
+        limiter.release('b.com')
+        limiter.release('c.com')
+        clock.now += 10
+        limiter.try_acquire('a.com')
+        self.assertEqual(limiter.stats(), {'a.com': {'rate': 10, 'in_flight': 2, 'waiting': 0}})
+
+    def test_rebalance_replaced_host(self):
+        clock = Clock()
+        limiter = HostLimiter(self.loop, global_rate=10, clock=clock)
+        limiter.try_acquire('a.com')
+        limiter.try_acquire('b.com')
+        limiter.release('b.com')
+        clock.now += 10
+        # b.com is forgotten & c.com is added in one call,the number of hosts doesn't change
+        limiter.try_acquire('c.com')
+        self.assertEqual({host: s['rate'] for host, s in limiter.stats().items()}, {'a.com': 5, 'c.com': 5})
+
+    async def test_concurrency(self):
+        limiter = HostLimiter(self.loop, host_concurrency=2)
+        running = []
+
+        async def request(host):
+            await limiter.acquire(host)
+            running.append(host)
+            self.assertLessEqual(running.count(host), 2)
+            await asyncio.sleep(0.05)
+            running.remove(host)
+            limiter.release(host)
+
+        await asyncio.gather(*[request(host) for host in ['a.com'] * 6 + ['b.com'] * 2])
+        self.assertEqual(limiter.stats()['a.com']['in_flight'], 0)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+# Author: Vincent<vincent8280@outlook.com>
+#         http://blog.vincentzhong.cn
+# Created on 2017/10/18 15:21
+import os
+import shutil
+import tempfile
+
+import asynctest
+
+import catty.libs.bloom_filter
+from catty.libs.bloom_filter import MmapBloomFilter
+from catty.libs.utils import md5string
+
+
+class Test(asynctest.TestCase):
+    use_default_loop = True
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'bloomfilter', 'Test')
+        self.tids = [md5string(str(i)) for i in range(1000)]
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    async def test_add(self):
+        bloomfilter = MmapBloomFilter(self.loop, 'Test', capacity=10000, path=self.path)
+        await bloomfilter.conn()
+        self.assertEqual(await bloomfilter.add_if_absent(self.tids[0]), True)
+        self.assertEqual(await bloomfilter.add_if_absent(self.tids[0]), False)
+        self.assertEqual(await bloomfilter.is_contain(self.tids[0]), True)
+        self.assertEqual(await bloomfilter.is_contain(self.tids[1]), False)
+
+        is_new = await bloomfilter.add_many(self.tids + self.tids[:1])
+        self.assertEqual(is_new[0], False)
+        self.assertEqual(is_new[-1], False)
+        self.assertEqual(sum(is_new), 999)
+        bloomfilter.close()
+
+        # reopen the file,the parameters in the file are used
+        bloomfilter = MmapBloomFilter(self.loop, 'Test', capacity=1, path=self.path)
+        await bloomfilter.conn()
+        self.assertEqual(await bloomfilter.add_many(self.tids), [False] * 1000)
+
+        await bloomfilter.clean()
+        self.assertEqual(await bloomfilter.is_contain(self.tids[0]), False)
+        bloomfilter.close()
+
+    async def test_without_numpy(self):
+        numpy = catty.libs.bloom_filter.numpy
+        catty.libs.bloom_filter.numpy = None
+        try:
+            bloomfilter = MmapBloomFilter(self.loop, 'Test', capacity=10000, path=self.path)
+            await bloomfilter.conn()
+            self.assertEqual(await bloomfilter.add_many(self.tids[:2] + self.tids[:1]), [True, True, False])
+            bloomfilter.close()
+        finally:
+            catty.libs.bloom_filter.numpy = numpy
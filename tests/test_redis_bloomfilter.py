@@ -6,7 +6,8 @@
 # Created on 2017/4/18 13:38
 
 import asynctest
-from catty.libs.bloom_filter import RedisBloomFilter
+from catty.libs.bloom_filter import RedisBloomFilter, ScalableRedisBloomFilter, TimeWindowBloomFilter
+from catty.libs.utils import md5string
 
 
 class Test(asynctest.TestCase):
@@ -39,3 +40,105 @@ class Test(asynctest.TestCase):
         self.assertEqual(await self.redis_bloomfilter.is_contain('new_world'), False)
         self.assertEqual(await self.redis_bloomfilter.is_contain('hi'), False)
         self.assertEqual(await self.redis_bloomfilter.is_contain('not not'), False)
+
+    async def test_add_if_absent(self):
+        await self.redis_bloomfilter.conn()
+        await self.redis_bloomfilter.clean()
+        tid = md5string('add_if_absent')
+        self.assertEqual(await self.redis_bloomfilter.add_if_absent(tid), True)
+        self.assertEqual(await self.redis_bloomfilter.add_if_absent(tid), False)
+        self.assertEqual(await self.redis_bloomfilter.is_contain(tid), True)
+
+    async def test_add_many(self):
+        await self.redis_bloomfilter.conn()
+        await self.redis_bloomfilter.clean()
+        tids = [md5string(i) for i in ('a', 'b', 'a', 'c')]
+        self.assertEqual(await self.redis_bloomfilter.add_many(tids), [True, True, False, True])
+        self.assertEqual(await self.redis_bloomfilter.add_many(tids[:2] + [md5string('d')]), [False, False, True])
+
+    async def test_local_cache(self):
+        bloomfilter = RedisBloomFilter(loop=self.loop, key="TestLocalCache", seeds=[b"HELLO", b"WORLD"],
+                                       local_cache_size=2)
+        await bloomfilter.conn()
+        await bloomfilter.clean()
+        tid = md5string('local_cache')
+        self.assertEqual(await bloomfilter.add_if_absent(tid), True)
+        self.assertEqual(await bloomfilter.add_if_absent(tid), False)
+        self.assertEqual(bloomfilter.local_cache.stats()['hits'], 1)
+
+        await bloomfilter.clean()
+        self.assertEqual(len(bloomfilter.local_cache), 0)
+        self.assertEqual(await bloomfilter.add_if_absent(tid), True)
+
+    async def test_scalable(self):
+        bloomfilter = ScalableRedisBloomFilter(loop=self.loop, key="TestScalable", capacity=100, error_rate=0.001)
+        await bloomfilter.conn()
+        await bloomfilter.clean()
+        tids = [md5string(str(i)) for i in range(1000)]
+        is_new = await bloomfilter.add_many(tids)
+        self.assertGreater(sum(is_new), 990)
+        self.assertEqual(await bloomfilter.add_many(tids), [False] * 1000)
+        self.assertEqual(await bloomfilter.is_contain(tids[0]), True)
+
+        info = await bloomfilter.info()
+        self.assertGreater(info['slices'], 1)
+        self.assertGreaterEqual(info['capacity'], info['items'])
+        self.assertLess(info['estimated_fpr'], 0.001)
+        self.assertGreater(info['memory'], 0)
+
+    async def test_nodes(self):
+        nodes = [('localhost', 6379, 0), ('localhost', 6379, 1)]
+        bloomfilter = RedisBloomFilter(loop=self.loop, key="TestNodes", seeds=[b"HELLO", b"WORLD"], blockNum=8,
+                                       hash_version=3, nodes=nodes)
+        await bloomfilter.conn()
+        await bloomfilter.clean()
+        tids = [md5string(str(i)) for i in range(100)]
+        self.assertEqual(await bloomfilter.add_many(tids), [True] * 100)
+        self.assertEqual(await bloomfilter.add_many(tids), [False] * 100)
+        self.assertEqual(await bloomfilter.is_contain(tids[0]), True)
+        self.assertEqual(await bloomfilter.add_if_absent(tids[1]), False)
+
+        used = {bloomfilter.ring.get_node(bloomfilter._locate(tid)[0]) for tid in tids}
+        self.assertEqual(used, set(nodes))
+
+    async def test_nodes_changed(self):
+        old_nodes = [('localhost', 6379, 0), ('localhost', 6379, 1)]
+        new_nodes = [('localhost', 6379, 0), ('localhost', 6379, 1), ('localhost', 6379, 2)]
+        bloomfilter = RedisBloomFilter(loop=self.loop, key="TestNodesChanged", seeds=[b"HELLO", b"WORLD"],
+                                       blockNum=8, hash_version=3, nodes=old_nodes)
+        await bloomfilter.clean()
+        await bloomfilter.conn()
+        tids = [md5string(str(i)) for i in range(100)]
+        await bloomfilter.add_many(tids)
+
+        bloomfilter = RedisBloomFilter(loop=self.loop, key="TestNodesChanged", seeds=[b"HELLO", b"WORLD"],
+                                       blockNum=8, hash_version=3, nodes=new_nodes)
+        with self.assertRaises(ValueError):
+            await bloomfilter.conn()
+
+        await bloomfilter.migrate_nodes(old_nodes)
+        await bloomfilter.conn()
+        used = {bloomfilter.ring.get_node(bloomfilter._locate(tid)[0]) for tid in tids}
+        self.assertEqual(used, set(new_nodes))
+        self.assertEqual(await bloomfilter.add_many(tids), [False] * 100)
+        await bloomfilter.clean()
+
+    async def test_time_window(self):
+        now = [1000.0]
+        bloomfilter = TimeWindowBloomFilter(loop=self.loop, key="TestTimeWindow", window=100, generations=4,
+                                            capacity=1000, clock=lambda: now[0])
+        await bloomfilter.conn()
+        await bloomfilter.clean()
+        tids = [md5string(str(i)) for i in range(10)]
+        self.assertEqual(await bloomfilter.add_many(tids), [True] * 10)
+
+        now[0] += 99
+        self.assertEqual(await bloomfilter.add_many(tids), [False] * 10)
+        self.assertEqual(await bloomfilter.is_contain(tids[0]), True)
+
+        # out of the window
+        now[0] += 30
+        self.assertEqual(await bloomfilter.is_contain(tids[0]), False)
+        self.assertEqual(await bloomfilter.add_if_absent(tids[0]), True)
+        self.assertEqual(await bloomfilter.add_if_absent(tids[0]), False)
+        self.assertGreater(await bloomfilter.redis_conn.ttl(bloomfilter.generation_keys()[0]), 100)
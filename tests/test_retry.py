@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+# Author: Vincent<vincent8280@outlook.com>
+#         http://blog.vincentzhong.cn
+# Created on 2017/10/19 11:20
+import time
+import unittest
+from email.utils import formatdate
+
+from catty.libs.retry import RetryPolicy, EXCEPTION_STATUS
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.meta = {'retry': 3, 'retry_wait': 1}
+        self.policy = RetryPolicy({
+            'default': {'factor': 2, 'max_delay': 3},
+            'TimeoutError': {'base': 5},
+            'exception': {'base': 2, 'jitter': 0.5},
+            '404': {'retry': 0},
+            '5xx': {'base': 10, 'retry': 1},
+        })
+
+    def test_match(self):
+        self.assertEqual(self.policy.match(EXCEPTION_STATUS, 'TimeoutError'), {'base': 5})
+        self.assertEqual(self.policy.match(EXCEPTION_STATUS, 'ClientOSError')['base'], 2)
+        self.assertEqual(self.policy.match(404), {'retry': 0})
+        self.assertEqual(self.policy.match(503)['base'], 10)
+        self.assertEqual(self.policy.match(429)['max_delay'], 3)
+
+    def test_backoff(self):
+        self.assertEqual([self.policy.delay(self.meta, i, 429) for i in range(4)], [1, 2, 3, None])
+        self.assertEqual(self.policy.delay(self.meta, 0, 404), None)
+        self.assertEqual(self.policy.delay(self.meta, 0, 500), 10)
+        self.assertEqual(self.policy.delay(self.meta, 1, 500), None)
+        for i in range(100):
+            self.assertTrue(1 <= self.policy.delay(self.meta, 0, EXCEPTION_STATUS, 'ClientOSError') <= 2)
+
+    def test_retry_after(self):
+        self.assertEqual(self.policy.delay(self.meta, 0, 429, headers=((b'Retry-After', b'120'),)), 120)
+        delay = self.policy.delay(self.meta, 0, 503, headers=[['retry-after', formatdate(time.time() + 60)]])
+        self.assertTrue(55 < delay <= 60)
+        self.assertEqual(self.policy.delay(self.meta, 0, 429, headers=((b'Retry-After', b'soon'),)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,8 +9,10 @@ import asyncio
 
 import asynctest
 
+import catty.config
 from catty.message_queue import AsyncRedisPriorityQueue
-from catty.scheduler import Scheduler
+from catty.scheduler import Scheduler, Selector
+from tests.test_limiter import Clock
 
 
 class TestAsyncScheduler(asynctest.TestCase):
@@ -121,6 +123,53 @@ class TestAsyncScheduler(asynctest.TestCase):
         task = await spider_requests_q.get()
         self.assertEqual(task['request']['url'], 'http://www.next_page.com')
 
+
+class TestSelector(asynctest.TestCase):
+    use_default_loop = True
+
+    async def setUp(self):
+        self.scheduler_downloader_queue = AsyncRedisPriorityQueue('Catty:SD', loop=self.loop)
+        await self.scheduler_downloader_queue.conn()
+        await self.scheduler_downloader_queue.clear()
+        self.requests_queue = {}
+        for spider_name in ('slow', 'fast'):
+            q = self.requests_queue[spider_name + ':requests'] = AsyncRedisPriorityQueue(
+                spider_name + ':requests', loop=self.loop)
+            await q.conn()
+            await q.clear()
+            await q.put_many([{'tid': str(i), 'spider_name': spider_name, 'priority': 0} for i in range(3000)])
+
+    async def tearDown(self):
+        await self.scheduler_downloader_queue.clear()
+        for q in self.requests_queue.values():
+            await q.clear()
+
+    async def wait_selected(self, selector):
+        """Let the selector tick a few times & move all the tokens it took"""
+        await asyncio.sleep(catty.config.SELECTOR_TICK * 5)
+        while selector.selecting:
+            await asyncio.sleep(catty.config.SELECTOR_TICK)
+
+    async def test_select_task(self):
+        clock = Clock()
+        selector = Selector({'slow': 0.5, 'fast': 1000}, self.scheduler_downloader_queue, self.requests_queue,
+                            set(), set(), {'slow', 'fast'}, set(), set(), self.loop, clock=clock)
+        task = self.loop.create_task(selector.select_task())
+
+        # the buckets are full at the beginning,and never refilled while the clock stop
+        await self.wait_selected(selector)
+        self.assertEqual(selector.emitted, {'slow': 1, 'fast': selector._capacity(1000)})
+
+        # the buckets hold at most their capacity
+        clock.now += 2
+        await self.wait_selected(selector)
+        task.cancel()
+        self.assertEqual(selector.emitted, {'slow': 2, 'fast': selector._capacity(1000) * 2})
+        self.assertEqual(await self.scheduler_downloader_queue.qsize(), sum(selector.emitted.values()))
+
+        selector.update_speed('slow', 2)
+        self.assertEqual(selector.speed_stats()['slow']['target'], 2)
+
 if __name__ == '__main__':
     loop = asyncio.get_event_loop()
 
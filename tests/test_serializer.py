@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+# Author: Vincent<vincent8280@outlook.com>
+#         http://blog.vincentzhong.cn
+# Created on 2017/10/14 15:02
+import pickle
+import unittest
+from http.cookies import SimpleCookie
+
+from catty.libs.request import Request
+from catty.libs.response import Response
+from catty.libs.serializer import MsgpackSerializer, PickleSerializer, MAGIC
+from catty.libs.tasker import Tasker
+
+
+def make_task():
+    task = Tasker.make_task({
+        'spider_name': 'mock_spider',
+        'callback': [{'parser': 'parser_list_page', 'fetcher': ['get_list', 'get_content']}],
+        'request': Request(url='http://applehater.cn/', headers={'User-Agent': 'Catty'}, params={'a': '1'}),
+        'meta': {'retry': 3, 'retry_wait': 3, 'dupe_filter': True},
+        'priority': 2,
+    })
+    cookies = SimpleCookie()
+    cookies.load('session=abc; Path=/')
+    task['response'] = Response(
+        status=200, method='GET', use_time=0.12, url='http://applehater.cn/', body=b'<html>hello</html>',
+        cookies=cookies, charset='utf-8', content_type='text/html',
+        headers=((b'Content-Type', b'text/html'), (b'Set-Cookie', b'session=abc; Path=/'))
+    )
+    task['parser'] = {'item': {'article_url': ['http://applehater.cn/1'], 'next_page_url': None}}
+    task['retried'] = 1
+    return task
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.serializer = MsgpackSerializer()
+
+    def test_task(self):
+        task = make_task()
+        data = self.serializer.dumps(task)
+        self.assertTrue(data.startswith(MAGIC))
+
+        loaded = self.serializer.loads(data)
+        self.assertEqual(dict(loaded, request=None, response=None), dict(task, request=None, response=None))
+        self.assertEqual(loaded['request'].dump_request(), task['request'].dump_request())
+        self.assertEqual(loaded['response'].headers, task['response'].headers)
+        self.assertEqual(loaded['response'].body, task['response'].body)
+        self.assertEqual(loaded['response'].cookies['session'].value, 'abc')
+
+    def test_fall_back_to_pickle(self):
+        task = make_task()
+        task['meta']['tuple'] = (1, 2)
+        data = self.serializer.dumps(task)
+        self.assertFalse(data.startswith(MAGIC))
+        self.assertEqual(self.serializer.loads(data)['meta']['tuple'], (1, 2))
+
+        self.assertEqual(self.serializer.loads(pickle.dumps({'test': 'testing1'})), {'test': 'testing1'})
+        self.assertEqual(PickleSerializer().loads(self.serializer.dumps({'test': 'testing1'})), {'test': 'testing1'})
+
+
+if __name__ == '__main__':
+    unittest.main()